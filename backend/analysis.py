@@ -0,0 +1,190 @@
+import math
+import os
+
+import cv2
+import numpy as np
+
+# Exposure and sharpness are measured on a copy whose longest side is at
+# most ANALYSIS_MAX_SIDE. Noise is measured on full-resolution patches
+# instead, because downscaling averages it away.
+ANALYSIS_MAX_SIDE = 512
+NOISE_PATCH_SIDE = 256
+NOISE_PATCH_GRID = 3  # patches per side, centred in a 3x3 grid
+# Fraction of the strongest gradients left out of the noise estimate: the
+# estimator reads edges and texture as noise
+NOISE_EDGE_FRACTION = 0.1
+
+# Decision thresholds. Noise is the estimated standard deviation of luma in
+# 8-bit levels: below about 4, NLM removes more detail than noise. Sharpness
+# is the Laplacian variance at the analysis size, normalised to full range.
+AUTO_NOISE_THRESHOLD = float(os.getenv("AUTO_NOISE_THRESHOLD", 4.0))
+AUTO_SHARPNESS_THRESHOLD = float(os.getenv("AUTO_SHARPNESS_THRESHOLD", 200))
+# NLM strength per unit of noise, and its bounds. 0.7 gave the best PSNR
+# against clean references; the old fixed h=10 over-smoothed all of them.
+DENOISE_STRENGTH_PER_SIGMA = 0.7
+DENOISE_STRENGTH_RANGE = (2, 15)
+# Contrast: the 1st..99th percentile range is stretched towards STRETCH_RANGE
+# when narrower than STRETCH_MIN_SPAN, with a gain of at most STRETCH_MAX_GAIN
+STRETCH_RANGE = (8, 247)
+STRETCH_MIN_SPAN = 200
+STRETCH_MAX_GAIN = 1.5
+# Brightness: mean luma outside EXPOSURE_RANGE is moved half way towards
+# TARGET_MEAN, so low-key and high-key scenes keep their character
+EXPOSURE_RANGE = (90, 180)
+TARGET_MEAN = 118
+BRIGHTNESS_RANGE = (-20, 30)
+
+# Immerkaer's noise estimation mask: the difference of two Laplacians,
+# which cancels out smooth image structure
+_NOISE_KERNEL = np.array([[1, -2, 1], [-2, 4, -2], [1, -2, 1]], dtype=np.float32)
+
+
+def _gray(image):
+    return image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+
+def analysis_copy(image, max_side: int = ANALYSIS_MAX_SIDE):
+    # Shrink by a whole factor: INTER_AREA is several times faster on exact multiples
+    h, w = image.shape[:2]
+    factor = math.ceil(max(h, w) / max_side)
+    if factor > 1:
+        image = cv2.resize(image[:h // factor * factor, :w // factor * factor], (w // factor, h // factor),
+                           interpolation=cv2.INTER_AREA)
+    return _gray(image)
+
+
+def noise_patches(image, side: int = NOISE_PATCH_SIDE, grid: int = NOISE_PATCH_GRID):
+    h, w = image.shape[:2]
+    if h <= side * grid and w <= side * grid:
+        return [_gray(image)]
+    patches = []
+    for row in range(grid):
+        for col in range(grid):
+            y = max(0, min(h - side, (2 * row + 1) * h // (2 * grid) - side // 2))
+            x = max(0, min(w - side, (2 * col + 1) * w // (2 * grid) - side // 2))
+            patches.append(_gray(image[y:y + side, x:x + side]))
+    return patches
+
+
+def estimate_noise(gray):
+    """Standard deviation of Gaussian noise in a grayscale image (Immerkaer, 1996).
+
+    sigma = sqrt(pi / 2) * mean(|gray * N|) / 6 over pixels away from edges.
+    """
+    if min(gray.shape) < 3:
+        return 0.0
+    gray = gray.astype(np.float32)
+    response = np.abs(cv2.filter2D(gray, -1, _NOISE_KERNEL)[1:-1, 1:-1])
+    gx = cv2.Sobel(gray, cv2.CV_32F, 1, 0)[1:-1, 1:-1]
+    gy = cv2.Sobel(gray, cv2.CV_32F, 0, 1)[1:-1, 1:-1]
+    gradient = np.abs(gx) + np.abs(gy)
+    flat = gradient <= np.quantile(gradient, 1 - NOISE_EDGE_FRACTION)
+    return float(math.sqrt(math.pi / 2) * response[flat].mean() / 6)
+
+
+def exposure_stats(gray):
+    # -> (mean, 1st percentile, 99th percentile) of luma, from the histogram
+    hist = np.bincount(gray.ravel(), minlength=256)
+    cdf = np.cumsum(hist)
+    low = int(np.searchsorted(cdf, 0.01 * cdf[-1]))
+    high = int(np.searchsorted(cdf, 0.99 * cdf[-1]))
+    mean = float(np.dot(hist, np.arange(256)) / cdf[-1])
+    return mean, low, high
+
+
+def sharpness(gray, low: int = 0, high: int = 255):
+    # Scaled as if the levels spanned the full range, so dim images do not read as soft
+    span = max(high - low, 32)
+    return float(cv2.Laplacian(gray, cv2.CV_32F).var()) * (255 / span) ** 2
+
+
+def analyze(image):
+    """-> {noise, mean, low, high, sharpness} for a BGR or grayscale image."""
+    small = analysis_copy(image)
+    mean, low, high = exposure_stats(small)
+    return {
+        "noise": float(np.median([estimate_noise(patch) for patch in noise_patches(image)])),
+        "mean": mean,
+        "low": low,
+        "high": high,
+        "sharpness": sharpness(small, low, high),
+    }
+
+
+class AutoPlan:
+    """Stages enhance_auto runs for one image and their strengths.
+
+    A stage set to None is skipped: denoise_h is the NLM strength, stretch
+    the (low, high) input levels mapped onto STRETCH_RANGE, brightness the
+    value offset and sharpen the kernel amount.
+    """
+
+    def __init__(self, stats, denoise_h=None, stretch=None, brightness=None, sharpen=None):
+        self.stats = stats
+        self.denoise_h = denoise_h
+        self.stretch = stretch
+        self.brightness = brightness
+        self.sharpen = sharpen
+
+    def describe_stages(self):
+        stages = []
+        if self.denoise_h is not None:
+            stages.append(f"denoise;h={self.denoise_h}")
+        if self.stretch is not None:
+            stages.append(f"contrast;levels={self.stretch[0]}-{self.stretch[1]}")
+        if self.brightness is not None:
+            stages.append(f"brightness;value={self.brightness:+d}")
+        if self.sharpen is not None:
+            stages.append(f"sharpen;amount={self.sharpen}")
+        return ", ".join(stages) or "none"
+
+    def describe_stats(self):
+        stats = self.stats
+        return (
+            f"noise={stats['noise']:.2f}, mean={stats['mean']:.1f}, "
+            f"levels={stats['low']}-{stats['high']}, sharpness={stats['sharpness']:.1f}"
+        )
+
+    def __repr__(self):
+        return f"AutoPlan({self.describe_stages()})"
+
+
+def _stretch_levels(low: int, high: int):
+    # Input levels whose linear map onto STRETCH_RANGE has at most STRETCH_MAX_GAIN
+    out_low, out_high = STRETCH_RANGE
+    span = max(high - low, 1)
+    if span >= STRETCH_MIN_SPAN:
+        return None
+    min_span = round((out_high - out_low) / STRETCH_MAX_GAIN)
+    if span < min_span:
+        # Widen around the middle, kept within 0..255
+        low = min(max(0, round((low + high - min_span) / 2)), 255 - min_span)
+        high = low + min_span
+    return low, high
+
+
+def plan_auto(image, stats=None):
+    stats = stats or analyze(image)
+    denoise_h = None
+    if stats["noise"] > AUTO_NOISE_THRESHOLD:
+        low_h, high_h = DENOISE_STRENGTH_RANGE
+        denoise_h = int(min(high_h, max(low_h, round(stats["noise"] * DENOISE_STRENGTH_PER_SIGMA))))
+
+    stretch = _stretch_levels(stats["low"], stats["high"])
+    mean = stats["mean"]
+    if stretch is not None:
+        # Mean after the stretch, to decide on brightness
+        gain = (STRETCH_RANGE[1] - STRETCH_RANGE[0]) / (stretch[1] - stretch[0])
+        mean = min(255, max(0, STRETCH_RANGE[0] + (mean - stretch[0]) * gain))
+
+    brightness = None
+    if not EXPOSURE_RANGE[0] <= mean <= EXPOSURE_RANGE[1]:
+        brightness = int(min(BRIGHTNESS_RANGE[1], max(BRIGHTNESS_RANGE[0], round((TARGET_MEAN - mean) / 2))))
+
+    sharpen = None
+    if stats["sharpness"] < AUTO_SHARPNESS_THRESHOLD / 4:
+        sharpen = 1.0
+    elif stats["sharpness"] < AUTO_SHARPNESS_THRESHOLD or denoise_h is not None:
+        # Also restores some of the detail NLM smooths away
+        sharpen = 0.5
+    return AutoPlan(stats, denoise_h, stretch, brightness, sharpen)
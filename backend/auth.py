@@ -1,13 +1,19 @@
+import ipaddress
+import os
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from typing import Optional
-from fastapi import Depends, HTTPException, status, APIRouter
+from fastapi import Depends, HTTPException, status, APIRouter, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
-import bcrypt
+from sqlalchemy import event, inspect
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError
-from . import database, models, schemas
+from . import database, models, schemas, metrics, passwords
 import logging
 
 # Set up logging
@@ -19,21 +25,127 @@ SECRET_KEY = "your-secret-key-CHANGE-THIS-IN-PRODUCTION"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Credential cache configuration (a size of 0 disables the cache)
+TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", 1024))
+USER_CACHE_SIZE = int(os.getenv("AUTH_USER_CACHE_SIZE", 1024))
+USER_CACHE_TTL_SECONDS = float(os.getenv("AUTH_USER_CACHE_TTL_SECONDS", 60))
+
+# Reverse proxies whose X-Forwarded-For is believed, as comma-separated
+# addresses or networks (e.g. "127.0.0.1,10.0.0.0/8"); none by default
+TRUSTED_PROXIES = [
+    ipaddress.ip_network(item.strip(), strict=False)
+    for item in os.getenv("TRUSTED_PROXIES", "").split(",") if item.strip()
+]
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token")
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
+# --- Credential Caches ---
+
+class ExpiringLRU:
+    """Bounded LRU mapping whose entries each carry their own expiry time."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data = OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+
+    def get(self, key, now: float = None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= (now or time.time()):
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value, expires_at: float):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return entry[0] if entry is not None else None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+# Verified token -> subject email, until the token's own exp
+token_cache = ExpiringLRU(TOKEN_CACHE_SIZE)
+# ("email", email) and ("id", id) -> detached User, for USER_CACHE_TTL_SECONDS
+user_cache = ExpiringLRU(USER_CACHE_SIZE)
+
+AUTH_CACHE_LOOKUPS = metrics.Counter(
+    "auth_cache_lookups_total", "Credential cache lookups on protected routes", ("cache", "result")
+)
+
+def invalidate_user(user_id: int = None, email: str = None):
+    # Call after changing or deleting a user outside the ORM (e.g. raw SQL)
+    for user in (user_cache.pop(("id", user_id)), user_cache.pop(("email", email))):
+        if user is not None:
+            user_cache.pop(("id", user.id))
+            user_cache.pop(("email", user.email))
+
+def invalidate_token(token: str):
+    # Call to revoke a token before its exp, e.g. on logout
+    token_cache.pop(token)
+
+def clear_auth_caches():
+    token_cache.clear()
+    user_cache.clear()
+
+@event.listens_for(models.User, "after_update")
+@event.listens_for(models.User, "after_delete")
+def _invalidate_changed_user(mapper, connection, target):
+    # ORM writes in this process drop the cached copy; other processes rely on the TTL
+    invalidate_user(user_id=target.id, email=target.email)
+    for old_email in inspect(target).attrs.email.history.deleted:
+        invalidate_user(email=old_email)
+
+def _decode_token(token: str):
+    # -> subject email; signature and exp are only checked on a cache miss
+    email = token_cache.get(token)
+    AUTH_CACHE_LOOKUPS.inc(cache="token", result="hit" if email is not None else "miss")
+    if email is not None:
+        return email
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    email = payload.get("sub")
+    if email is not None and payload.get("exp") is not None:
+        token_cache.put(token, email, float(payload["exp"]))
+    return email
+
+def _cached_user(email: str):
+    user = user_cache.get(("email", email))
+    AUTH_CACHE_LOOKUPS.inc(cache="user", result="hit" if user is not None else "miss")
+    return user
+
+def _fetch_user(db: Session, email: str):
+    # Blocking query; callers on the event loop run it in the threadpool
+    user = db.query(models.User).filter(models.User.email == email).first()
+    if user is not None:
+        # Detach so the cached copy can be shared across sessions and threads
+        db.expunge(user)
+        expires_at = time.time() + USER_CACHE_TTL_SECONDS
+        user_cache.put(("email", email), user, expires_at)
+        user_cache.put(("id", user.id), user, expires_at)
+    return user
+
 def verify_password(plain_password, hashed_password):
-    try:
-        return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
-    except Exception:
-        return False
+    return passwords.verify_password(plain_password, hashed_password)
 
 def get_password_hash(password):
-    pwd_bytes = password.encode('utf-8')
-    salt = bcrypt.gensalt()
-    hashed_password = bcrypt.hashpw(pwd_bytes, salt)
-    return hashed_password.decode('utf-8')
+    return passwords.hash_password(password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -52,26 +164,72 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
+        email: str = _decode_token(token)
         if email is None:
             raise credentials_exception
         token_data = schemas.TokenData(email=email)
     except JWTError:
         raise credentials_exception
     
-    user = db.query(models.User).filter(models.User.email == token_data.email).first()
+    # Cache hits stay on the event loop; only a miss waits for the database
+    user = _cached_user(token_data.email)
+    if user is None:
+        user = await run_in_threadpool(_fetch_user, db, token_data.email)
     if user is None:
         raise credentials_exception
     return user
 
 # --- Routes ---
 
+def _too_many_requests(message: str, retry_after: float):
+    return JSONResponse(
+        status_code=429,
+        content={"success": False, "message": message},
+        headers={"Retry-After": str(max(1, round(retry_after)))}
+    )
+
+def _is_trusted_proxy(address: str):
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in TRUSTED_PROXIES)
+
+def client_address(request: Request):
+    # The peer, unless it is a trusted proxy: then the nearest X-Forwarded-For
+    # hop that is not one, as earlier hops can be set by the client itself
+    address = request.client.host if request.client else None
+    if address is None or not _is_trusted_proxy(address):
+        return address
+    hops = [hop.strip() for hop in ",".join(request.headers.getlist("x-forwarded-for")).split(",") if hop.strip()]
+    for hop in reversed(hops):
+        if not _is_trusted_proxy(hop):
+            return hop
+    return hops[0] if hops else address
+
+def _get_user_by_email(db: Session, email: str):
+    return db.query(models.User).filter(models.User.email == email).first()
+
+def _commit_user(db: Session, db_user: models.User):
+    db.add(db_user)
+    try:
+        db.commit()
+        db.refresh(db_user)
+    except Exception:
+        db.rollback()
+        raise
+
+# register and login are async so that waiting for bcrypt holds neither a
+# request thread nor the event loop; database calls go to the threadpool.
+
 @router.post("/register")
-def register(user: schemas.UserCreate, db: Session = Depends(database.get_db)):
+async def register(user: schemas.UserCreate, request: Request, db: Session = Depends(database.get_db)):
+    retry_after = passwords.register_rate_limiter.check(client_address(request))
+    if retry_after:
+        return _too_many_requests("Too many attempts, try again later", retry_after)
     try:
         # Check if email exists
-        db_user = db.query(models.User).filter(models.User.email == user.email).first()
+        db_user = await run_in_threadpool(_get_user_by_email, db, user.email)
         if db_user:
             return JSONResponse(
                 status_code=409,  # Conflict
@@ -79,25 +237,21 @@ def register(user: schemas.UserCreate, db: Session = Depends(database.get_db)):
             )
         
         # Create new user
-        hashed_password = get_password_hash(user.password)
+        hashed_password = await passwords.hash_password_async(user.password)
         new_user = models.User(
             email=user.email,
             name=user.name,
             hashed_password=hashed_password
         )
-        db.add(new_user)
-        try:
-            db.commit()
-            db.refresh(new_user)
-        except Exception:
-            db.rollback()
-            raise
+        await run_in_threadpool(_commit_user, db, new_user)
 
         return JSONResponse(
             status_code=201,  # Created
             content={"success": True, "message": "Account created successfully"}
         )
 
+    except passwords.HashQueueFullError as e:
+        return _too_many_requests(str(e), 5)
     except ValueError as ve:
         # Pydantic validation error (manually raised if any)
         return JSONResponse(
@@ -118,17 +272,29 @@ def register(user: schemas.UserCreate, db: Session = Depends(database.get_db)):
         )
 
 @router.post("/login")
-def login(user: schemas.UserLogin, db: Session = Depends(database.get_db)):
+async def login(user: schemas.UserLogin, request: Request, db: Session = Depends(database.get_db)):
+    # Per account and address, so users behind one proxy or NAT do not share a budget
+    retry_after = passwords.login_rate_limiter.check((client_address(request), user.email.strip().lower()))
+    if retry_after:
+        return _too_many_requests("Too many attempts, try again later", retry_after)
     try:
         # Check if user exists
-        db_user = db.query(models.User).filter(models.User.email == user.email).first()
+        db_user = await run_in_threadpool(_get_user_by_email, db, user.email)
         
         # Verify password (safely handle user not found)
-        if not db_user or not verify_password(user.password, db_user.hashed_password):
+        if not db_user or not await passwords.verify_password_async(user.password, db_user.hashed_password):
             return JSONResponse(
                 status_code=401, 
                 content={"success": False, "message": "Invalid email or password"}
             )
+
+        # Upgrade the stored hash when BCRYPT_ROUNDS has changed since it was made
+        if passwords.needs_rehash(db_user.hashed_password):
+            try:
+                db_user.hashed_password = await passwords.hash_password_async(user.password)
+                await run_in_threadpool(_commit_user, db, db_user)
+            except passwords.HashQueueFullError:
+                pass  # Upgraded on a later login instead
         
         # Generate token
         access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -146,6 +312,8 @@ def login(user: schemas.UserLogin, db: Session = Depends(database.get_db)):
             }
         )
 
+    except passwords.HashQueueFullError as e:
+        return _too_many_requests(str(e), 5)
     except SQLAlchemyError as e:
         logger.error(f"Database error during login: {str(e)}")
         return JSONResponse(
@@ -160,5 +328,5 @@ def login(user: schemas.UserLogin, db: Session = Depends(database.get_db)):
         )
 
 @router.get("/me", response_model=schemas.UserResponse)
-def read_users_me(current_user: models.User = Depends(get_current_user)):
+async def read_users_me(current_user: models.User = Depends(get_current_user)):
     return current_user
@@ -0,0 +1,65 @@
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Batch configuration
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", os.cpu_count() or 1))
+MAX_BATCH_FILES = int(os.getenv("MAX_BATCH_FILES", 500))
+
+_executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix="batch")
+
+
+class ZipStream:
+    """Write-only sink for zipfile that hands out what was written so far.
+
+    It has no seek()/tell(), so zipfile falls back to streaming mode and
+    writes data descriptors after each member.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def run_unordered(func, items, workers: int = BATCH_WORKERS):
+    """Yield func(item) results as they complete, with at most 2 x workers in flight."""
+    items = iter(items)
+    pending = set()
+    limit = 2 * workers
+    while True:
+        for item in items:
+            pending.add(_executor.submit(func, item))
+            if len(pending) >= limit:
+                break
+        if not pending:
+            return
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield future.result()
+
+
+def stream_zip(results, finish=None):
+    """Stream (name, data) pairs as a ZIP archive, one chunk per member.
+
+    `finish` is called once all results are written and may return a final
+    list of (name, data) members, e.g. a manifest.
+    """
+    stream = ZipStream()
+    with zipfile.ZipFile(stream, "w", compression=zipfile.ZIP_STORED) as zf:
+        for name, data in results:
+            zf.writestr(name, data)
+            yield stream.drain()
+        for name, data in (finish() if finish else None) or []:
+            zf.writestr(name, data)
+    yield stream.drain()
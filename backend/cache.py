@@ -0,0 +1,209 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+# Cache configuration
+CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", 1024 * 1024 * 1024))
+CACHE_MEMORY_MAX_BYTES = int(os.getenv("RESULT_CACHE_MEMORY_MAX_BYTES", 64 * 1024 * 1024))
+CACHE_MEMORY_ITEM_MAX_BYTES = int(os.getenv("RESULT_CACHE_MEMORY_ITEM_MAX_BYTES", 512 * 1024))
+
+
+def make_key(content_hash: str, filter_type: str, params: dict = None):
+    # None-valued params mean "use the default", so they must not split the key
+    normalized = {k: v for k, v in (params or {}).items() if v is not None}
+    raw = json.dumps([content_hash, filter_type, normalized], sort_keys=True)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except FileExistsError:
+        # Put concurrently under the same key, e.g. by coalesced requests; same content
+        pass
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+class ResultCache:
+    """Two-tier LRU cache of enhanced outputs keyed by make_key().
+
+    Small results are also kept in memory; every result is kept on disk
+    under `directory`, whose total size is bounded by `max_bytes`.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = CACHE_MAX_BYTES,
+                 memory_max_bytes: int = CACHE_MEMORY_MAX_BYTES,
+                 memory_item_max_bytes: int = CACHE_MEMORY_ITEM_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.memory_max_bytes = memory_max_bytes
+        self.memory_item_max_bytes = memory_item_max_bytes
+        self._lock = threading.Lock()
+        self._disk = OrderedDict()    # key -> (filename, size)
+        self._memory = OrderedDict()  # key -> bytes
+        self._disk_bytes = 0
+        self._memory_bytes = 0
+        self.hits = 0
+        self.memory_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        entries = []
+        for filename in os.listdir(self.directory):
+            path = os.path.join(self.directory, filename)
+            if os.path.isfile(path) and not filename.endswith(".tmp"):
+                st = os.stat(path)
+                entries.append((st.st_mtime, filename, st.st_size))
+        for _, filename, size in sorted(entries):
+            key = os.path.splitext(filename)[0]
+            self._disk[key] = (filename, size)
+            self._disk_bytes += size
+        self._evict_disk()
+
+    def _evict_disk(self):
+        while self._disk_bytes > self.max_bytes and self._disk:
+            key, (filename, size) = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(os.path.join(self.directory, filename))
+            except FileNotFoundError:
+                pass
+            self._drop_memory(key)
+
+    def _evict_memory(self):
+        while self._memory_bytes > self.memory_max_bytes and self._memory:
+            _, data = self._memory.popitem(last=False)
+            self._memory_bytes -= len(data)
+
+    def _drop_memory(self, key):
+        data = self._memory.pop(key, None)
+        if data is not None:
+            self._memory_bytes -= len(data)
+
+    def _lookup(self, key):
+        # -> (memory bytes or None, cached path) on a hit, None on a miss
+        with self._lock:
+            entry = self._disk.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._disk.move_to_end(key)
+            self.hits += 1
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+            return data, os.path.join(self.directory, entry[0])
+
+    def _forget(self, key):
+        # Entry was removed behind our back; count the lookup as a miss
+        with self._lock:
+            entry = self._disk.pop(key, None)
+            if entry is not None:
+                self._disk_bytes -= entry[1]
+            self.hits -= 1
+            self.misses += 1
+
+    def get(self, key: str, output_path: str):
+        """Materialise a cached result at output_path.
+
+        Returns the result bytes on a memory hit, True on a disk hit and
+        None on a miss.
+        """
+        found = self._lookup(key)
+        if found is None:
+            return None
+        data, cached_path = found
+        if data is not None:
+            with open(output_path, "wb") as f:
+                f.write(data)
+            return data
+        try:
+            _link_or_copy(cached_path, output_path)
+        except FileNotFoundError:
+            self._forget(key)
+            return None
+        return True
+
+    def get_bytes(self, key: str):
+        found = self._lookup(key)
+        if found is None:
+            return None
+        data, cached_path = found
+        if data is not None:
+            return data
+        try:
+            with open(cached_path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            self._forget(key)
+            return None
+
+    def put(self, key: str, output_path: str, data: bytes = None):
+        # `data` is the content of output_path when the caller already has it
+        filename = key + os.path.splitext(output_path)[1]
+        cached_path = os.path.join(self.directory, filename)
+        size = os.path.getsize(output_path)
+        if size > self.max_bytes:
+            return
+        if size > self.memory_item_max_bytes:
+            data = None
+        elif data is None:
+            with open(output_path, "rb") as f:
+                data = f.read()
+        if not os.path.exists(cached_path):
+            _link_or_copy(output_path, cached_path)
+        self._register(key, filename, size, data)
+
+    def put_bytes(self, key: str, data: bytes, ext: str):
+        filename = key + ext
+        cached_path = os.path.join(self.directory, filename)
+        size = len(data)
+        if size > self.max_bytes:
+            return
+        if not os.path.exists(cached_path):
+            tmp_path = f"{cached_path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, cached_path)
+        self._register(key, filename, size, data if size <= self.memory_item_max_bytes else None)
+
+    def _register(self, key, filename, size, data):
+        with self._lock:
+            old = self._disk.pop(key, None)
+            if old is not None:
+                self._disk_bytes -= old[1]
+            self._disk[key] = (filename, size)
+            self._disk_bytes += size
+            self.stores += 1
+            if data is not None:
+                self._drop_memory(key)
+                self._memory[key] = data
+                self._memory_bytes += len(data)
+                self._evict_memory()
+            self._evict_disk()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "memory_hits": self.memory_hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "entries": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+                "disk_max_bytes": self.max_bytes,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "memory_max_bytes": self.memory_max_bytes,
+            }
@@ -0,0 +1,90 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+
+from . import metrics
+
+EXECUTED = "executed"
+COALESCED = "coalesced"
+
+# Enhancements actually run, and requests that joined an identical one in flight
+# (same upload hash, filter, parameters and output settings), by where they ran:
+# "inline" for /enhance and batch items, "job" for ?async=1 jobs
+ENHANCE_RUNS = metrics.Counter(
+    "enhance_runs_total", "Enhancements run, and requests served by an identical one in flight", ("mode", "outcome")
+)
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time; callers with the same key share its result.
+
+    Usable from threads and from any event loop: each flight is a
+    concurrent.futures.Future, completed by whoever started it. The key is
+    forgotten as soon as the call finishes, so later requests go through the
+    result cache instead.
+    """
+
+    def __init__(self, mode: str = "inline"):
+        self.mode = mode
+        self._flights = {}
+        self._tasks = set()
+        self._lock = threading.Lock()
+
+    def _join(self, key):
+        # -> (flight, True if the caller has to run it)
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                ENHANCE_RUNS.inc(mode=self.mode, outcome=COALESCED)
+                return flight, False
+            flight = self._flights[key] = Future()
+            ENHANCE_RUNS.inc(mode=self.mode, outcome=EXECUTED)
+            return flight, True
+
+    def _land(self, key, flight, result=None, exception=None):
+        with self._lock:
+            del self._flights[key]
+        if exception is not None:
+            flight.set_exception(exception)
+        else:
+            flight.set_result(result)
+
+    def do(self, key, func, timer=metrics.NULL_TIMER):
+        # Blocking form for worker threads: calls func() once per key
+        flight, leader = self._join(key)
+        if not leader:
+            with timer.stage("coalesced"):
+                return flight.result()
+        try:
+            result = func()
+        except BaseException as e:
+            self._land(key, flight, exception=e)
+            raise
+        self._land(key, flight, result)
+        return result
+
+    async def do_async(self, key, start, timer=metrics.NULL_TIMER):
+        """Await start() once per key; start returns the awaitable doing the work.
+
+        The work runs as its own task, so it finishes for the requests that
+        joined it even if the one that started it goes away.
+        """
+        flight, leader = self._join(key)
+        if leader:
+            task = asyncio.ensure_future(start())
+            self._tasks.add(task)
+            task.add_done_callback(lambda t: self._finish_task(key, flight, t))
+            return await asyncio.shield(asyncio.wrap_future(flight))
+        with timer.stage("coalesced"):
+            return await asyncio.shield(asyncio.wrap_future(flight))
+
+    def _finish_task(self, key, flight, task):
+        self._tasks.discard(task)
+        if task.cancelled():
+            self._land(key, flight, exception=asyncio.CancelledError())
+        else:
+            self._land(key, flight, task.result() if task.exception() is None else None, task.exception())
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._flights)
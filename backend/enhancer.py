@@ -1,43 +1,84 @@
 import cv2
 import numpy as np
 from PIL import Image, ImageEnhance
+import io
 import os
+import time
+from functools import lru_cache
+
+from .analysis import STRETCH_RANGE, plan_auto
+from .pointops import apply_lut, apply_value_lut, brightness_lut, gamma_lut, levels_lut
+from .tiling import should_tile, choose_tile_rows, process_tiled, resolve_workers, PARALLEL_MIN_PIXELS
+from .metrics import NULL_TIMER
+from . import buffers
+
+# Warm-up on startup and in job workers; see warm_up()
+WARMUP_ENABLED = os.getenv("ENHANCE_WARMUP", "1") == "1"
+WARMUP_SIDE = 64
 
 def load_image(image_path: str):
     return cv2.imread(image_path)
 
-def save_image(image, output_path: str):
-    cv2.imwrite(output_path, image)
+def save_image(image, output_path: str, options=None):
+    # options: formats.OutputOptions; the path's extension picks the encoder
+    cv2.imwrite(output_path, image, options.imwrite_flags() if options is not None else [])
+
+# Decoder scale factor -> imdecode flag; JPEG decodes straight to the
+# reduced size, other formats decode fully and are then shrunk
+REDUCED_DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
 
-def denoise(image):
-    return cv2.fastNlMeansDenoisingColored(image, None, 10, 10, 7, 21)
+def decode_image(data: bytes, reduction: int = 1):
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), REDUCED_DECODE_FLAGS[reduction])
+
+def encode_image(image, ext: str = ".jpg", quality: int = None, options=None):
+    flags = []
+    if options is not None:
+        ext, flags = options.ext, options.imwrite_flags()
+    elif quality is not None and ext.lower() in (".jpg", ".jpeg"):
+        flags = [cv2.IMWRITE_JPEG_QUALITY, quality]
+    ok, buf = cv2.imencode(ext, image, flags)
+    if not ok:
+        raise ValueError(f"Could not encode image as {ext}")
+    return buf.tobytes()
+
+# The filters write into buffers.take(), pooled while a request holds a lease
+def denoise(image, h=10):
+    return cv2.fastNlMeansDenoisingColored(image, buffers.take(image.shape), h, h, 7, 21)
 
 def increase_brightness(image, value=30):
-    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-    h, s, v = cv2.split(hsv)
-    
-    lim = 255 - value
-    v[v > lim] = 255
-    v[v <= lim] += value
-    
-    final_hsv = cv2.merge((h, s, v))
-    image = cv2.cvtColor(final_hsv, cv2.COLOR_HSV2BGR)
-    return image
+    return apply_value_lut(image, brightness_lut(value))
 
 def increase_contrast(image, alpha=1.5, beta=0):
-    return cv2.convertScaleAbs(image, alpha=alpha, beta=beta)
+    # A single scale/offset is faster as convertScaleAbs than as a LUT;
+    # chains of point operations are fused into one LUT by the pipeline
+    return cv2.convertScaleAbs(image, dst=buffers.take(image.shape), alpha=alpha, beta=beta)
+
+def adjust_gamma(image, gamma=1.0):
+    return apply_lut(image, gamma_lut(gamma))
+
+@lru_cache(maxsize=64)
+def sharpen_kernel(amount=1.0):
+    # amount 1.0 is the classic [0,-1,0; -1,5,-1; 0,-1,0] kernel. Built once
+    # per amount and shared between calls, so read-only.
+    kernel = np.array([[0, -amount, 0], 
+                       [-amount, 1 + 4 * amount, -amount], 
+                       [0, -amount, 0]], dtype=np.float64)
+    kernel.setflags(write=False)
+    return kernel
 
-def sharpen(image):
-    kernel = np.array([[0, -1, 0], 
-                       [-1, 5,-1], 
-                       [0, -1, 0]])
-    return cv2.filter2D(image, -1, kernel)
+def sharpen(image, amount=1.0):
+    return cv2.filter2D(image, -1, sharpen_kernel(amount), dst=buffers.take(image.shape))
 
 def to_grayscale(image):
-    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=buffers.take(image.shape[:2]))
 
 def blur(image):
-    return cv2.GaussianBlur(image, (5, 5), 0)
+    return cv2.GaussianBlur(image, (5, 5), 0, dst=buffers.take(image.shape))
     
 def resize_image(image, width=None, height=None):
     if width is None and height is None:
@@ -54,42 +95,257 @@ def resize_image(image, width=None, height=None):
     else:
         dim = (width, height)
         
-    return cv2.resize(image, dim, interpolation=cv2.INTER_AREA)
+    return cv2.resize(image, dim, dst=buffers.take((dim[1], dim[0]) + image.shape[2:]), interpolation=cv2.INTER_AREA)
 
-def enhance_auto(image):
-    image = denoise(image)
-    image = increase_contrast(image, 1.2, 10)
-    image = increase_brightness(image, 10)
-    image = sharpen(image)
-    return image
+def enhance_auto(image, plan=None):
+    # Only the stages the image needs, at strengths chosen from its statistics;
+    # tiled callers pass the plan made for the whole image
+    plan = plan or plan_auto(image)
+    steps = []
+    if plan.denoise_h is not None:
+        steps.append(lambda im: denoise(im, plan.denoise_h))
+    if plan.stretch is not None:
+        steps.append(lambda im: apply_lut(im, levels_lut(*plan.stretch, *STRETCH_RANGE)))
+    if plan.brightness is not None:
+        steps.append(lambda im: increase_brightness(im, plan.brightness))
+    if plan.sharpen is not None:
+        steps.append(lambda im: sharpen(im, plan.sharpen))
+    result = image
+    for step in steps:
+        previous, result = result, step(result)
+        # Intermediates go back to the pool; the caller's image is never ours to return
+        if previous is not image:
+            buffers.release(previous)
+    return result
 
 
-    
+
+# --- Filter registry ---
+
+# Cost classes. Heavy filters are split across cores even when memory is
+# not tight; the estimates seed the preview's time budget.
+LIGHT = "light"        # one pass of a point operation
+MODERATE = "moderate"  # small kernels and resampling
+HEAVY = "heavy"        # non-local means: seconds per megapixel
+
+
+class Param:
+    """One keyword argument of a filter, with its type and accepted range."""
+
+    def __init__(self, name, type=float, default=None, minimum=None, maximum=None, required=False):
+        self.name = name
+        self.type = type
+        self.default = default
+        self.minimum = minimum
+        self.maximum = maximum
+        self.required = required
+
+    def convert(self, value):
+        try:
+            value = self.type(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{self.name} must be {'an integer' if self.type is int else 'a number'}")
+        if self.minimum is not None and value < self.minimum or self.maximum is not None and value > self.maximum:
+            if self.maximum is None:
+                raise ValueError(f"{self.name} must be at least {self.minimum}")
+            raise ValueError(f"{self.name} must be between {self.minimum} and {self.maximum}")
+        return value
+
+    def describe(self):
+        return {
+            "name": self.name,
+            "type": self.type.__name__,
+            "default": self.default,
+            "minimum": self.minimum,
+            "maximum": self.maximum,
+            "required": self.required,
+        }
+
+
+class FilterSpec:
+    """A filter and what the dispatcher, pipeline planner and tiler know about it.
+
+    halo is the footprint radius used as the tile halo (None: never tiled)
+    and peak_copies the number of full-size arrays held at the peak.
+    needs_color: 3-channel BGR input required (HSV conversion, colored NLM).
+    scale_invariant: downscaling before this stage gives the same result
+    within tolerance. Internal filters are only created by the pipeline.
+    """
+
+    def __init__(self, name, func, cost, cost_ms_per_mp, params=(), needs_color=False, scale_invariant=False,
+                 halo=None, peak_copies=1, internal=False):
+        self.name = name
+        self.func = func
+        self.cost = cost
+        self.cost_ms_per_mp = cost_ms_per_mp
+        self.params = list(params)
+        self.needs_color = needs_color
+        self.scale_invariant = scale_invariant
+        self.halo = halo
+        self.peak_copies = peak_copies
+        self.internal = internal
+
+    @property
+    def parallel(self):
+        return self.cost == HEAVY
+
+    @property
+    def standalone(self):
+        # Usable as filter_type, where only the defaults apply
+        return not self.internal and not any(p.required for p in self.params)
+
+    def usage(self):
+        # e.g. "contrast[:alpha[:beta]]" or "gamma:<gamma>"
+        optional = [p for p in self.params if not p.required]
+        return (
+            self.name + "".join(f":<{p.name}>" for p in self.params if p.required)
+            + "".join(f"[:{p.name}" for p in optional) + "]" * len(optional)
+        )
+
+    def parse_args(self, args):
+        # Positional pipeline arguments, in declaration order
+        required = sum(p.required for p in self.params)
+        if not self.params and args:
+            raise ValueError(f"Filter '{self.name}' takes no arguments")
+        if not required <= len(args) <= len(self.params):
+            raise ValueError(f"Usage: {self.usage()}")
+        return {p.name: p.convert(arg) for p, arg in zip(self.params, args)}
+
+    def validate(self, kwargs: dict):
+        # -> kwargs converted to the declared types; None means "use the default"
+        unknown = set(kwargs) - {p.name for p in self.params}
+        if unknown:
+            raise ValueError(f"Filter '{self.name}' has no parameter '{sorted(unknown)[0]}'")
+        return {p.name: p.convert(kwargs[p.name]) for p in self.params if kwargs.get(p.name) is not None}
+
+    def describe(self):
+        return {
+            "name": self.name,
+            "cost": self.cost,
+            "needs_color": self.needs_color,
+            "params": [p.describe() for p in self.params],
+        }
+
+
+# Point operations commute with INTER_AREA downscaling up to rounding. NLM
+# denoise does not commute exactly, but denoising at the output resolution
+# is visually equivalent and far cheaper. Kernel filters (sharpen, blur) are
+# defined in pixels, so moving a resize across them changes the result.
+#
+# NLM denoise needs a halo of search window / 2 + template window / 2 =
+# 21 // 2 + 7 // 2; auto runs denoise followed by the 3x3 sharpen.
+FILTERS = {spec.name: spec for spec in [
+    FilterSpec("denoise", denoise, HEAVY, 2000.0, [Param("h", float, 10, 1, 30)],
+               needs_color=True, scale_invariant=True, halo=13, peak_copies=6),
+    FilterSpec("brightness", increase_brightness, LIGHT, 10.0, [Param("value", int, 30, -255, 255)],
+               needs_color=True, scale_invariant=True, halo=0, peak_copies=3),
+    FilterSpec("contrast", increase_contrast, LIGHT, 2.0,
+               [Param("alpha", float, 1.5, 0, 10), Param("beta", float, 0, -255, 255)],
+               scale_invariant=True, halo=0, peak_copies=2),
+    FilterSpec("gamma", adjust_gamma, LIGHT, 3.0, [Param("gamma", float, None, 0.01, required=True)],
+               scale_invariant=True, halo=0, peak_copies=2),
+    FilterSpec("sharpen", sharpen, MODERATE, 8.0, [Param("amount", float, 1.0, 0, 5)], halo=1, peak_copies=2),
+    FilterSpec("grayscale", to_grayscale, LIGHT, 2.0, needs_color=True, scale_invariant=True,
+               halo=0, peak_copies=1.5),
+    FilterSpec("blur", blur, MODERATE, 6.0, halo=2, peak_copies=2),
+    FilterSpec("auto", enhance_auto, HEAVY, 2100.0, needs_color=True, halo=14, peak_copies=7),
+    FilterSpec("resize", resize_image, MODERATE, 5.0,
+               [Param("width", int, None, 1, 65535), Param("height", int, None, 1, 65535)]),
+    # Fused chain of point operations, see pipeline.fuse_point_ops()
+    FilterSpec("lut", apply_lut, LIGHT, 3.0, scale_invariant=True, halo=0, peak_copies=2, internal=True),
+]}
+
+
+def get_filter(name: str):
+    spec = FILTERS.get(name)
+    if spec is None or spec.internal:
+        raise ValueError(f"Unknown filter '{name}'")
+    return spec
+
+def run_filter(func, image, name: str, memory_cap_mb: int = None, workers: int = None, **kwargs):
+    # Large images go through the tiled engine so peak memory follows tile
+    # size; big images on expensive filters are also split across cores
+    spec = FILTERS[name]
+    if spec.halo is None:
+        return func(image, **kwargs)
+    workers = resolve_workers(workers) if spec.parallel else 1
+    if workers > 1 and image.shape[0] * image.shape[1] < PARALLEL_MIN_PIXELS:
+        workers = 1
+    if workers == 1 and not should_tile(image, spec.peak_copies, memory_cap_mb):
+        return func(image, **kwargs)
+    tile_rows = choose_tile_rows(image, spec.halo, spec.peak_copies, memory_cap_mb, workers)
+    return process_tiled(image, lambda tile: func(tile, **kwargs), spec.halo, tile_rows, workers)
+
+def process_image(image, filter_type: str, params: dict = None, auto_plan=None):
+    # params may carry more than the filter's own arguments (memory cap,
+    # output options); only the declared ones are passed on
+    params = params or {}
+    spec = get_filter(filter_type)
+    kwargs = spec.validate({p.name: params.get(p.name) for p in spec.params})
+    if filter_type == 'auto':
+        # Analysed once here, not per tile
+        kwargs['plan'] = auto_plan or plan_auto(image)
+    return run_filter(
+        spec.func, image, filter_type, params.get('memory_cap_mb'), params.get('parallelism'), **kwargs
+    )
+
+def warm_up(side: int = WARMUP_SIDE):
+    """Run every filter and codec once on a small image; -> {name: ms}.
+
+    The first call into OpenCV starts its thread pool and the first call of
+    each function sets up its own tables, which would otherwise land on the
+    first request that uses it.
+    """
+    rng = np.random.default_rng(0)
+    image = cv2.resize(rng.integers(0, 256, (4, 4, 3), dtype=np.uint8), (side, side), interpolation=cv2.INTER_LINEAR)
+    image = cv2.add(image, rng.integers(0, 24, image.shape, dtype=np.uint8))
+    # Kernels for the amounts auto sharpens by
+    for amount in (0.5, 1.0):
+        sharpen_kernel(amount)
+
+    timings = {}
+    for name, spec in FILTERS.items():
+        if not spec.standalone:
+            continue
+        start = time.perf_counter()
+        process_image(image, name, {"width": side // 2})
+        timings[name] = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    for ext in (".jpg", ".png", ".webp"):
+        data = encode_image(image, ext)
+        decode_image(data)
+        # Pillow loads its format plugins on the first open; uploads are
+        # validated by reading their header with it
+        with Image.open(io.BytesIO(data)) as im:
+            im.size
+    timings["codecs"] = (time.perf_counter() - start) * 1000
+    return timings
+
 def apply_filter(image_path: str, filter_type: str, output_path: str, params: dict = None):
     image = load_image(image_path)
     if image is None:
         raise ValueError("Could not load image")
 
-    if filter_type == 'denoise':
-        processed = denoise(image)
-    elif filter_type == 'brightness':
-        processed = increase_brightness(image)
-    elif filter_type == 'contrast':
-        processed = increase_contrast(image)
-    elif filter_type == 'sharpen':
-        processed = sharpen(image)
-    elif filter_type == 'grayscale':
-        processed = to_grayscale(image)
-    elif filter_type == 'blur':
-        processed = blur(image)
-    elif filter_type == 'auto':
-        processed = enhance_auto(image)
-    elif filter_type == 'resize':
-        w = params.get('width') if params else None
-        h = params.get('height') if params else None
-        processed = resize_image(image, width=w, height=h)
-    else:
-        processed = image # No change
-        
-    save_image(processed, output_path)
+    with buffers.lease():
+        processed = process_image(image, filter_type, params)
+        save_image(processed, output_path, (params or {}).get('output'))
     return output_path
+
+def apply_filter_bytes(data: bytes, filter_type: str, ext: str = ".jpg", params: dict = None, timer=NULL_TIMER):
+    # In-memory variant of apply_filter: encoded bytes in, encoded bytes out
+    with timer.stage("decode"):
+        image = decode_image(data)
+    if image is None:
+        raise ValueError("Could not load image")
+    timer.megapixels = image.shape[0] * image.shape[1] / 1_000_000
+
+    auto_plan = None
+    if filter_type == 'auto':
+        with timer.stage("analysis"):
+            auto_plan = timer.auto_plan = plan_auto(image)
+    # Filter outputs come from the buffer pool and go back once encoded
+    with buffers.lease():
+        with timer.stage("filter"):
+            processed = process_image(image, filter_type, params, auto_plan)
+        with timer.stage("encode"):
+            return encode_image(processed, ext, options=(params or {}).get('output'))
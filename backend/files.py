@@ -0,0 +1,121 @@
+import hashlib
+import os
+import uuid
+from email.utils import formatdate, parsedate_to_datetime
+
+from fastapi import HTTPException
+from fastapi.responses import FileResponse, Response
+
+from .enhancer import decode_image, encode_image, resize_image
+from .formats import EXTENSION_FORMATS, OutputOptions, media_type_for
+from .preview import choose_reduction, probe_size
+
+# Uploads and outputs are written once under a uuid name and never change
+FILE_CACHE_CONTROL = os.getenv("FILE_CACHE_CONTROL", "public, max-age=31536000, immutable")
+# Thumbnail widths served via ?w=; a fixed set keeps the on-disk variants bounded
+THUMBNAIL_WIDTHS = (64, 128, 256, 512, 1024)
+THUMBNAIL_QUALITY = 80
+
+
+def file_etag(path: str, stat_result=None):
+    # Strong: the name is unique and the content behind it never changes
+    st = stat_result or os.stat(path)
+    tag = hashlib.sha1(f"{os.path.basename(path)}:{st.st_size}:{st.st_mtime_ns}".encode()).hexdigest()
+    return f'"{tag}"'
+
+
+def is_not_modified(request_headers, etag: str, last_modified: float):
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        # If-None-Match takes precedence over If-Modified-Since (RFC 9110)
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            return int(last_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _cache_headers(etag: str, last_modified: float):
+    return {
+        "ETag": etag,
+        "Cache-Control": FILE_CACHE_CONTROL,
+        "Last-Modified": formatdate(last_modified, usegmt=True),
+    }
+
+
+def cached_file_response(path: str, request_headers, etag: str = None):
+    """FileResponse with a strong ETag, immutable caching and 304 handling.
+
+    Byte ranges (Range / If-Range) are handled by FileResponse itself.
+    """
+    st = os.stat(path)
+    etag = etag or file_etag(path, st)
+    headers = _cache_headers(etag, st.st_mtime)
+    if is_not_modified(request_headers, etag, st.st_mtime):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type=media_type_for(path), headers=headers, stat_result=st)
+
+
+def _thumbnail_path(thumbnail_dir: str, source: str, width: int):
+    # Same name and format as the source, one directory per width
+    return os.path.join(thumbnail_dir, str(width), os.path.basename(source))
+
+
+def get_thumbnail(source: str, width: int, thumbnail_dir: str):
+    """-> path of a copy of `source` at most `width` pixels wide.
+
+    Generated on first request and kept under thumbnail_dir; images already
+    narrower than `width` are served as they are.
+    """
+    thumb = _thumbnail_path(thumbnail_dir, source, width)
+    if os.path.isfile(thumb):
+        return thumb
+
+    with open(source, "rb") as f:
+        data = f.read()
+    try:
+        src_width, src_height = probe_size(data)
+        reduction = choose_reduction(src_width, src_height, width, max(1, round(src_height * width / src_width)))
+    except Exception:
+        # Formats this Pillow build cannot read (e.g. AVIF): decode in full
+        src_width, reduction = None, 1
+    if src_width is not None and src_width <= width:
+        return source
+
+    image = decode_image(data, reduction)
+    if image is None:
+        raise HTTPException(status_code=415, detail="Not an image")
+    if image.shape[1] <= width:
+        return source
+    output = OutputOptions(EXTENSION_FORMATS.get(os.path.splitext(source)[1].lower(), "jpeg"), THUMBNAIL_QUALITY)
+    result = encode_image(resize_image(image, width=width), options=output)
+
+    # Write under a temporary name so concurrent requests never see a partial file
+    os.makedirs(os.path.dirname(thumb), exist_ok=True)
+    tmp = f"{thumb}.{uuid.uuid4().hex}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(result)
+    os.replace(tmp, thumb)
+    return thumb
+
+
+def serve_file(path: str, request_headers, width: int = None, thumbnail_dir: str = None):
+    # `path` is None when the requested name is not stored
+    if path is None or not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="File not found")
+    if width is None:
+        return cached_file_response(path, request_headers)
+    if width not in THUMBNAIL_WIDTHS:
+        raise HTTPException(
+            status_code=400, detail=f"w must be one of {', '.join(map(str, THUMBNAIL_WIDTHS))}"
+        )
+    # Keyed on the source file, so revalidation never needs the thumbnail itself
+    st = os.stat(path)
+    etag = file_etag(path, st)[:-1] + f'-w{width}"'
+    if is_not_modified(request_headers, etag, st.st_mtime):
+        return Response(status_code=304, headers=_cache_headers(etag, st.st_mtime))
+    return cached_file_response(get_thumbnail(path, width, thumbnail_dir), request_headers, etag=etag)
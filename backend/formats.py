@@ -0,0 +1,126 @@
+import mimetypes
+import os
+
+import cv2
+
+# Output format defaults, chosen for encode speed and size. JPEG at 85 is
+# about half the bytes of OpenCV's default 95 and encodes faster; WebP
+# without a quality flag would fall back to slow lossless encoding.
+JPEG_QUALITY = int(os.getenv("OUTPUT_JPEG_QUALITY", 85))
+WEBP_QUALITY = int(os.getenv("OUTPUT_WEBP_QUALITY", 80))
+AVIF_QUALITY = int(os.getenv("OUTPUT_AVIF_QUALITY", 60))
+AVIF_SPEED = 8  # 0 (slowest, smallest) .. 9
+
+# name -> (extension, media type); AVIF only when this OpenCV build can write it
+FORMATS = {
+    "jpeg": (".jpg", "image/jpeg"),
+    "png": (".png", "image/png"),
+    "webp": (".webp", "image/webp"),
+}
+if cv2.haveImageWriter(".avif"):
+    FORMATS["avif"] = (".avif", "image/avif")
+
+EXTENSION_FORMATS = {".jpg": "jpeg", ".jpeg": "jpeg", ".png": "png", ".webp": "webp", ".avif": "avif"}
+MEDIA_TYPE_FORMATS = {media_type: name for name, (_, media_type) in FORMATS.items()}
+# Tie-break between equally acceptable types: smallest output first
+NEGOTIATION_ORDER = ["avif", "webp", "jpeg", "png"]
+
+
+class OutputOptions:
+    """Encoder choice and settings for one result."""
+
+    def __init__(self, format: str = "jpeg", quality: int = None, progressive: bool = False,
+                 optimize: bool = False, png_compression: int = None):
+        if format not in FORMATS:
+            raise ValueError(f"Unsupported output format '{format}'; choose from {', '.join(FORMATS)}")
+        if quality is not None and not 1 <= quality <= 100:
+            raise ValueError("quality must be between 1 and 100")
+        if png_compression is not None and not 0 <= png_compression <= 9:
+            raise ValueError("png_compression must be between 0 and 9")
+        self.format = format
+        self.quality = quality
+        self.progressive = progressive
+        self.optimize = optimize
+        self.png_compression = png_compression
+
+    @property
+    def ext(self):
+        return FORMATS[self.format][0]
+
+    @property
+    def media_type(self):
+        return FORMATS[self.format][1]
+
+    def imwrite_flags(self):
+        if self.format == "jpeg":
+            flags = [cv2.IMWRITE_JPEG_QUALITY, self.quality or JPEG_QUALITY]
+            if self.progressive:
+                flags += [cv2.IMWRITE_JPEG_PROGRESSIVE, 1]
+            if self.optimize:
+                flags += [cv2.IMWRITE_JPEG_OPTIMIZE, 1]
+            return flags
+        if self.format == "png":
+            # OpenCV's own default (no flag) is its fastest setting
+            return [cv2.IMWRITE_PNG_COMPRESSION, self.png_compression] if self.png_compression is not None else []
+        if self.format == "webp":
+            return [cv2.IMWRITE_WEBP_QUALITY, self.quality or WEBP_QUALITY]
+        return [cv2.IMWRITE_AVIF_QUALITY, self.quality or AVIF_QUALITY, cv2.IMWRITE_AVIF_SPEED, AVIF_SPEED]
+
+    def key_params(self):
+        # Everything that changes the encoded bytes, for result cache keys
+        return {
+            "format": self.format,
+            "quality": self.quality,
+            "progressive": self.progressive or None,
+            "optimize": self.optimize or None,
+            "png_compression": self.png_compression,
+        }
+
+
+def media_type_for(path: str):
+    name = EXTENSION_FORMATS.get(os.path.splitext(path)[1].lower())
+    if name in FORMATS:
+        return FORMATS[name][1]
+    # Enhanced clips (.mp4, .gif)
+    return mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+
+def parse_accept(header: str):
+    """-> {media type: q} for the concrete types listed in an Accept header."""
+    accepted = {}
+    for part in (header or "").split(","):
+        media_type, *params = [item.strip() for item in part.split(";")]
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if media_type:
+            accepted[media_type.lower()] = q
+    return accepted
+
+
+def negotiate(accept: str):
+    # Only explicitly listed image types count; wildcards mean "no preference"
+    accepted = parse_accept(accept)
+    candidates = [
+        (q, -NEGOTIATION_ORDER.index(MEDIA_TYPE_FORMATS[media_type]), MEDIA_TYPE_FORMATS[media_type])
+        for media_type, q in accepted.items() if media_type in MEDIA_TYPE_FORMATS and q > 0
+    ]
+    return max(candidates)[2] if candidates else None
+
+
+def resolve_output(input_ext: str, output_format: str = None, accept: str = None, quality: int = None,
+                   progressive: bool = False, optimize: bool = False, png_compression: int = None):
+    """Pick the output format: explicit request, then Accept, then the input's format.
+
+    Raises ValueError for unknown formats or out-of-range settings.
+    """
+    if output_format:
+        name = EXTENSION_FORMATS.get("." + output_format.lower().lstrip("."), output_format.lower())
+    else:
+        name = negotiate(accept) or EXTENSION_FORMATS.get(input_ext.lower(), "jpeg")
+    return OutputOptions(name, quality, progressive, optimize, png_compression)
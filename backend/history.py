@@ -0,0 +1,159 @@
+import logging
+import os
+import queue
+import threading
+import time
+from collections import Counter
+
+from sqlalchemy import exc, insert
+
+from . import database, metrics, models
+
+logger = logging.getLogger(__name__)
+
+# History write batching: rows are queued by the request and inserted by a
+# background thread, HISTORY_BATCH_SIZE rows per statement at most, after
+# waiting at most HISTORY_FLUSH_MS for more rows to arrive
+HISTORY_BATCH_SIZE = int(os.getenv("HISTORY_BATCH_SIZE", 256))
+HISTORY_FLUSH_MS = int(os.getenv("HISTORY_FLUSH_MS", 50))
+# A batch that fails because the database is busy or unreachable is retried,
+# waiting twice as long each time up to HISTORY_RETRY_MAX_MS, until it is written
+HISTORY_RETRY_MS = int(os.getenv("HISTORY_RETRY_MS", 100))
+HISTORY_RETRY_MAX_MS = int(os.getenv("HISTORY_RETRY_MAX_MS", 5000))
+
+HISTORY_ROWS_DROPPED = metrics.Counter(
+    "history_rows_dropped_total", "Queued history rows that were never written", ("reason",)
+)
+HISTORY_WRITE_RETRIES = metrics.Counter("history_write_retries_total", "History batches retried after an error")
+
+_STOP = object()
+
+
+def _is_transient(error):
+    # Locked SQLite database, lost or refused server connection
+    return isinstance(error, (exc.OperationalError, exc.InterfaceError)) or (
+        isinstance(error, exc.DBAPIError) and error.connection_invalidated
+    )
+
+
+class HistoryWriter:
+    """Coalesces ImageHistory inserts into batched transactions.
+
+    Rows are visible once flushed; flush(user_id) waits for that user's
+    queued rows, which /history uses so a client always sees its own writes.
+    """
+
+    def __init__(self, engine, batch_size: int = HISTORY_BATCH_SIZE, flush_ms: int = HISTORY_FLUSH_MS):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000
+        self._queue = queue.Queue()
+        self._pending = Counter()  # user id -> queued rows
+        self._cond = threading.Condition()
+        self._thread = None
+        self._closing = threading.Event()
+
+    def _ensure_started(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+            self._thread.start()
+
+    def add(self, user_id: int, original_filename: str, enhanced_filename: str):
+        self.add_many([{
+            "user_id": user_id,
+            "original_filename": original_filename,
+            "enhanced_filename": enhanced_filename,
+        }])
+
+    def add_many(self, rows):
+        if not rows:
+            return
+        with self._cond:
+            self._ensure_started()
+            for row in rows:
+                self._pending[row["user_id"]] += 1
+                self._queue.put(row)
+
+    def flush(self, user_id: int = None, timeout: float = 5.0):
+        # Wait until the given user's rows (or all rows) have been written
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._pending[user_id] if user_id is not None else sum(self._pending.values()):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._cond.wait(remaining):
+                    return False
+        return True
+
+    def close(self):
+        with self._cond:
+            thread = self._thread
+        if thread is not None:
+            # Stops retrying: whatever cannot be written right away is dropped
+            self._closing.set()
+            self._queue.put(_STOP)
+            thread.join()
+
+    def _run(self):
+        while True:
+            row = self._queue.get()
+            if row is _STOP:
+                return
+            batch = [row]
+            deadline = time.monotonic() + self.flush_interval
+            stop = False
+            while len(batch) < self.batch_size:
+                try:
+                    row = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if row is _STOP:
+                    stop = True
+                    break
+                batch.append(row)
+            self._write(batch)
+            if stop:
+                return
+
+    def _insert(self, rows):
+        with self.engine.begin() as conn:
+            conn.execute(insert(models.ImageHistory), rows)
+
+    def _write(self, batch):
+        # Rows stay pending, and /history keeps waiting for them, until they are committed
+        delay = HISTORY_RETRY_MS / 1000
+        while True:
+            try:
+                self._insert(batch)
+                break
+            except Exception as e:
+                if not _is_transient(e):
+                    # A bad row: write the others one by one
+                    self._write_each(batch, e)
+                    return
+                if self._closing.is_set():
+                    logger.error(f"Dropped {len(batch)} history rows at shutdown: {str(e)}")
+                    HISTORY_ROWS_DROPPED.inc(len(batch), reason="shutdown")
+                    break
+                logger.warning(f"Could not write {len(batch)} history rows, retrying in {delay:.1f}s: {str(e)}")
+                HISTORY_WRITE_RETRIES.inc()
+                self._closing.wait(delay)
+                delay = min(delay * 2, HISTORY_RETRY_MAX_MS / 1000)
+        self._done(batch)
+
+    def _write_each(self, batch, error):
+        if len(batch) == 1:
+            logger.error(f"Dropped a history row: {str(error)}")
+            HISTORY_ROWS_DROPPED.inc(reason="error")
+            self._done(batch)
+            return
+        for row in batch:
+            self._write([row])
+
+    def _done(self, rows):
+        with self._cond:
+            self._pending.subtract(row["user_id"] for row in rows)
+            self._pending += Counter()  # drop zero counts
+            self._cond.notify_all()
+
+
+writer = HistoryWriter(database.engine)
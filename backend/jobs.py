@@ -0,0 +1,318 @@
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+import cv2
+from sqlalchemy import delete, or_, select
+
+from .enhancer import apply_filter, warm_up, WARMUP_ENABLED
+from . import database, models
+from .coalesce import ENHANCE_RUNS, EXECUTED, COALESCED
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Worker pool configuration
+MAX_WORKERS = int(os.getenv("ENHANCE_WORKERS", os.cpu_count() or 1))
+MAX_QUEUE_SIZE = int(os.getenv("ENHANCE_QUEUE_SIZE", MAX_WORKERS * 4))
+JOB_TTL_SECONDS = int(os.getenv("ENHANCE_JOB_TTL_SECONDS", 3600))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, user_id, filter_type, original_filename, output_filename, output_path):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.filter_type = filter_type
+        self.original_filename = original_filename
+        self.output_filename = output_filename
+        self.output_path = output_path
+        self.created_at = time.time()
+        self.finished_at = None
+        self.error = None
+        self.future = None
+        self.on_success = None
+        # Identical jobs submitted while this one runs; they share its future
+        self.key = None
+        self.followers = []
+
+    @property
+    def status(self):
+        if self.finished_at is None:
+            return RUNNING if self.future is not None and self.future.running() else QUEUED
+        return FAILED if self.error is not None else DONE
+
+    def to_dict(self):
+        data = {
+            "job_id": self.id,
+            "status": self.status,
+            "filter_type": self.filter_type,
+        }
+        if data["status"] == DONE:
+            data["enhanced_filename"] = self.output_filename
+            data["output_url"] = f"/outputs/{self.output_filename}"
+        elif data["status"] == FAILED:
+            data["error"] = self.error
+        return data
+
+
+_pool = None
+# Jobs submitted by this process. Their status is also written to the
+# enhance_jobs table, which is how other worker processes find them.
+_jobs = {}
+# Coalescing key -> job running it
+_in_flight = {}
+_lock = threading.Lock()
+
+
+def _init_worker():
+    # One job per core: keep OpenCV from spawning its own threads in each worker
+    cv2.setNumThreads(1)
+    if WARMUP_ENABLED:
+        warm_up()
+
+
+def get_pool():
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=MAX_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+            )
+        return _pool
+
+
+def _prune_jobs(now):
+    expired = [
+        job_id for job_id, job in _jobs.items()
+        if job.finished_at is not None and now - job.finished_at > JOB_TTL_SECONDS
+    ]
+    for job_id in expired:
+        del _jobs[job_id]
+
+
+def _pending_count():
+    return sum(1 for job in _jobs.values() if job.finished_at is None)
+
+
+def _utc(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc) if timestamp is not None else None
+
+
+def _epoch(value):
+    # SQLite hands back naive datetimes; they were written in UTC
+    if value is None:
+        return None
+    return (value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)).timestamp()
+
+
+def _save_job(job):
+    db = database.SessionLocal()
+    try:
+        if job.finished_at is None:
+            # New job: drop the rows other jobs have outlived
+            cutoff = _utc(time.time() - JOB_TTL_SECONDS)
+            db.execute(delete(models.EnhanceJob).where(models.EnhanceJob.finished_at < cutoff))
+        db.merge(models.EnhanceJob(
+            id=job.id,
+            user_id=job.user_id,
+            filter_type=job.filter_type,
+            output_filename=job.output_filename,
+            status=job.status,
+            error=job.error,
+            created_at=_utc(job.created_at),
+            finished_at=_utc(job.finished_at),
+        ))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def _forget_job(job):
+    db = database.SessionLocal()
+    try:
+        db.execute(delete(models.EnhanceJob).where(models.EnhanceJob.id == job.id))
+        db.commit()
+    finally:
+        db.close()
+
+
+def _load_job(job_id):
+    # A job submitted by another worker process; status only, it has no future here
+    cutoff = _utc(time.time() - JOB_TTL_SECONDS)
+    db = database.SessionLocal()
+    try:
+        row = db.execute(select(models.EnhanceJob).where(
+            models.EnhanceJob.id == job_id,
+            or_(models.EnhanceJob.finished_at.is_(None), models.EnhanceJob.finished_at >= cutoff)
+        )).scalar_one_or_none()
+    finally:
+        db.close()
+    if row is None:
+        return None
+    job = Job(row.user_id, row.filter_type, None, row.output_filename, None)
+    job.id = row.id
+    job.created_at = _epoch(row.created_at)
+    job.finished_at = _epoch(row.finished_at)
+    job.error = row.error
+    return job
+
+
+def _record_history(job):
+    db = database.SessionLocal()
+    try:
+        db.add(models.ImageHistory(
+            user_id=job.user_id,
+            original_filename=job.original_filename,
+            enhanced_filename=job.output_filename
+        ))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def _finish_job(job, error=None):
+    try:
+        if error is not None:
+            raise error
+        if job.on_success is not None:
+            job.on_success(job)
+        _record_history(job)
+    except Exception as e:
+        job.error = str(e)
+        logger.error(f"Enhance job {job.id} failed: {str(e)}")
+    finally:
+        job.finished_at = time.time()
+    try:
+        _save_job(job)
+    except Exception as e:
+        logger.error(f"Could not save the status of job {job.id}: {str(e)}")
+
+
+def _copy_output(job, follower):
+    try:
+        shutil.copyfile(job.output_path, follower.output_path)
+    except Exception as e:
+        return e
+    return None
+
+
+def _on_job_done(job, future):
+    with _lock:
+        if job.key is not None and _in_flight.get(job.key) is job:
+            del _in_flight[job.key]
+        followers = job.followers
+    try:
+        error = future.exception()
+    except Exception as e:
+        # Cancelled at shutdown
+        error = e
+    # Followers get their own copy before on_success moves the output away
+    follower_errors = [error if error is not None else _copy_output(job, f) for f in followers]
+    _finish_job(job, error)
+    for follower, follower_error in zip(followers, follower_errors):
+        _finish_job(follower, follower_error)
+
+
+def _new_job(user_id, upload_path, filter_type, output_path):
+    return Job(
+        user_id=user_id,
+        filter_type=filter_type,
+        original_filename=os.path.basename(upload_path),
+        output_filename=os.path.basename(output_path),
+        output_path=output_path,
+    )
+
+
+def add_completed_job(user_id, upload_path, filter_type, output_path):
+    # Result was already available (e.g. from the cache); skip the pool
+    job = _new_job(user_id, upload_path, filter_type, output_path)
+    _record_history(job)
+    job.finished_at = time.time()
+    _save_job(job)
+    with _lock:
+        _jobs[job.id] = job
+    return job
+
+
+def submit_job(user_id, upload_path, filter_type, output_path, params=None, on_success=None, task=apply_filter,
+               key=None):
+    """Queue a job for the worker pool.
+
+    Jobs submitted with the same `key` while one is queued or running attach
+    to it instead: they complete with a copy of its output, and each still
+    runs its own on_success and records its own history row.
+    """
+    pool = get_pool()
+    job = _new_job(user_id, upload_path, filter_type, output_path)
+    job.on_success = on_success
+    # Written before the job can finish, so the final status is never overwritten
+    _save_job(job)
+    try:
+        return _submit(pool, job, upload_path, filter_type, output_path, params, task, key)
+    except QueueFullError:
+        _forget_job(job)
+        raise
+
+
+def _submit(pool, job, upload_path, filter_type, output_path, params, task, key):
+    with _lock:
+        _prune_jobs(time.time())
+        leader = _in_flight.get(key) if key is not None else None
+        if leader is not None:
+            job.future = leader.future
+            leader.followers.append(job)
+            _jobs[job.id] = job
+            ENHANCE_RUNS.inc(mode="job", outcome=COALESCED)
+            return job
+        if _pending_count() >= MAX_QUEUE_SIZE:
+            raise QueueFullError("Enhance queue is full, retry later")
+        _jobs[job.id] = job
+        job.future = pool.submit(task, upload_path, filter_type, output_path, params)
+        if key is not None:
+            job.key = key
+            _in_flight[key] = job
+        ENHANCE_RUNS.inc(mode="job", outcome=EXECUTED)
+    job.future.add_done_callback(lambda future: _on_job_done(job, future))
+    return job
+
+
+def pending_jobs():
+    with _lock:
+        return _pending_count()
+
+
+def get_job(job_id):
+    # Blocking: jobs from other worker processes are read from the database
+    with _lock:
+        job = _jobs.get(job_id)
+    return job if job is not None else _load_job(job_id)
+
+
+def shutdown():
+    global _pool
+    with _lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
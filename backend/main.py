@@ -1,21 +1,31 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Depends
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Depends, Query, BackgroundTasks, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 import uvicorn
-import shutil
+import hashlib
+import json
 import os
+import time
 import uuid
+from datetime import datetime
+from typing import List
+from urllib.parse import quote
+from sqlalchemy import bindparam, select, tuple_
 from sqlalchemy.orm import Session
 
-from .enhancer import apply_filter
-from . import database, models, auth
-
-# Create Database Tables
-models.Base.metadata.create_all(bind=database.engine)
+from .enhancer import apply_filter, apply_filter_bytes, get_filter, warm_up, FILTERS, WARMUP_ENABLED
+from .pipeline import apply_pipeline, apply_pipeline_bytes
+from .cache import ResultCache, make_key
+from . import database, models, auth, jobs, batch, preview, metrics, passwords, history, uploads, formats, files, storage, buffers, offload, video, coalesce
 
 app = FastAPI()
 
+# Cap upload bodies while they stream in, before Starlette spools them to disk.
+# Added first so it sits inside CORS, and its 413s carry the CORS headers.
+app.add_middleware(uploads.UploadLimitMiddleware)
+
 # Enable CORS
 app.add_middleware(
     CORSMiddleware,
@@ -29,10 +39,55 @@ app.add_middleware(
 UPLOAD_DIR = "uploads"
 OUTPUT_DIR = "outputs"
 TEMPLATES_DIR = "templates"
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 500
+
+# Created on startup, together with the tables and directories they use:
+# enhanced outputs keyed by (upload hash, filter, params), and uploads and
+# outputs deduplicated, sharded, with quotas and a background sweep
+result_cache = None
+file_store = None
+
+# Per-filter timings of the startup warm-up
+warmup_timings = {}
+
+# Identical enhancements in flight, keyed like the result cache; requests
+# arriving while one runs wait for it instead of running the filters again
+enhance_flights = coalesce.SingleFlight()
+
+# Scrape-time gauges for /metrics
+metrics.Gauge(
+    "result_cache", "Result cache counters and sizes",
+    lambda: {(name,): value for name, value in result_cache.stats().items()} if result_cache else {}, ("stat",)
+)
+metrics.Gauge("jobs_pending", "Queued or running async jobs", jobs.pending_jobs)
+metrics.Gauge("enhance_in_flight", "Distinct inline enhancements running", enhance_flights.in_flight)
+metrics.Gauge(
+    "buffer_pool", "Filter output buffer pool counters and sizes",
+    lambda: {(name,): value for name, value in buffers.pool.stats().items()}, ("stat",)
+)
+metrics.Gauge(
+    "filter_concurrency", "Requests running and waiting per filter, and the limit",
+    lambda: {(name, state): value for name, limit in offload.stats().items() for state, value in limit.items()},
+    ("filter", "state")
+)
+metrics.Gauge(
+    "filter_warmup_ms", "Time each filter took in the startup warm-up",
+    lambda: {(name,): ms for name, ms in warmup_timings.items()}, ("filter",)
+)
 
-# Ensure directories exist
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-os.makedirs(OUTPUT_DIR, exist_ok=True)
+@app.middleware("http")
+async def record_request_duration(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    # Label by route template, not the raw path, to keep cardinality bounded
+    route = request.scope.get("route")
+    metrics.HTTP_REQUEST_SECONDS.observe(
+        time.perf_counter() - start,
+        method=request.method, route=route.path if route is not None else "unmatched",
+        status=response.status_code
+    )
+    return response
 
 # Include Auth Router
 app.include_router(auth.router)
@@ -40,97 +95,673 @@ app.include_router(auth.router)
 # Mount Static Files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
+@app.on_event("startup")
+def prepare_storage():
+    global result_cache, file_store
+    models.Base.metadata.create_all(bind=database.engine)
+    # create_all skips tables that already exist, so indexes added later are created here
+    for index in models.ImageHistory.__table__.indexes:
+        index.create(bind=database.engine, checkfirst=True)
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    result_cache = ResultCache(os.path.join(OUTPUT_DIR, ".cache"))
+    file_store = storage.Storage(database.engine, {storage.UPLOAD: UPLOAD_DIR, storage.OUTPUT: OUTPUT_DIR})
+    file_store.start_gc()
+
+@app.on_event("startup")
+def warm_up_filters():
+    # One small pass per filter, so the first real request is not a cold start
+    if WARMUP_ENABLED:
+        warmup_timings.update(warm_up())
+
+@app.on_event("shutdown")
+def shutdown_workers():
+    jobs.shutdown()
+    offload.shutdown()
+    video.shutdown()
+    passwords.shutdown()
+    history.writer.close()
+    file_store.stop_gc()
+
 # --- Page Routes ---
 
 @app.get("/")
-def read_root():
+async def read_root():
     return FileResponse(os.path.join(TEMPLATES_DIR, "landing.html"))
 
 @app.get("/login")
-def login_page():
+async def login_page():
     return FileResponse(os.path.join(TEMPLATES_DIR, "login.html"))
 
 @app.get("/register")
-def register_page():
+async def register_page():
     return FileResponse(os.path.join(TEMPLATES_DIR, "register.html"))
 
 @app.get("/dashboard")
-def dashboard_page():
+async def dashboard_page():
     return FileResponse(os.path.join(TEMPLATES_DIR, "dashboard.html"))
 
 # --- Protected Enhance Route ---
 
+async def _read_upload(file: UploadFile):
+    # Size cap, magic bytes and header-only dimension check before any decode
+    try:
+        return await uploads.read_upload_async(file)
+    except uploads.InvalidUpload as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+def _save_upload(file: UploadFile, upload_path: str):
+    # As _read_upload, but streamed to disk; -> sha256 hex digest
+    try:
+        return uploads.save_upload(file, upload_path)[0]
+    except uploads.InvalidUpload as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+def _check_quota(user_id: int, incoming_bytes: int):
+    try:
+        file_store.check_quota(user_id, incoming_bytes)
+    except storage.QuotaExceeded as e:
+        raise HTTPException(status_code=507, detail=str(e))
+
+def _persist_result(user_id: int, data: bytes, content_hash: str, unique_filename: str,
+                    result: bytes, output_filename: str, cache_key: str = None):
+    # Runs after the response has been sent
+    paths = file_store.store(user_id, [
+        (storage.UPLOAD, unique_filename, data, content_hash),
+        (storage.OUTPUT, output_filename, result, None),
+    ])
+    if cache_key is not None:
+        result_cache.put(cache_key, paths[output_filename], data=result)
+
+def _content_disposition(filename: str):
+    # Same header FileResponse(filename=...) would send
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+def _result_cache_key(content_hash: str, filter_type: str, output: formats.OutputOptions, params: dict):
+    # The output format and encoder settings change the bytes as much as the filter does
+    return make_key(content_hash, filter_type, {**params, **output.key_params()})
+
+def _resolve_output(filename: str, output_format, accept, quality, progressive, optimize, png_compression):
+    # Explicit output_format, else the Accept header, else the upload's own format
+    try:
+        return formats.resolve_output(
+            os.path.splitext(filename)[1], output_format, accept, quality, progressive, optimize, png_compression
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _output_filename(unique_filename: str, output: formats.OutputOptions):
+    return f"enhanced_{os.path.splitext(unique_filename)[0]}{output.ext}"
+
+def _resolve_filter(filter_type, filters, width, height, reorder, max_memory_mb, parallelism):
+    # Either a single filter or a pipeline spec like "denoise,contrast,resize:800x"
+    if filters:
+        try:
+            names = offload.filter_names(filters, pipeline=True)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        filter_type = filters
+        process, process_bytes = apply_pipeline, apply_pipeline_bytes
+        key_params = {"reorder": reorder}
+    elif filter_type:
+        # Checked against the registry before the upload is read
+        try:
+            spec = get_filter(filter_type)
+            if filter_type == 'resize':
+                spec.validate({"width": width, "height": height})
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if not spec.standalone:
+            raise HTTPException(status_code=400, detail=f"Filter '{filter_type}' needs arguments; use filters={spec.usage()}")
+        names = offload.filter_names(filter_type)
+        process, process_bytes = apply_filter, apply_filter_bytes
+        # Only resize reads the dimensions
+        key_params = {"width": width, "height": height} if filter_type == 'resize' else {}
+    else:
+        raise HTTPException(status_code=400, detail="Either filter_type or filters is required")
+    # Memory cap and parallelism only change how tiles run, not the pixels
+    params = {**key_params, "memory_cap_mb": max_memory_mb, "parallelism": parallelism}
+    return filter_type, names, process, process_bytes, key_params, params
+
+def _lookup_result(data: bytes, filter_type: str, output: formats.OutputOptions, key_params: dict,
+                   timer=metrics.NULL_TIMER):
+    # -> (cached result or None, upload hash, cache key)
+    with timer.stage("cache"):
+        content_hash = hashlib.sha256(data).hexdigest()
+        cache_key = _result_cache_key(content_hash, filter_type, output, key_params)
+        return result_cache.get_bytes(cache_key), content_hash, cache_key
+
+def _enhance_bytes(data: bytes, filter_type: str, names, process_bytes, output: formats.OutputOptions,
+                   key_params: dict, params: dict, timer=metrics.NULL_TIMER):
+    # -> (result, upload hash, cache key to store the result under or None on a cache hit).
+    # Blocking: for worker threads, which wait for the filter slots in place.
+    result, content_hash, cache_key = _lookup_result(data, filter_type, output, key_params, timer)
+    if result is not None:
+        return result, content_hash, None
+    params = {**params, "output": output}
+
+    def run():
+        with offload.holding(names):
+            result = process_bytes(data, filter_type, output.ext, params=params, timer=timer)
+        return result, timer.shared()
+
+    result, shared = enhance_flights.do(cache_key, run, timer)
+    # Requests that joined this one report the same auto plan as the one that ran it
+    timer.adopt(shared)
+    return result, content_hash, cache_key
+
+async def _enhance_bytes_async(data: bytes, filter_type: str, names, process_bytes, output: formats.OutputOptions,
+                               key_params: dict, params: dict, timer=metrics.NULL_TIMER, coalesce=True):
+    # As _enhance_bytes; hashing and the cache read go to the threadpool, filters to the CPU executor.
+    # coalesce=False runs the filters even if an identical request is in flight.
+    result, content_hash, cache_key = await run_in_threadpool(
+        _lookup_result, data, filter_type, output, key_params, timer
+    )
+    if result is not None:
+        return result, content_hash, None
+    params = {**params, "output": output}
+
+    async def start():
+        result = await offload.run(names, process_bytes, data, filter_type, output.ext, params=params, timer=timer)
+        return result, timer.shared()
+
+    if coalesce:
+        result, shared = await enhance_flights.do_async(cache_key, start, timer)
+        timer.adopt(shared)
+    else:
+        result, _ = await start()
+    return result, content_hash, cache_key
+
+def _profiled(func, profilers: list):
+    # Samples the CPU thread func ends up running on
+    def wrapper(*args, **kwargs):
+        with metrics.SamplingProfiler() as profiler:
+            profilers.append(profiler)
+            return func(*args, **kwargs)
+    return wrapper
+
+def _filter_busy(e: offload.FilterBusyError):
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "5"})
+
+def _queue_job(file: UploadFile, user_id: int, filter_type: str, process, output: formats.OutputOptions,
+               key_params: dict, params: dict, unique_filename: str, output_filename: str):
+    # Blocking: streams the upload to disk and queries the quota and cache; run in the threadpool.
+    # Workers read the upload from the staging area and both files move into
+    # storage once the job succeeds.
+    upload_path = file_store.staging_path(storage.UPLOAD, unique_filename)
+    output_path = file_store.staging_path(storage.OUTPUT, output_filename)
+    content_hash = _save_upload(file, upload_path)
+    try:
+        _check_quota(user_id, os.path.getsize(upload_path))
+    except HTTPException:
+        os.remove(upload_path)
+        raise
+    cache_key = _result_cache_key(content_hash, filter_type, output, key_params)
+    params = {**params, "output": output}
+
+    def store_result(job, cache_result=True):
+        # Link into the cache before storage takes the staged output over
+        if cache_result:
+            result_cache.put(cache_key, output_path)
+        file_store.store(user_id, [
+            (storage.UPLOAD, unique_filename, upload_path, content_hash),
+            (storage.OUTPUT, output_filename, output_path, None),
+        ])
+
+    try:
+        if result_cache.get(cache_key, output_path) is not None:
+            store_result(None, cache_result=False)
+            job = jobs.add_completed_job(user_id, upload_path, filter_type, output_path)
+        else:
+            job = jobs.submit_job(
+                user_id, upload_path, filter_type, output_path, params=params,
+                on_success=store_result, task=process, key=cache_key
+            )
+    except jobs.QueueFullError as e:
+        os.remove(upload_path)
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "5"})
+    return JSONResponse(
+        status_code=202,
+        content={**job.to_dict(), "status_url": f"/jobs/{job.id}"}
+    )
+
+# Async: uploads are read and responses sent on the event loop, blocking
+# storage and database calls go to the threadpool and filters to the CPU
+# executor, which limits how many requests run each filter at once
+
 @app.post("/enhance")
-def enhance_image(
+async def enhance_image(
+    request: Request,
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...), 
-    filter_type: str = Form(...),
+    filter_type: str = Form(None),
+    filters: str = Form(None),
     width: int = Form(None),
     height: int = Form(None),
+    reorder: bool = Form(True),
+    max_memory_mb: int = Form(None),
+    parallelism: int = Form(None),
+    persist: bool = Form(True),
+    output_format: str = Form(None),
+    quality: int = Form(None),
+    progressive: bool = Form(False),
+    optimize: bool = Form(False),
+    png_compression: int = Form(None),
+    run_async: bool = Query(False, alias="async"),
+    profile: bool = Query(False),
     current_user: models.User = Depends(auth.get_current_user), # Protected Route
-    db: Session = Depends(database.get_db)
 ):
+    timer = metrics.StageTimer()
     # Validate file type
     if file.filename.split(".")[-1].lower() not in ["jpg", "jpeg", "png"]:
          raise HTTPException(status_code=400, detail="Invalid file type. Only JPG, JPEG, PNG are supported.")
 
+    filter_type, names, process, process_bytes, key_params, params = _resolve_filter(
+        filter_type, filters, width, height, reorder, max_memory_mb, parallelism
+    )
+    output = _resolve_output(
+        file.filename, output_format, request.headers.get("accept"), quality, progressive, optimize, png_compression
+    )
+
     # Generate unique filename
     unique_filename = f"{uuid.uuid4()}_{file.filename}"
-    upload_path = os.path.join(UPLOAD_DIR, unique_filename)
-    output_filename = f"enhanced_{unique_filename}"
-    output_path = os.path.join(OUTPUT_DIR, output_filename)
+    output_filename = _output_filename(unique_filename, output)
+
+    # Queue for the worker pool and return immediately
+    if run_async:
+        return await run_in_threadpool(
+            _queue_job, file, current_user.id, filter_type, process, output, key_params, params,
+            unique_filename, output_filename
+        )
 
-    # Save uploaded file
-    with open(upload_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # Decode, filter and encode straight from the upload buffer
+    with timer.stage("upload"):
+        data = await _read_upload(file)
+    if persist:
+        # Checked against the upload; the result is charged once it is stored
+        await run_in_threadpool(_check_quota, current_user.id, len(data))
 
+    # Sampling profiler for this request only, when enabled on the server
+    profilers = []
+    profiling = profile and metrics.PROFILING_ENABLED
+    if profiling:
+        process_bytes = _profiled(process_bytes, profilers)
     try:
-        # Process image
-        apply_filter(upload_path, filter_type, output_path, params={"width": width, "height": height})
-        
-        # Save to History
-        history_item = models.ImageHistory(
-            user_id=current_user.id,
-            original_filename=unique_filename,
-            enhanced_filename=output_filename
+        # Process image, unless an identical request was already served or is
+        # running; a profiled request always runs its own
+        result, content_hash, cache_key = await _enhance_bytes_async(
+            data, filter_type, names, process_bytes, output, key_params, params, timer, coalesce=not profiling
         )
-        db.add(history_item)
-        db.commit()
-        db.refresh(history_item)
 
+        if persist:
+            # Save to History; the row is inserted by the batched history writer
+            # and the files themselves are stored after the response
+            history.writer.add(current_user.id, unique_filename, output_filename)
+            background_tasks.add_task(
+                _persist_result, current_user.id, data, content_hash, unique_filename,
+                result, output_filename, cache_key
+            )
+        elif cache_key is not None:
+            background_tasks.add_task(result_cache.put_bytes, cache_key, result, output.ext)
+
+    except offload.FilterBusyError as e:
+        raise _filter_busy(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    
-    # Return processed file
-    return FileResponse(output_path, media_type="image/jpeg", filename=output_filename)
+
+    # Pipelines share a label to keep cardinality bounded
+    label = "pipeline" if filters else filter_type
+    timer.observe(label, bytes_in=len(data), bytes_out=len(result), output_format=output.format)
+    headers = {"Content-Disposition": _content_disposition(output_filename), "Server-Timing": timer.server_timing()}
+    if output_format is None:
+        headers["Vary"] = "Accept"
+    if timer.auto_plan is not None:
+        # What the auto filter measured and which stages it chose
+        headers["X-Auto-Analysis"] = timer.auto_plan.describe_stats()
+        headers["X-Auto-Stages"] = timer.auto_plan.describe_stages()
+    if profilers:
+        headers["X-Profile-Id"] = metrics.store_profile(profilers[0], current_user.id)
+
+    # Return processed image from memory
+    return Response(content=result, media_type=output.media_type, headers=headers)
+
+# --- Preview Route ---
+
+@app.post("/enhance/preview")
+async def enhance_preview(
+    file: UploadFile = File(...),
+    filter_type: str = Form(None),
+    filters: str = Form(None),
+    width: int = Form(None),
+    height: int = Form(None),
+    reorder: bool = Form(True),
+    max_side: int = Form(preview.PREVIEW_MAX_SIDE, gt=0, le=preview.PREVIEW_MAX_SIDE_LIMIT),
+    budget_ms: int = Form(preview.PREVIEW_BUDGET_MS, gt=0, le=preview.PREVIEW_MAX_BUDGET_MS),
+    current_user: models.User = Depends(auth.get_current_user), # Protected Route
+):
+    # Low-resolution result for interactive tweaking; nothing is stored.
+    # POST /enhance with the same fields renders the full-resolution result.
+    if file.filename.split(".")[-1].lower() not in ["jpg", "jpeg", "png"]:
+         raise HTTPException(status_code=400, detail="Invalid file type. Only JPG, JPEG, PNG are supported.")
+    filter_type, names, _, _, _, params = _resolve_filter(filter_type, filters, width, height, reorder, None, None)
+
+    data = await _read_upload(file)
+    try:
+        result, info = await offload.run(
+            names, preview.render_preview, data, filter_type, params, pipeline=bool(filters),
+            max_side=max_side, budget_ms=budget_ms
+        )
+    except offload.FilterBusyError as e:
+        raise _filter_busy(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return Response(
+        content=result,
+        media_type="image/jpeg",
+        headers={
+            "X-Preview-Width": str(info["width"]),
+            "X-Preview-Height": str(info["height"]),
+            "X-Preview-Scale": f"{info['scale']:.4f}",
+            "X-Preview-Filter-Ms": f"{info['filter_ms']:.1f}",
+        }
+    )
+
+# --- Batch Route ---
+
+@app.post("/enhance/batch")
+def enhance_batch(
+    files: List[UploadFile] = File(...),
+    filter_type: str = Form(None),
+    filters: str = Form(None),
+    width: int = Form(None),
+    height: int = Form(None),
+    reorder: bool = Form(True),
+    max_memory_mb: int = Form(None),
+    parallelism: int = Form(None),
+    output_format: str = Form(None),
+    quality: int = Form(None),
+    progressive: bool = Form(False),
+    optimize: bool = Form(False),
+    png_compression: int = Form(None),
+    current_user: models.User = Depends(auth.get_current_user), # Protected Route
+):
+    if len(files) > batch.MAX_BATCH_FILES:
+        raise HTTPException(status_code=400, detail=f"At most {batch.MAX_BATCH_FILES} files per batch")
+    filter_type, names, _, process_bytes, key_params, params = _resolve_filter(
+        filter_type, filters, width, height, reorder, max_memory_mb, parallelism
+    )
+    # Without output_format each image keeps its own format; check the settings once up front
+    encode_settings = (output_format, None, quality, progressive, optimize, png_compression)
+    _resolve_output(".jpg", *encode_settings)
+    user_id = current_user.id
+    manifest = []
+
+    def process_one(file: UploadFile):
+        if file.filename.split(".")[-1].lower() not in ["jpg", "jpeg", "png"]:
+            return file.filename, None, None, "Invalid file type. Only JPG, JPEG, PNG are supported."
+        unique_filename = f"{uuid.uuid4()}_{file.filename}"
+        output = _resolve_output(file.filename, *encode_settings)
+        output_filename = _output_filename(unique_filename, output)
+        try:
+            data = uploads.read_upload(file)
+            file_store.check_quota(user_id, len(data))
+            result, content_hash, cache_key = _enhance_bytes(
+                data, filter_type, names, process_bytes, output, key_params, params
+            )
+            _persist_result(user_id, data, content_hash, unique_filename, result, output_filename, cache_key)
+        except Exception as e:
+            return file.filename, None, None, str(e)
+        # Queued as soon as the files are stored, so members already stored keep
+        # their history even if the client goes away before the archive ends
+        history.writer.add(user_id, unique_filename, output_filename)
+        return file.filename, output_filename, result, None
+
+    def results():
+        for filename, output_filename, result, error in batch.run_unordered(process_one, files):
+            if error is not None:
+                manifest.append({"filename": filename, "success": False, "message": error})
+                continue
+            manifest.append({"filename": filename, "success": True, "enhanced_filename": output_filename})
+            yield output_filename, result
+
+    def finish():
+        return [("manifest.json", json.dumps(manifest, indent=2))]
+
+    return StreamingResponse(
+        batch.stream_zip(results(), finish),
+        media_type="application/zip",
+        headers={"Content-Disposition": _content_disposition("enhanced_batch.zip")}
+    )
+
+# --- Video Route ---
+
+def _discard(*paths):
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+def _stage_clip(file: UploadFile, user_id: int, unique_filename: str):
+    # Blocking: -> (staged upload path, sha256 hex digest, clip kind)
+    upload_path = file_store.staging_path(storage.UPLOAD, unique_filename)
+    try:
+        content_hash, kind = uploads.save_upload(
+            file, upload_path, uploads.MAX_CLIP_UPLOAD_BYTES, probe=video.probe_clip
+        )
+    except uploads.InvalidUpload as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    try:
+        _check_quota(user_id, os.path.getsize(upload_path))
+    except HTTPException:
+        os.remove(upload_path)
+        raise
+    return upload_path, content_hash, kind
+
+@app.post("/enhance/video")
+async def enhance_video(
+    file: UploadFile = File(...),
+    filter_type: str = Form(None),
+    filters: str = Form(None),
+    width: int = Form(None),
+    height: int = Form(None),
+    reorder: bool = Form(True),
+    max_memory_mb: int = Form(None),
+    parallelism: int = Form(None),
+    temporal: bool = Form(False),
+    run_async: bool = Query(False, alias="async"),
+    current_user: models.User = Depends(auth.get_current_user), # Protected Route
+):
+    # Every frame of a video, GIF or APNG through the same filter or pipeline;
+    # the result is a clip of the same kind (videos come back as MP4)
+    filter_type, names, _, _, _, params = _resolve_filter(
+        filter_type, filters, width, height, reorder, max_memory_mb, parallelism
+    )
+    if temporal and (filters or filter_type != 'denoise'):
+        raise HTTPException(status_code=400, detail="temporal only applies to filter_type=denoise")
+    unique_filename = f"{uuid.uuid4()}_{file.filename}"
+    upload_path, content_hash, kind = await run_in_threadpool(_stage_clip, file, current_user.id, unique_filename)
+    # The kind found when the upload was validated, so the clip is not sniffed again
+    params = {**params, "pipeline": bool(filters), "temporal": temporal, "kind": kind}
+    ext, media_type = video.OUTPUT_FORMATS[kind]
+    output_filename = f"enhanced_{os.path.splitext(unique_filename)[0]}{ext}"
+    output_path = file_store.staging_path(storage.OUTPUT, output_filename)
+    user_id = current_user.id
+
+    def store_result(job=None):
+        return file_store.store(user_id, [
+            (storage.UPLOAD, unique_filename, upload_path, content_hash),
+            (storage.OUTPUT, output_filename, output_path, None),
+        ])
+
+    if run_async:
+        try:
+            # Blocking: the first job starts the process pool
+            job = await run_in_threadpool(
+                jobs.submit_job, user_id, upload_path, filter_type, output_path, params=params,
+                on_success=store_result, task=video.enhance_clip
+            )
+        except jobs.QueueFullError as e:
+            os.remove(upload_path)
+            raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "5"})
+        return JSONResponse(
+            status_code=202,
+            content={**job.to_dict(), "status_url": f"/jobs/{job.id}"}
+        )
+
+    try:
+        await offload.run(names, video.enhance_clip, upload_path, filter_type, output_path, params)
+    except offload.FilterBusyError as e:
+        _discard(upload_path, output_path)
+        raise _filter_busy(e)
+    except ValueError as e:
+        # Unreadable clip, or too many frames
+        _discard(upload_path, output_path)
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        _discard(upload_path, output_path)
+        raise HTTPException(status_code=500, detail=str(e))
+
+    paths = await run_in_threadpool(store_result)
+    history.writer.add(user_id, unique_filename, output_filename)
+    return FileResponse(paths[output_filename], media_type=media_type, filename=output_filename)
+
+# --- Job Routes ---
+
+def _get_user_job(job_id: str, current_user: models.User):
+    job = jobs.get_job(job_id)
+    if job is None or job.user_id != current_user.id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/jobs/{job_id}")
+def get_job_status(job_id: str, current_user: models.User = Depends(auth.get_current_user)):
+    return _get_user_job(job_id, current_user).to_dict()
+
+@app.get("/jobs/{job_id}/result")
+def get_job_result(job_id: str, current_user: models.User = Depends(auth.get_current_user)):
+    job = _get_user_job(job_id, current_user)
+    status = job.status
+    if status == jobs.FAILED:
+        raise HTTPException(status_code=500, detail=job.error)
+    if status != jobs.DONE:
+        return JSONResponse(status_code=202, content=job.to_dict())
+    path = file_store.local_path(storage.OUTPUT, job.output_filename)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Result no longer stored")
+    return FileResponse(path, media_type=formats.media_type_for(path), filename=job.output_filename)
+
+@app.get("/filters")
+async def list_filters():
+    # Filters usable as filter_type or in a filters pipeline, with their parameters
+    return [spec.describe() for spec in FILTERS.values() if not spec.internal]
+
+@app.get("/cache/stats")
+def get_cache_stats(current_user: models.User = Depends(auth.get_current_user)):
+    return result_cache.stats()
+
+@app.get("/storage/usage")
+def get_storage_usage(current_user: models.User = Depends(auth.get_current_user)):
+    return file_store.usage(current_user.id)
+
+# --- Metrics Routes ---
+
+@app.get("/metrics")
+def get_metrics():
+    return PlainTextResponse(metrics.render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/metrics/profiles/{profile_id}")
+def get_profile(profile_id: str, current_user: models.User = Depends(auth.get_current_user)):
+    # Collapsed stacks, one "frame;frame;frame count" line per stack
+    profile = metrics.get_profile(profile_id, current_user.id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(profile)
 
 # --- History Routes ---
 
+def _history_cursor(timestamp: datetime, item_id: int):
+    return f"{timestamp.isoformat()},{item_id}"
+
+def _parse_history_cursor(after: str):
+    # "<ISO timestamp>,<id>", as sent in X-Next-Cursor
+    timestamp, _, item_id = after.rpartition(",")
+    try:
+        return datetime.fromisoformat(timestamp), int(item_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _etag_matches(if_none_match: str, etag: str):
+    if if_none_match is None:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    # Weak comparison, as required for If-None-Match
+    return "*" in tags or etag.removeprefix("W/") in (tag.removeprefix("W/") for tag in tags)
+
 @app.get("/history")
 def get_user_history(
+    request: Request,
+    after: str = Query(None),
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_MAX_PAGE_SIZE),
     current_user: models.User = Depends(auth.get_current_user),
     db: Session = Depends(database.get_db)
 ):
-    history_items = db.query(models.ImageHistory).filter(models.ImageHistory.user_id == current_user.id).order_by(models.ImageHistory.timestamp.desc()).all()
-    return [{
-        "id": item.id,
-        "original_filename": item.original_filename,
-        "enhanced_filename": item.enhanced_filename,
-        "timestamp": item.timestamp.isoformat()
-    } for item in history_items]
+    # Newest first, one page per request; pass X-Next-Cursor back as `after` for the next page.
+    # The cursor's timestamp is bound with the column's own type, so it compares
+    # as a timestamp on every database and equal timestamps fall back to the id.
+    ImageHistory = models.ImageHistory
+    query = select(
+        ImageHistory.id, ImageHistory.original_filename, ImageHistory.enhanced_filename, ImageHistory.timestamp
+    ).where(ImageHistory.user_id == current_user.id)
+    if after:
+        timestamp, item_id = _parse_history_cursor(after)
+        # A row-value comparison lets the index seek straight to the cursor
+        query = query.where(tuple_(ImageHistory.timestamp, ImageHistory.id) < tuple_(
+            bindparam("after_timestamp", timestamp, type_=ImageHistory.timestamp.type), item_id
+        ))
+    # Read-your-writes: wait for this user's rows still queued in the history writer
+    history.writer.flush(current_user.id)
+    rows = db.execute(query.order_by(ImageHistory.timestamp.desc(), ImageHistory.id.desc()).limit(limit + 1)).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _history_cursor(rows[-1].timestamp, rows[-1].id)
+
+    # Fingerprint of exactly what this page would contain
+    digest = hashlib.sha1(repr([(row.id, row.timestamp, row.enhanced_filename) for row in rows]).encode())
+    etag = f'W/"{digest.hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if next_cursor is not None:
+        headers["X-Next-Cursor"] = next_cursor
+        headers["Link"] = f'</history?after={quote(next_cursor)}&limit={limit}>; rel="next"'
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    return JSONResponse(
+        content=[{
+            "id": row.id,
+            "original_filename": row.original_filename,
+            "enhanced_filename": row.enhanced_filename,
+            "timestamp": row.timestamp.isoformat()
+        } for row in rows],
+        headers=headers
+    )
+
+# Both routes send strong ETags and immutable cache headers, answer conditional
+# requests with 304, support byte ranges, and serve thumbnails for ?w=<width>
 
 @app.get("/uploads/{filename}")
-def get_upload(filename: str):
-    path = os.path.join(UPLOAD_DIR, filename)
-    if os.path.exists(path):
-        return FileResponse(path)
-    return HTTPException(status_code=404)
+def get_upload(request: Request, filename: str, w: int = Query(None)):
+    path = file_store.local_path(storage.UPLOAD, filename)
+    return files.serve_file(path, request.headers, w, file_store.thumbnail_dir(storage.UPLOAD))
 
 @app.get("/outputs/{filename}")
-def get_output(filename: str):
-    path = os.path.join(OUTPUT_DIR, filename)
-    if os.path.exists(path):
-        return FileResponse(path)
-    return HTTPException(status_code=404)
+def get_output(request: Request, filename: str, w: int = Query(None)):
+    path = file_store.local_path(storage.OUTPUT, filename)
+    return files.serve_file(path, request.headers, w, file_store.thumbnail_dir(storage.OUTPUT))
 
 
 if __name__ == "__main__":
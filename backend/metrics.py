@@ -0,0 +1,242 @@
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter as _Tally, OrderedDict
+from contextlib import contextmanager
+
+# Profiling configuration
+PROFILING_ENABLED = os.getenv("ENABLE_PROFILING", "0") == "1"
+PROFILE_INTERVAL_SECONDS = float(os.getenv("PROFILE_INTERVAL_MS", 5)) / 1000
+MAX_STORED_PROFILES = 32
+
+_registry = []
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (extra or [])
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Gauge:
+    # Value is read from a callback at scrape time: fn() -> number or {label tuple: number}
+    def __init__(self, name, documentation, fn, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+        _registry.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        values = self.fn()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, buckets, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = tuple(labelnames)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    labels = _format_labels(self.labelnames, key, [("le", repr(float(bound)))])
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _format_labels(self.labelnames, key, [("le", "+Inf")])
+                lines.append(f"{self.name}_bucket{labels} {series[-1]}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {series[-2]}")
+                lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+
+def render_metrics():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- Enhance path metrics ---
+
+_SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+_BYTES_BUCKETS = tuple(1024 * 2 ** i for i in range(0, 18, 2))  # 1 KiB .. 64 GiB
+_MEGAPIXEL_BUCKETS = (0.1, 0.5, 1, 2, 4, 8, 12, 16, 24, 48, 100)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "HTTP request latency", _SECONDS_BUCKETS, ("method", "route", "status")
+)
+ENHANCE_STAGE_SECONDS = Histogram(
+    "enhance_stage_duration_seconds", "Time spent in each stage of /enhance", _SECONDS_BUCKETS, ("stage", "filter")
+)
+ENHANCE_BYTES_IN = Histogram("enhance_bytes_in", "Upload size", _BYTES_BUCKETS, ("filter",))
+ENHANCE_BYTES_OUT = Histogram("enhance_bytes_out", "Encoded result size", _BYTES_BUCKETS, ("filter", "format"))
+ENHANCE_MEGAPIXELS = Histogram("enhance_image_megapixels", "Decoded image size", _MEGAPIXEL_BUCKETS, ("filter",))
+
+
+class StageTimer:
+    """Collects per-stage durations for one request."""
+
+    def __init__(self):
+        self.stages = OrderedDict()
+        self.megapixels = None
+        self.auto_plan = None  # analysis.AutoPlan when the auto filter ran
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def shared(self):
+        # What requests coalesced onto this one copy: the auto filter's plan and analysis time
+        return self.auto_plan, self.stages.get("analysis")
+
+    def adopt(self, shared):
+        auto_plan, analysis_seconds = shared
+        if auto_plan is not None:
+            self.auto_plan = auto_plan
+        if analysis_seconds is not None:
+            self.stages["analysis"] = analysis_seconds
+
+    def server_timing(self):
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items())
+
+    def observe(self, filter_label, bytes_in=None, bytes_out=None, output_format=""):
+        for name, seconds in self.stages.items():
+            ENHANCE_STAGE_SECONDS.observe(seconds, stage=name, filter=filter_label)
+        if bytes_in is not None:
+            ENHANCE_BYTES_IN.observe(bytes_in, filter=filter_label)
+        if bytes_out is not None:
+            ENHANCE_BYTES_OUT.observe(bytes_out, filter=filter_label, format=output_format)
+        if self.megapixels is not None:
+            ENHANCE_MEGAPIXELS.observe(self.megapixels, filter=filter_label)
+
+
+class _NullTimer:
+    megapixels = None
+    auto_plan = None
+
+    @contextmanager
+    def stage(self, name):
+        yield
+
+    def shared(self):
+        return None, None
+
+    def adopt(self, shared):
+        pass
+
+
+NULL_TIMER = _NullTimer()
+
+
+# --- Sampling profiler ---
+
+_profiles = OrderedDict()
+_profiles_lock = threading.Lock()
+
+
+class SamplingProfiler:
+    """Samples one thread's Python stack at a fixed interval.
+
+    The result is in collapsed-stack format ("frame;frame;frame count" per
+    line), which flamegraph.pl and speedscope read directly.
+    """
+
+    def __init__(self, thread_id=None, interval=PROFILE_INTERVAL_SECONDS):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.samples = _Tally()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self):
+        return "\n".join(f"{stack} {count}" for stack, count in self.samples.most_common()) + "\n"
+
+
+def store_profile(profiler, user_id):
+    profile_id = uuid.uuid4().hex
+    with _profiles_lock:
+        _profiles[profile_id] = (user_id, profiler.collapsed())
+        while len(_profiles) > MAX_STORED_PROFILES:
+            _profiles.popitem(last=False)
+    return profile_id
+
+
+def get_profile(profile_id, user_id):
+    # Only the user whose request was profiled gets its stacks
+    with _profiles_lock:
+        owner, profile = _profiles.get(profile_id, (None, None))
+    return profile if owner == user_id else None
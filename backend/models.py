@@ -2,7 +2,8 @@ from sqlalchemy import Column, Integer, String, DateTime
 from datetime import datetime
 from .database import Base
 
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, func
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index, func
+from sqlalchemy.dialects import sqlite
 from sqlalchemy.orm import relationship
 from .database import Base
 
@@ -23,8 +24,73 @@ class ImageHistory(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
-    original_filename = Column(String)
-    enhanced_filename = Column(String)
-    timestamp = Column(DateTime(timezone=True), server_default=func.now())
+    # Indexed for the storage sweep, which matches stored files to history rows
+    original_filename = Column(String, index=True)
+    enhanced_filename = Column(String, index=True)
+    # SQLite stores this as text. CURRENT_TIMESTAMP has no fractional seconds,
+    # so bound values drop them too, and /history cursors compare like the rows.
+    timestamp = Column(
+        DateTime(timezone=True).with_variant(sqlite.DATETIME(truncate_microseconds=True), "sqlite"),
+        server_default=func.now()
+    )
 
     user = relationship("User", back_populates="history")
+
+    __table_args__ = (
+        # Serves /history: one user's rows, newest first, with id as tie-breaker
+        Index("ix_image_history_user_timestamp", "user_id", timestamp.desc(), id.desc()),
+    )
+
+
+class StoredFile(Base):
+    """Public name of an upload or output -> its content in storage."""
+    __tablename__ = "stored_files"
+
+    kind = Column(String, primary_key=True)  # "upload" or "output"
+    name = Column(String, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    blob = Column(String)  # content hash + extension, shared by identical files
+    size = Column(Integer)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+
+    __table_args__ = (
+        Index("ix_stored_files_kind_blob", "kind", "blob"),
+    )
+
+
+class StorageUsage(Base):
+    __tablename__ = "storage_usage"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    bytes = Column(Integer, default=0)
+    files = Column(Integer, default=0)
+    quota_bytes = Column(Integer, nullable=True)  # overrides STORAGE_USER_QUOTA_BYTES
+
+
+class StoredBlob(Base):
+    """Content in storage, one row per key.
+
+    store() touches last_used in the same transaction that references the
+    content; the sweep deletes content only by deleting this row, so the
+    two always see each other's writes.
+    """
+    __tablename__ = "stored_blobs"
+
+    kind = Column(String, primary_key=True)
+    key = Column(String, primary_key=True)  # content hash + extension
+    size = Column(Integer)
+    last_used = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+
+
+class EnhanceJob(Base):
+    """Status of an ?async=1 job, so any worker process can answer /jobs/{id}."""
+    __tablename__ = "enhance_jobs"
+
+    id = Column(String, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    filter_type = Column(String)
+    output_filename = Column(String)
+    status = Column(String)  # "queued", "done" or "failed"
+    error = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True))
+    finished_at = Column(DateTime(timezone=True), nullable=True, index=True)
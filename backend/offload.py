@@ -0,0 +1,211 @@
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+
+from .enhancer import FILTERS, HEAVY, MODERATE, LIGHT
+from .pipeline import parse_pipeline
+from . import metrics
+
+# CPU executor for filter work started by requests. OpenCV releases the GIL,
+# so threads run filters in parallel. The executor has more threads than
+# heavy filters may occupy, so light requests always find a free one.
+CPU_WORKERS = int(os.getenv("ENHANCE_CPU_WORKERS", max(2, os.cpu_count() or 1)))
+
+# How many requests may run each filter at once, by cost class;
+# ENHANCE_FILTER_CONCURRENCY overrides single filters, e.g. "denoise=1,auto=1".
+# A request waits for a slot of every filter it runs before taking a thread.
+COST_CONCURRENCY = {
+    HEAVY: max(1, CPU_WORKERS // 2),
+    MODERATE: CPU_WORKERS,
+    LIGHT: CPU_WORKERS,
+}
+# Requests allowed to wait for one filter's slots before new ones are refused
+FILTER_QUEUE_SIZE = int(os.getenv("ENHANCE_FILTER_QUEUE_SIZE", 64))
+
+
+def _parse_concurrency(value: str):
+    limits = {}
+    for item in value.split(","):
+        name, sep, limit = item.partition("=")
+        if sep:
+            limits[name.strip().lower()] = max(1, int(limit))
+    return limits
+
+
+FILTER_CONCURRENCY = _parse_concurrency(os.getenv("ENHANCE_FILTER_CONCURRENCY", ""))
+
+_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUEUE_WAIT_SECONDS = metrics.Histogram(
+    "filter_queue_wait_seconds", "Time requests wait for a filter slot and a CPU thread", _WAIT_BUCKETS, ("filter",)
+)
+REJECTED = metrics.Counter("filter_rejected_total", "Requests turned away with the filter queue full", ("filter",))
+
+
+class FilterBusyError(Exception):
+    pass
+
+
+class ConcurrencyLimit:
+    """Counting semaphore usable from threads and from any event loop.
+
+    Waiters are served in arrival order. Each waits on its own
+    concurrent.futures.Future, which the releasing thread completes.
+    """
+
+    def __init__(self, name: str, limit: int, queue_size: int = FILTER_QUEUE_SIZE):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self._active = 0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    def _try_acquire(self):
+        # -> None if a slot was taken, otherwise a Future to wait on
+        with self._lock:
+            if self._active < self.limit and not self._waiters:
+                self._active += 1
+                return None
+            if len(self._waiters) >= self.queue_size:
+                REJECTED.inc(filter=self.name)
+                raise FilterBusyError(f"Too many '{self.name}' requests waiting, retry later")
+            waiter = Future()
+            self._waiters.append(waiter)
+            return waiter
+
+    def acquire(self):
+        waiter = self._try_acquire()
+        if waiter is not None:
+            waiter.result()
+
+    async def acquire_async(self):
+        waiter = self._try_acquire()
+        if waiter is None:
+            return
+        try:
+            await asyncio.wrap_future(waiter)
+        except asyncio.CancelledError:
+            # Either still queued (the cancel takes it out) or already granted
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+            if not waiter.cancel():
+                self.release()
+            raise
+
+    def release(self):
+        # Hand the slot straight to the next live waiter
+        with self._lock:
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                if waiter.set_running_or_notify_cancel():
+                    waiter.set_result(None)
+                    return
+            self._active -= 1
+
+    def stats(self):
+        with self._lock:
+            return {"active": self._active, "waiting": len(self._waiters), "limit": self.limit}
+
+
+_limits = {}
+_limits_lock = threading.Lock()
+_executor = None
+
+
+def get_limit(name: str):
+    with _limits_lock:
+        limit = _limits.get(name)
+        if limit is None:
+            default = COST_CONCURRENCY[FILTERS[name].cost] if name in FILTERS else CPU_WORKERS
+            limit = _limits[name] = ConcurrencyLimit(name, FILTER_CONCURRENCY.get(name, default))
+        return limit
+
+
+def get_executor():
+    global _executor
+    with _limits_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix="cpu")
+        return _executor
+
+
+def filter_names(filter_type: str, pipeline: bool = False):
+    # Distinct filters a request runs, sorted so that slots are always taken in the same order
+    if pipeline:
+        return sorted({stage.name for stage in parse_pipeline(filter_type)})
+    return [filter_type]
+
+
+def _release_all(limits):
+    for limit in reversed(limits):
+        limit.release()
+
+
+async def _acquire_all(names):
+    held = []
+    try:
+        for name in names:
+            limit = get_limit(name)
+            await limit.acquire_async()
+            held.append(limit)
+    except BaseException:
+        _release_all(held)
+        raise
+    return held
+
+
+async def run(names, func, *args, **kwargs):
+    """Run func on the CPU executor once a slot of every filter in `names` is free.
+
+    The slots are released when func finishes, even if the awaiting request
+    has gone away, so abandoned work still counts against the limits.
+    """
+    submitted = time.perf_counter()
+    held = await _acquire_all(names)
+
+    def timed():
+        wait = time.perf_counter() - submitted
+        for name in names:
+            QUEUE_WAIT_SECONDS.observe(wait, filter=name)
+        return func(*args, **kwargs)
+
+    try:
+        future = get_executor().submit(timed)
+    except RuntimeError:
+        _release_all(held)
+        raise
+    future.add_done_callback(lambda _: _release_all(held))
+    return await asyncio.wrap_future(future)
+
+
+@contextmanager
+def holding(names):
+    # Blocking form for code already on a worker thread, e.g. batch items
+    held = []
+    try:
+        for name in names:
+            limit = get_limit(name)
+            limit.acquire()
+            held.append(limit)
+        yield
+    finally:
+        _release_all(held)
+
+
+def stats():
+    with _limits_lock:
+        limits = list(_limits.values())
+    return {limit.name: limit.stats() for limit in limits}
+
+
+def shutdown():
+    global _executor
+    with _limits_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
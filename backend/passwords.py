@@ -0,0 +1,145 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+from . import metrics
+
+# Password hashing configuration. bcrypt releases the GIL, so a small
+# thread pool bounds how much CPU login and registration bursts can take
+# from image processing.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", max(1, (os.cpu_count() or 1) // 2)))
+HASH_QUEUE_SIZE = int(os.getenv("PASSWORD_HASH_QUEUE_SIZE", HASH_WORKERS * 16))
+# Login attempts per (client address, email), and registrations per client address
+AUTH_RATE_PER_MINUTE = float(os.getenv("AUTH_RATE_LIMIT_PER_MINUTE", 20))
+REGISTER_RATE_PER_MINUTE = float(os.getenv("AUTH_REGISTER_RATE_LIMIT_PER_MINUTE", 20))
+
+_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="bcrypt")
+_pending = 0
+_lock = threading.Lock()
+
+_HASH_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUEUE_WAIT_SECONDS = metrics.Histogram(
+    "password_hash_queue_wait_seconds", "Time bcrypt calls wait for a hashing thread", _HASH_BUCKETS, ("op",)
+)
+HASH_SECONDS = metrics.Histogram(
+    "password_hash_duration_seconds", "Time spent inside bcrypt", _HASH_BUCKETS, ("op",)
+)
+REJECTED = metrics.Counter("password_hash_rejected_total", "Auth requests turned away", ("reason",))
+metrics.Gauge("password_hash_pending", "Queued or running bcrypt calls", lambda: _pending)
+
+
+class HashQueueFullError(Exception):
+    pass
+
+
+def hash_password(password: str, rounds: int = None):
+    salt = bcrypt.gensalt(rounds or BCRYPT_ROUNDS)
+    return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+
+
+def verify_password(plain_password: str, hashed_password: str):
+    try:
+        return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
+    except Exception:
+        return False
+
+
+def needs_rehash(hashed_password: str):
+    # "$2b$<cost>$<salt+hash>"
+    try:
+        return int(hashed_password.split("$")[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return False
+
+
+def _release(future=None):
+    global _pending
+    with _lock:
+        _pending -= 1
+
+
+async def _run(op: str, func, *args):
+    # Off the event loop and off the request threadpool, with a bounded queue
+    global _pending
+    with _lock:
+        if _pending >= HASH_QUEUE_SIZE:
+            REJECTED.inc(reason="queue_full")
+            raise HashQueueFullError("Too many sign-in requests, try again shortly")
+        _pending += 1
+    submitted = time.perf_counter()
+
+    def timed():
+        started = time.perf_counter()
+        QUEUE_WAIT_SECONDS.observe(started - submitted, op=op)
+        try:
+            return func(*args)
+        finally:
+            HASH_SECONDS.observe(time.perf_counter() - started, op=op)
+
+    try:
+        future = _executor.submit(timed)
+    except RuntimeError:
+        _release()
+        raise
+    # Released when bcrypt finishes, even if the client has gone away
+    future.add_done_callback(_release)
+    return await asyncio.wrap_future(future)
+
+
+async def hash_password_async(password: str):
+    return await _run("hash", hash_password, password)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str):
+    return await _run("verify", verify_password, plain_password, hashed_password)
+
+
+class RateLimiter:
+    """Token bucket per key: `rate_per_minute` sustained, bursts up to the same amount."""
+
+    MAX_KEYS = 10_000
+
+    def __init__(self, rate_per_minute: float):
+        self.rate = rate_per_minute / 60
+        self.capacity = max(1.0, rate_per_minute)
+        self._buckets = {}  # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    def check(self, key):
+        # -> 0 if allowed, otherwise seconds until the next attempt is allowed
+        if self.rate <= 0:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                REJECTED.inc(reason="rate_limited")
+                return (1 - tokens) / self.rate
+            self._buckets[key] = (tokens - 1, now)
+            if len(self._buckets) > self.MAX_KEYS:
+                self._prune(now)
+                if len(self._buckets) > self.MAX_KEYS:
+                    self._buckets.clear()
+        return 0
+
+    def _prune(self, now):
+        # Buckets that have refilled completely carry no state worth keeping
+        full = [key for key, (tokens, updated) in self._buckets.items()
+                if tokens + (now - updated) * self.rate >= self.capacity]
+        for key in full:
+            del self._buckets[key]
+
+
+login_rate_limiter = RateLimiter(AUTH_RATE_PER_MINUTE)
+register_rate_limiter = RateLimiter(REGISTER_RATE_PER_MINUTE)
+
+
+def shutdown():
+    _executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,185 @@
+import cv2
+import numpy as np
+
+from .enhancer import load_image, save_image, decode_image, encode_image, get_filter, run_filter
+from .analysis import plan_auto
+from .pointops import apply_lut, compose, contrast_lut, gamma_lut
+from .metrics import NULL_TIMER
+from . import buffers
+
+# Maximum number of stages accepted in one spec
+MAX_STAGES = 16
+
+
+class Stage:
+    def __init__(self, name, func, kwargs=None, needs_color=False, scale_invariant=False):
+        self.name = name
+        self.func = func
+        self.kwargs = kwargs or {}
+        # 3-channel BGR input required (HSV conversion, colored NLM)
+        self.needs_color = needs_color
+        # Downscaling before this stage gives the same result within tolerance
+        self.scale_invariant = scale_invariant
+
+    def target_size(self, height, width):
+        # Output (height, width) of a resize stage, mirrors resize_image()
+        w, h = self.kwargs.get("width"), self.kwargs.get("height")
+        if w is None and h is None:
+            return height, width
+        if w is None:
+            return h, int(width * (h / float(height)))
+        if h is None:
+            return int(height * (w / float(width))), w
+        return h, w
+
+    def __repr__(self):
+        return f"Stage({self.name}, {self.kwargs})"
+
+
+def _resize_args(args):
+    if len(args) != 1 or "x" not in args[0]:
+        raise ValueError("Usage: resize:<width>x<height>, resize:<width>x or resize:x<height>")
+    w, h = args[0].split("x", 1)
+    kwargs = {"width": int(w) if w else None, "height": int(h) if h else None}
+    if kwargs["width"] is None and kwargs["height"] is None:
+        raise ValueError("resize needs a width or a height")
+    if any(v is not None and v <= 0 for v in kwargs.values()):
+        raise ValueError("resize dimensions must be positive")
+    return kwargs
+
+
+# Filters whose arguments are not plain positional values
+ARG_PARSERS = {
+    "resize": _resize_args,
+}
+
+
+# Per-channel point operations whose lookup tables fuse into one cv2.LUT pass.
+# Brightness works on the HSV value channel, so it is not fused with these.
+POINT_LUTS = {
+    "contrast": contrast_lut,
+    "gamma": gamma_lut,
+}
+
+
+def parse_pipeline(spec: str):
+    """Parse "denoise,contrast:1.2,resize:800x" into a list of stages."""
+    stages = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, *args = item.split(":")
+        name = name.strip().lower()
+        filter_spec = get_filter(name)
+        try:
+            if name in ARG_PARSERS:
+                kwargs = filter_spec.validate(ARG_PARSERS[name](args))
+            else:
+                kwargs = filter_spec.parse_args(args)
+        except ValueError as e:
+            raise ValueError(f"Invalid stage '{item}': {e}")
+        stages.append(Stage(name, filter_spec.func, kwargs, filter_spec.needs_color, filter_spec.scale_invariant))
+    if not stages:
+        raise ValueError("Pipeline is empty")
+    if len(stages) > MAX_STAGES:
+        raise ValueError(f"Pipeline has more than {MAX_STAGES} stages")
+    return stages
+
+
+def plan_pipeline(stages, height, width):
+    """Hoist downscaling resizes ahead of the scale-invariant stages before them."""
+    planned = []
+    for stage in stages:
+        if stage.name == "resize":
+            new_h, new_w = stage.target_size(height, width)
+            if new_h * new_w < height * width:
+                pos = len(planned)
+                while pos > 0 and planned[pos - 1].scale_invariant:
+                    pos -= 1
+                planned.insert(pos, stage)
+            else:
+                planned.append(stage)
+            height, width = new_h, new_w
+        else:
+            planned.append(stage)
+    return planned
+
+
+def fuse_point_ops(stages):
+    """Collapse runs of adjacent per-channel point operations into one LUT stage."""
+    fused = []
+    run = []
+    for stage in stages + [None]:
+        if stage is not None and stage.name in POINT_LUTS:
+            run.append(stage)
+            continue
+        if len(run) == 1:
+            fused.append(run[0])
+        elif run:
+            lut = compose(*(POINT_LUTS[s.name](**s.kwargs) for s in run))
+            fused.append(Stage("lut", apply_lut, {"lut": lut}, scale_invariant=True))
+        run = []
+        if stage is not None:
+            fused.append(stage)
+    return fused
+
+
+def run_pipeline(image, stages, reorder=True, memory_cap_mb=None, workers=None, timer=NULL_TIMER):
+    if reorder:
+        stages = plan_pipeline(stages, *image.shape[:2])
+    stages = fuse_point_ops(stages)
+    source = image
+    for stage in stages:
+        inputs = [image]
+        if stage.needs_color and image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR, dst=buffers.take(image.shape + (3,)))
+            inputs.append(image)
+        kwargs = stage.kwargs
+        if stage.name == "auto":
+            # Planned on this stage's whole input, so every tile runs the same stages
+            kwargs = {**kwargs, "plan": plan_auto(image)}
+            timer.auto_plan = kwargs["plan"]
+        result = run_filter(stage.func, image, stage.name, memory_cap_mb, workers, **kwargs)
+        # A stage's inputs are read by that stage only; the source is the caller's
+        for used in inputs:
+            if used is not source and not np.may_share_memory(used, result):
+                buffers.release(used)
+        image = result
+    return image
+
+
+def apply_pipeline(image_path: str, spec: str, output_path: str, params: dict = None):
+    image = load_image(image_path)
+    if image is None:
+        raise ValueError("Could not load image")
+
+    params = params or {}
+    with buffers.lease():
+        processed = run_pipeline(
+            image, parse_pipeline(spec),
+            reorder=params.get('reorder', True), memory_cap_mb=params.get('memory_cap_mb'),
+            workers=params.get('parallelism')
+        )
+        save_image(processed, output_path, params.get('output'))
+    return output_path
+
+
+def apply_pipeline_bytes(data: bytes, spec: str, ext: str = ".jpg", params: dict = None, timer=NULL_TIMER):
+    with timer.stage("decode"):
+        image = decode_image(data)
+    if image is None:
+        raise ValueError("Could not load image")
+    timer.megapixels = image.shape[0] * image.shape[1] / 1_000_000
+
+    params = params or {}
+    # Stage outputs come from the buffer pool and go back once encoded
+    with buffers.lease():
+        with timer.stage("filter"):
+            processed = run_pipeline(
+                image, parse_pipeline(spec),
+                reorder=params.get('reorder', True), memory_cap_mb=params.get('memory_cap_mb'),
+                workers=params.get('parallelism'), timer=timer
+            )
+        with timer.stage("encode"):
+            return encode_image(processed, ext, options=params.get('output'))
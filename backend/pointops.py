@@ -0,0 +1,56 @@
+import cv2
+import numpy as np
+
+from . import buffers
+
+# Point operations compiled to 256-entry lookup tables, applied with cv2.LUT.
+# Tables of the same domain compose exactly: applying compose(a, b) once
+# gives the same pixels as applying a and then b.
+
+_RAMP = np.arange(256, dtype=np.uint8).reshape(1, 256)
+IDENTITY = _RAMP.ravel().copy()
+
+
+def contrast_lut(alpha=1.5, beta=0):
+    # Built with convertScaleAbs itself so rounding matches increase_contrast's original pass
+    return cv2.convertScaleAbs(_RAMP, alpha=alpha, beta=beta).ravel()
+
+
+def brightness_lut(value=30):
+    return np.clip(np.arange(256) + value, 0, 255).astype(np.uint8)
+
+
+def levels_lut(low, high, out_low=0, out_high=255):
+    # Linear map of input levels low..high onto out_low..out_high, clipped
+    scale = (out_high - out_low) / max(high - low, 1)
+    return np.clip(np.rint(out_low + (np.arange(256) - low) * scale), 0, 255).astype(np.uint8)
+
+
+def gamma_lut(gamma=1.0):
+    if gamma <= 0:
+        raise ValueError("gamma must be positive")
+    return np.clip(np.rint(255.0 * (np.arange(256) / 255.0) ** (1.0 / gamma)), 0, 255).astype(np.uint8)
+
+
+def compose(*luts):
+    """Fold tables applied left to right into one."""
+    result = IDENTITY
+    for lut in luts:
+        result = lut[result]
+    return result
+
+
+def apply_lut(image, lut):
+    # Same table on every channel (BGR or grayscale)
+    return cv2.LUT(image, lut, dst=buffers.take(image.shape))
+
+
+def apply_value_lut(image, lut):
+    # Table on the HSV value channel only: one LUT pass with identity H and S
+    # tables, instead of split / masked updates / merge
+    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV, dst=buffers.take(image.shape))
+    hsv_lut = np.dstack((IDENTITY, IDENTITY, lut))
+    cv2.LUT(hsv, hsv_lut, dst=hsv)
+    result = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR, dst=buffers.take(image.shape))
+    buffers.release(hsv)
+    return result
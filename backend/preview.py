@@ -0,0 +1,126 @@
+import io
+import math
+import os
+import threading
+import time
+
+from PIL import ExifTags, Image
+
+from .enhancer import decode_image, encode_image, process_image, resize_image, FILTERS, REDUCED_DECODE_FLAGS
+from .pipeline import parse_pipeline, run_pipeline
+from . import buffers
+
+# Preview configuration
+PREVIEW_MAX_SIDE = int(os.getenv("PREVIEW_MAX_SIDE", 1024))
+PREVIEW_BUDGET_MS = int(os.getenv("PREVIEW_BUDGET_MS", 150))
+PREVIEW_MIN_SIDE = 128
+# Upper bounds for the max_side and budget_ms a client may ask for
+PREVIEW_MAX_SIDE_LIMIT = 4096
+PREVIEW_MAX_BUDGET_MS = 10_000
+PREVIEW_JPEG_QUALITY = 80
+
+# Filter cost in ms per megapixel: the registry's estimates, refined from
+# observed preview timings (exponential moving average)
+COST_MS_PER_MP = {name: spec.cost_ms_per_mp for name, spec in FILTERS.items()}
+DEFAULT_COST_MS_PER_MP = 10.0
+_EWMA_WEIGHT = 0.2
+_cost_lock = threading.Lock()
+
+# EXIF orientations that turn the image by 90 degrees; the decoder applies them
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+
+def probe_size(data: bytes):
+    # -> (width, height) as decoded, i.e. after EXIF orientation, like
+    # ImageOps.exif_transpose. Pillow reads only the header; pixels are never decoded.
+    with Image.open(io.BytesIO(data)) as im:
+        width, height = im.size
+        if im.getexif().get(ExifTags.Base.Orientation) in TRANSPOSED_ORIENTATIONS:
+            return height, width
+        return width, height
+
+
+def estimate_cost_ms(names, megapixels: float):
+    with _cost_lock:
+        return sum(COST_MS_PER_MP.get(name, DEFAULT_COST_MS_PER_MP) for name in names) * megapixels
+
+
+def record_cost(names, megapixels: float, elapsed_ms: float):
+    # Spread the observation over the stages in proportion to their estimates
+    if megapixels <= 0:
+        return
+    with _cost_lock:
+        estimates = [COST_MS_PER_MP.get(name, DEFAULT_COST_MS_PER_MP) for name in names]
+        total = sum(estimates)
+        for name, estimate in zip(names, estimates):
+            observed = elapsed_ms / megapixels * (estimate / total)
+            COST_MS_PER_MP[name] = (1 - _EWMA_WEIGHT) * estimate + _EWMA_WEIGHT * observed
+
+
+def choose_proxy_size(width: int, height: int, names, max_side: int = PREVIEW_MAX_SIDE,
+                      budget_ms: int = PREVIEW_BUDGET_MS):
+    """Largest (width, height) that fits max_side and the filter's time budget."""
+    per_mp = estimate_cost_ms(names, 1.0)
+    max_pixels = budget_ms / per_mp * 1_000_000 if per_mp > 0 else width * height
+    scale = min(1.0, max_side / max(width, height), math.sqrt(max_pixels / (width * height)))
+    # Never shrink below a usable thumbnail, whatever the budget says
+    scale = max(scale, min(1.0, PREVIEW_MIN_SIDE / max(width, height)))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def choose_reduction(width: int, height: int, proxy_width: int, proxy_height: int):
+    # Largest decoder reduction that still yields at least the proxy size
+    best = 1
+    for factor in sorted(REDUCED_DECODE_FLAGS):
+        if width // factor >= proxy_width and height // factor >= proxy_height:
+            best = factor
+    return best
+
+
+def _scale_resize_stages(stages, scale: float):
+    # Resize targets are in full-resolution pixels; shrink them like the proxy
+    for stage in stages:
+        if stage.name == "resize":
+            stage.kwargs = {k: max(1, round(v * scale)) if v else v for k, v in stage.kwargs.items()}
+    return stages
+
+
+def render_preview(data: bytes, filter_type: str, params: dict = None, pipeline: bool = False,
+                   max_side: int = PREVIEW_MAX_SIDE, budget_ms: int = PREVIEW_BUDGET_MS):
+    """Run the filter on a downscaled proxy of the upload.
+
+    Returns the JPEG bytes and a dict describing the proxy.
+    """
+    params = dict(params or {})
+    stages = parse_pipeline(filter_type) if pipeline else None
+    names = [stage.name for stage in stages] if pipeline else [filter_type]
+
+    width, height = probe_size(data)
+    proxy_width, proxy_height = choose_proxy_size(width, height, names, max_side, budget_ms)
+    reduction = choose_reduction(width, height, proxy_width, proxy_height)
+    image = decode_image(data, reduction)
+    if image is None:
+        raise ValueError("Could not load image")
+    if image.shape[1] > proxy_width:
+        image = resize_image(image, width=proxy_width)
+
+    scale = image.shape[1] / width
+    with buffers.lease():
+        start = time.perf_counter()
+        if pipeline:
+            processed = run_pipeline(image, _scale_resize_stages(stages, scale), params.get('reorder', True))
+        else:
+            if filter_type == 'resize':
+                params = {k: max(1, round(params[k] * scale)) if params.get(k) else None for k in ('width', 'height')}
+            processed = process_image(image, filter_type, params)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        record_cost(names, image.shape[0] * image.shape[1] / 1_000_000, elapsed_ms)
+
+        info = {
+            "width": image.shape[1],
+            "height": image.shape[0],
+            "scale": scale,
+            "reduction": reduction,
+            "filter_ms": elapsed_ms,
+        }
+        return encode_image(processed, ".jpg", quality=PREVIEW_JPEG_QUALITY), info
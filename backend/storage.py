@@ -0,0 +1,719 @@
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, exists, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from . import metrics, models
+
+logger = logging.getLogger(__name__)
+
+# Storage backend: "local" shards files on this disk; "object" stores them
+# through an object-store client (a local directory stand-in for now)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")
+STORAGE_OBJECT_ROOT = os.getenv("STORAGE_OBJECT_ROOT", "object-store")
+STORAGE_OBJECT_CACHE_MAX_BYTES = int(os.getenv("STORAGE_OBJECT_CACHE_MAX_BYTES", 1024 * 1024 * 1024))
+
+# Quotas; 0 disables. Users are charged for every file they own, even when
+# its content is shared with other files
+STORAGE_USER_QUOTA_BYTES = int(os.getenv("STORAGE_USER_QUOTA_BYTES", 1024 * 1024 * 1024))
+STORAGE_GLOBAL_QUOTA_BYTES = int(os.getenv("STORAGE_GLOBAL_QUOTA_BYTES", 0))
+
+# Retention and garbage collection; files are kept forever with retention 0.
+# Nothing younger than the grace period is ever collected, so files still
+# being written (or whose history row is still queued) are safe. The sweep
+# deletes files and history rows, so it only runs with an interval set; with
+# several worker processes only one sweeps at a time (see GC_LOCK_FILE).
+STORAGE_RETENTION_DAYS = float(os.getenv("STORAGE_RETENTION_DAYS", 0))
+STORAGE_GC_INTERVAL_SECONDS = int(os.getenv("STORAGE_GC_INTERVAL_SECONDS", 0))
+STORAGE_GC_GRACE_SECONDS = int(os.getenv("STORAGE_GC_GRACE_SECONDS", 3600))
+
+UPLOAD = "upload"
+OUTPUT = "output"
+# Which ImageHistory column refers to files of each kind
+HISTORY_COLUMNS = {UPLOAD: "original_filename", OUTPUT: "enhanced_filename"}
+
+# Two levels of 256 directories keep each directory small into the hundreds of millions
+SHARD_DEPTH = 2
+STAGING_DIR = ".staging"
+THUMBNAIL_DIR = ".thumbs"
+GC_LOCK_FILE = ".gc.lock"
+GC_CHUNK = 500
+
+STORAGE_WRITES = metrics.Counter(
+    "storage_writes_total", "Files stored, by whether their content was already present", ("kind", "result")
+)
+STORAGE_GC_DELETIONS = metrics.Counter(
+    "storage_gc_deletions_total", "Files and records removed by the storage sweep", ("kind", "reason")
+)
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+def shard_path(key: str):
+    # "3fa9...e1.jpg" -> "3f/a9/3fa9...e1.jpg"
+    return "/".join([key[2 * i:2 * i + 2] for i in range(SHARD_DEPTH)] + [key])
+
+
+def _file_digest(path: str):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _write_atomic(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class StorageBackend:
+    """Where stored files live, by key (content hash + extension).
+
+    Files are immutable once put. local_path() returns a path on this host
+    for serving and processing, or None if the key is not stored.
+    """
+
+    def put_bytes(self, key: str, data: bytes):
+        raise NotImplementedError
+
+    def put_file(self, key: str, path: str):
+        # Takes ownership of `path`, which may be moved
+        raise NotImplementedError
+
+    def exists(self, key: str):
+        raise NotImplementedError
+
+    def local_path(self, key: str):
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def iter_keys(self):
+        # -> (key, size, mtime) for every stored file
+        raise NotImplementedError
+
+    def trim_cache(self):
+        pass
+
+
+class LocalDiskStorage(StorageBackend):
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, key: str):
+        return os.path.join(self.root, *shard_path(key).split("/"))
+
+    def put_bytes(self, key: str, data: bytes):
+        _write_atomic(self._path(key), data)
+
+    def put_file(self, key: str, path: str):
+        target = self._path(key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.move(path, target)
+
+    def exists(self, key: str):
+        return os.path.isfile(self._path(key))
+
+    def local_path(self, key: str):
+        path = self._path(key)
+        return path if os.path.isfile(path) else None
+
+    def delete(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def iter_keys(self):
+        # Shard directories only: skips .cache, .thumbs, .staging and unsharded legacy files
+        def shards(directory, depth):
+            for entry in os.scandir(directory):
+                if entry.is_dir() and len(entry.name) == 2 and not entry.name.startswith("."):
+                    if depth == 1:
+                        yield entry.path
+                    else:
+                        yield from shards(entry.path, depth - 1)
+
+        for directory in shards(self.root, SHARD_DEPTH):
+            for entry in os.scandir(directory):
+                if entry.is_file() and not entry.name.endswith(".tmp"):
+                    st = entry.stat()
+                    yield entry.name, st.st_size, st.st_mtime
+
+
+class LocalObjectClient:
+    """Stand-in for an object-store client (put/get/head/delete/list by key).
+
+    Objects are files under `root`; a real client (e.g. for S3) only needs
+    the same five methods.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, key: str):
+        return os.path.join(self.root, *key.split("/"))
+
+    def upload_file(self, key: str, path: str):
+        target = self._path(key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp = f"{target}.{uuid.uuid4().hex}.tmp"
+        shutil.copyfile(path, tmp)
+        os.replace(tmp, target)
+
+    def download_file(self, key: str, path: str):
+        shutil.copyfile(self._path(key), path)
+
+    def head_object(self, key: str):
+        # -> (size, mtime), or None if there is no such object
+        try:
+            st = os.stat(self._path(key))
+        except FileNotFoundError:
+            return None
+        return st.st_size, st.st_mtime
+
+    def delete_object(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def list_objects(self, prefix: str):
+        # -> (key, size, mtime) for every object whose key starts with prefix
+        base = self._path(prefix.rstrip("/"))
+        for directory, _, filenames in os.walk(base):
+            for filename in filenames:
+                if filename.endswith(".tmp"):
+                    continue
+                path = os.path.join(directory, filename)
+                st = os.stat(path)
+                key = os.path.relpath(path, self.root).replace(os.sep, "/")
+                yield key, st.st_size, st.st_mtime
+
+
+class ObjectStorage(StorageBackend):
+    """Files in an object store under `prefix`, with a local copy for serving.
+
+    Writes go through the local copy (write-through); reads download on a
+    miss. trim_cache() keeps the local copies within `cache_max_bytes`.
+    """
+
+    def __init__(self, client, prefix: str, cache_dir: str, cache_max_bytes: int = STORAGE_OBJECT_CACHE_MAX_BYTES):
+        self.client = client
+        self.prefix = prefix
+        self.cache_dir = cache_dir
+        self.cache_max_bytes = cache_max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _object_key(self, key: str):
+        return f"{self.prefix}/{shard_path(key)}"
+
+    def _cache_path(self, key: str):
+        return os.path.join(self.cache_dir, key)
+
+    def put_bytes(self, key: str, data: bytes):
+        cached = self._cache_path(key)
+        _write_atomic(cached, data)
+        self.client.upload_file(self._object_key(key), cached)
+
+    def put_file(self, key: str, path: str):
+        self.client.upload_file(self._object_key(key), path)
+        shutil.move(path, self._cache_path(key))
+
+    def exists(self, key: str):
+        return self.client.head_object(self._object_key(key)) is not None
+
+    def local_path(self, key: str):
+        cached = self._cache_path(key)
+        if os.path.isfile(cached):
+            os.utime(cached)  # recency for trim_cache
+            return cached
+        if self.client.head_object(self._object_key(key)) is None:
+            return None
+        tmp = f"{cached}.{uuid.uuid4().hex}.tmp"
+        self.client.download_file(self._object_key(key), tmp)
+        os.replace(tmp, cached)
+        return cached
+
+    def delete(self, key: str):
+        self.client.delete_object(self._object_key(key))
+        try:
+            os.remove(self._cache_path(key))
+        except FileNotFoundError:
+            pass
+
+    def iter_keys(self):
+        for object_key, size, mtime in self.client.list_objects(self.prefix + "/"):
+            yield object_key.rsplit("/", 1)[-1], size, mtime
+
+    def trim_cache(self):
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.cache_max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+
+def create_backend(root: str, kind: str):
+    if STORAGE_BACKEND == "local":
+        return LocalDiskStorage(root)
+    if STORAGE_BACKEND == "object":
+        return ObjectStorage(LocalObjectClient(STORAGE_OBJECT_ROOT), kind, os.path.join(root, ".objects"))
+    raise ValueError(f"Unknown STORAGE_BACKEND '{STORAGE_BACKEND}'; use 'local' or 'object'")
+
+
+def _put(backend: StorageBackend, key: str, source):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        backend.put_bytes(key, source)
+    else:
+        backend.put_file(key, source)
+
+
+def _try_lock(path: str):
+    # -> open file holding an exclusive lock on `path`, or None if another process holds it
+    f = open(path, "a+b")
+    try:
+        if os.name == "nt":
+            import msvcrt
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return None
+    return f
+
+
+def _utc_cutoff(seconds: float):
+    # Naive UTC, as the database stores server-side timestamps
+    return datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(seconds=seconds)
+
+
+class Storage:
+    """Uploads and outputs: deduplicated, sharded files behind public names.
+
+    `roots` maps each kind to its directory, which also holds the staging
+    area, thumbnails and any files written before sharding (served as they
+    are until the sweep adopts them). Each public name maps to a file keyed
+    by content hash, so identical files are stored once.
+    """
+
+    def __init__(self, engine, roots: dict, user_quota_bytes: int = STORAGE_USER_QUOTA_BYTES,
+                 global_quota_bytes: int = STORAGE_GLOBAL_QUOTA_BYTES):
+        self.engine = engine
+        self.roots = roots
+        self.backends = {kind: create_backend(root, kind) for kind, root in roots.items()}
+        self.user_quota_bytes = user_quota_bytes
+        self.global_quota_bytes = global_quota_bytes
+        # Guards the in-memory total only; store() and the sweep serialise
+        # on the stored_blobs rows instead, across processes
+        self._lock = threading.Lock()
+        self._total_bytes = None
+        self._gc_thread = None
+        self._gc_stop = threading.Event()
+        for root in roots.values():
+            os.makedirs(os.path.join(root, STAGING_DIR), exist_ok=True)
+
+    def staging_path(self, kind: str, name: str):
+        # For files produced on this host before store() takes them over
+        return os.path.join(self.roots[kind], STAGING_DIR, name)
+
+    def thumbnail_dir(self, kind: str):
+        return os.path.join(self.roots[kind], THUMBNAIL_DIR)
+
+    # --- Quotas ---
+
+    def _total(self):
+        if self._total_bytes is None:
+            with self.engine.connect() as conn:
+                total = conn.scalar(select(func.coalesce(func.sum(models.StorageUsage.bytes), 0)))
+            with self._lock:
+                if self._total_bytes is None:
+                    self._total_bytes = total
+        return self._total_bytes
+
+    def usage(self, user_id: int):
+        with self.engine.connect() as conn:
+            row = conn.execute(
+                select(models.StorageUsage.bytes, models.StorageUsage.files, models.StorageUsage.quota_bytes)
+                .where(models.StorageUsage.user_id == user_id)
+            ).first()
+        quota = row.quota_bytes if row is not None and row.quota_bytes is not None else self.user_quota_bytes
+        return {
+            "bytes": row.bytes if row is not None else 0,
+            "files": row.files if row is not None else 0,
+            "quota_bytes": quota or None,
+        }
+
+    def check_quota(self, user_id: int, incoming_bytes: int):
+        if self.global_quota_bytes and self._total() + incoming_bytes > self.global_quota_bytes:
+            raise QuotaExceeded("Storage is full, retry later")
+        usage = self.usage(user_id)
+        if usage["quota_bytes"] and usage["bytes"] + incoming_bytes > usage["quota_bytes"]:
+            raise QuotaExceeded(
+                f"Storage quota of {usage['quota_bytes'] / (1024 * 1024):.1f} MB exceeded; "
+                f"{usage['bytes'] / (1024 * 1024):.1f} MB in use"
+            )
+
+    # --- Writes and lookups ---
+
+    def store(self, user_id: int, items):
+        """Store files under their public names: -> {name: local path}.
+
+        `items` are (kind, name, source, content_hash) tuples; source is the
+        bytes or a staged file (which is taken over), content_hash its
+        sha256 hex digest if already known.
+        """
+        records = []
+        # (kind, key) -> (size, source to put again if the sweep removes the content first)
+        blobs = {}
+        # Staged files whose content was already stored; removed once recorded
+        duplicates = []
+        for kind, name, source, content_hash in items:
+            in_memory = isinstance(source, (bytes, bytearray, memoryview))
+            if in_memory:
+                size = len(source)
+                content_hash = content_hash or hashlib.sha256(source).hexdigest()
+            else:
+                size = os.path.getsize(source)
+                content_hash = content_hash or _file_digest(source)
+            key = content_hash + os.path.splitext(name)[1].lower()
+            backend = self.backends[kind]
+            if backend.exists(key):
+                if not in_memory:
+                    duplicates.append(source)
+                blobs[(kind, key)] = (size, source)
+                STORAGE_WRITES.inc(kind=kind, result="deduplicated")
+            else:
+                # Puts are atomic and content-addressed, so concurrent puts of a key are harmless
+                _put(backend, key, source)
+                blobs[(kind, key)] = (size, source if in_memory else None)
+                STORAGE_WRITES.inc(kind=kind, result="stored")
+            records.append({"kind": kind, "name": name, "user_id": user_id, "blob": key, "size": size})
+        try:
+            self._record(user_id, records, blobs)
+        finally:
+            for path in duplicates:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        return {record["name"]: self.backends[record["kind"]].local_path(record["blob"]) for record in records}
+
+    def _claim_blobs(self, conn, blobs: dict):
+        # Touching a content row locks it against the sweep until this transaction
+        # ends; content the sweep removed before that is put back
+        StoredBlob = models.StoredBlob
+        for (kind, key), (size, source) in blobs.items():
+            touched = conn.execute(
+                update(StoredBlob).where(StoredBlob.kind == kind, StoredBlob.key == key).values(last_used=func.now())
+            ).rowcount
+            if not touched:
+                conn.execute(insert(StoredBlob).values(kind=kind, key=key, size=size))
+            backend = self.backends[kind]
+            if not backend.exists(key):
+                if source is None or (isinstance(source, str) and not os.path.isfile(source)):
+                    raise FileNotFoundError(f"Content {key} was removed while being stored")
+                _put(backend, key, source)
+
+    def _record(self, user_id: int, records, blobs: dict):
+        added = sum(record["size"] for record in records)
+        for attempt in range(3):
+            try:
+                with self.engine.begin() as conn:
+                    self._claim_blobs(conn, blobs)
+                    conn.execute(insert(models.StoredFile), records)
+                    updated = conn.execute(
+                        update(models.StorageUsage).where(models.StorageUsage.user_id == user_id)
+                        .values(bytes=models.StorageUsage.bytes + added,
+                                files=models.StorageUsage.files + len(records))
+                    ).rowcount
+                    if not updated:
+                        conn.execute(insert(models.StorageUsage).values(
+                            user_id=user_id, bytes=added, files=len(records)
+                        ))
+                break
+            except IntegrityError:
+                # Another request created the same content row or the user's usage row first
+                if attempt == 2:
+                    raise
+        with self._lock:
+            if self._total_bytes is not None:
+                self._total_bytes += added
+
+    def local_path(self, kind: str, name: str):
+        # -> path of the file published as `name`, or None
+        if name.startswith("."):
+            return None
+        with self.engine.connect() as conn:
+            key = conn.scalar(
+                select(models.StoredFile.blob)
+                .where(models.StoredFile.kind == kind, models.StoredFile.name == name)
+            )
+        if key is not None:
+            return self.backends[kind].local_path(key)
+        legacy = os.path.join(self.roots[kind], name)
+        return legacy if os.path.isfile(legacy) else None
+
+    # --- Garbage collection ---
+
+    def sweep(self, retention_days: float = STORAGE_RETENTION_DAYS, grace_seconds: int = STORAGE_GC_GRACE_SECONDS):
+        """One retention and reconciliation pass: -> {step: count}.
+
+        1. Adopt legacy flat files that history refers to; delete the rest.
+        2. Expire files past the retention period, with their history rows.
+        3. Drop stored files no history row refers to, and history rows
+           whose result no longer exists.
+        4. Delete content no stored file refers to, stale staging files and
+           thumbnails of deleted content; rebuild usage totals.
+
+        Returns None without doing anything while another process sweeps.
+        """
+        lock = _try_lock(os.path.join(next(iter(self.roots.values())), GC_LOCK_FILE))
+        if lock is None:
+            return None
+        try:
+            return self._sweep(retention_days, grace_seconds)
+        finally:
+            lock.close()
+
+    def _sweep(self, retention_days: float, grace_seconds: int):
+        stats = {"adopted": 0, "expired": 0, "orphaned": 0, "missing": 0, "blobs": 0, "staging": 0, "thumbnails": 0}
+        grace_cutoff = time.time() - grace_seconds
+        for kind in self.roots:
+            stats["adopted"] += self._adopt_legacy(kind, grace_cutoff, stats)
+        if retention_days:
+            stats["expired"] = self._expire(_utc_cutoff(retention_days * 86400))
+        for kind in self.roots:
+            stats["orphaned"] += self._drop_orphans(kind, _utc_cutoff(grace_seconds))
+        stats["missing"] = self._drop_missing_history(_utc_cutoff(grace_seconds))
+        for kind, backend in self.backends.items():
+            stats["blobs"] += self._delete_unreferenced(kind, grace_cutoff, _utc_cutoff(grace_seconds))
+            stats["staging"] += self._clean_dir(os.path.join(self.roots[kind], STAGING_DIR), grace_cutoff, kind)
+            stats["thumbnails"] += self._clean_thumbnails(kind)
+            backend.trim_cache()
+        self._rebuild_usage()
+        return stats
+
+    def _history_owners(self, kind: str, names):
+        column = getattr(models.ImageHistory, HISTORY_COLUMNS[kind])
+        with self.engine.connect() as conn:
+            return dict(conn.execute(
+                select(column, models.ImageHistory.user_id).where(column.in_(names))
+            ).all())
+
+    def _adopt_legacy(self, kind: str, grace_cutoff: float, stats: dict):
+        root = self.roots[kind]
+        legacy = [
+            entry.name for entry in os.scandir(root)
+            if entry.is_file() and not entry.name.startswith(".") and not entry.name.endswith(".tmp")
+        ]
+        adopted = 0
+        for start in range(0, len(legacy), GC_CHUNK):
+            names = legacy[start:start + GC_CHUNK]
+            owners = self._history_owners(kind, names)
+            with self.engine.connect() as conn:
+                known = set(conn.scalars(
+                    select(models.StoredFile.name)
+                    .where(models.StoredFile.kind == kind, models.StoredFile.name.in_(names))
+                ))
+            for name in names:
+                path = os.path.join(root, name)
+                if name in owners and name not in known:
+                    self.store(owners[name], [(kind, name, path, None)])
+                    adopted += 1
+                elif os.path.getmtime(path) < grace_cutoff:
+                    os.remove(path)
+                    STORAGE_GC_DELETIONS.inc(kind=kind, reason="legacy")
+        return adopted
+
+    def _delete_records(self, conn, kind: str, names):
+        conn.execute(delete(models.StoredFile).where(
+            models.StoredFile.kind == kind, models.StoredFile.name.in_(names)
+        ))
+
+    def _expire(self, cutoff: datetime):
+        expired = 0
+        while True:
+            with self.engine.begin() as conn:
+                rows = conn.execute(
+                    select(models.StoredFile.kind, models.StoredFile.name)
+                    .where(models.StoredFile.created_at < cutoff).limit(GC_CHUNK)
+                ).all()
+                for kind in self.roots:
+                    names = [row.name for row in rows if row.kind == kind]
+                    if not names:
+                        continue
+                    self._delete_records(conn, kind, names)
+                    column = getattr(models.ImageHistory, HISTORY_COLUMNS[kind])
+                    conn.execute(delete(models.ImageHistory).where(column.in_(names)))
+                    STORAGE_GC_DELETIONS.inc(len(names), kind=kind, reason="expired")
+            expired += len(rows)
+            if len(rows) < GC_CHUNK:
+                return expired
+
+    def _drop_orphans(self, kind: str, cutoff: datetime):
+        column = getattr(models.ImageHistory, HISTORY_COLUMNS[kind])
+        StoredFile = models.StoredFile
+        with self.engine.connect() as conn:
+            orphans = list(conn.scalars(
+                select(StoredFile.name).where(
+                    StoredFile.kind == kind, StoredFile.created_at < cutoff,
+                    ~exists().where(column == StoredFile.name)
+                )
+            ))
+        for start in range(0, len(orphans), GC_CHUNK):
+            with self.engine.begin() as conn:
+                self._delete_records(conn, kind, orphans[start:start + GC_CHUNK])
+        if orphans:
+            STORAGE_GC_DELETIONS.inc(len(orphans), kind=kind, reason="orphaned")
+        return len(orphans)
+
+    def _drop_missing_history(self, cutoff: datetime):
+        # Runs after adoption, so a result that is not stored no longer exists anywhere
+        ImageHistory, StoredFile = models.ImageHistory, models.StoredFile
+        with self.engine.begin() as conn:
+            missing = conn.execute(delete(ImageHistory).where(
+                ImageHistory.timestamp < cutoff,
+                ~exists().where(StoredFile.kind == OUTPUT, StoredFile.name == ImageHistory.enhanced_filename)
+            )).rowcount
+        if missing:
+            STORAGE_GC_DELETIONS.inc(missing, kind=OUTPUT, reason="missing")
+        return missing
+
+    def _track_untracked(self, kind: str, grace_cutoff: float):
+        # Content without a row: stored before rows were kept, or put by a request
+        # that failed before recording it. Rows carry the file's age, so the
+        # deletion below treats both like any other content.
+        StoredBlob = models.StoredBlob
+        old = [(key, size, mtime) for key, size, mtime in self.backends[kind].iter_keys() if mtime < grace_cutoff]
+        for start in range(0, len(old), GC_CHUNK):
+            chunk = old[start:start + GC_CHUNK]
+            with self.engine.connect() as conn:
+                known = set(conn.scalars(
+                    select(StoredBlob.key).where(StoredBlob.kind == kind, StoredBlob.key.in_([k for k, _, _ in chunk]))
+                ))
+            for key, size, mtime in chunk:
+                if key in known:
+                    continue
+                last_used = datetime.fromtimestamp(mtime, timezone.utc).replace(tzinfo=None)
+                try:
+                    with self.engine.begin() as conn:
+                        conn.execute(insert(StoredBlob).values(kind=kind, key=key, size=size, last_used=last_used))
+                except IntegrityError:
+                    # store() claimed it meanwhile
+                    pass
+
+    def _delete_unreferenced(self, kind: str, grace_cutoff: float, cutoff: datetime):
+        StoredBlob, StoredFile = models.StoredBlob, models.StoredFile
+        backend = self.backends[kind]
+        self._track_untracked(kind, grace_cutoff)
+        stale = (
+            StoredBlob.kind == kind, StoredBlob.last_used < cutoff,
+            ~exists().where(StoredFile.kind == kind, StoredFile.blob == StoredBlob.key),
+        )
+        with self.engine.connect() as conn:
+            candidates = list(conn.scalars(select(StoredBlob.key).where(*stale)))
+        deleted = 0
+        for start in range(0, len(candidates), GC_CHUNK):
+            # Re-checked while deleting the rows, and the content is removed before
+            # the transaction releases them, so a concurrent store() either sees
+            # the row gone (and puts the content back) or keeps it alive
+            with self.engine.begin() as conn:
+                keys = conn.scalars(
+                    delete(StoredBlob).where(StoredBlob.key.in_(candidates[start:start + GC_CHUNK]), *stale)
+                    .returning(StoredBlob.key)
+                ).all()
+                for key in keys:
+                    backend.delete(key)
+            deleted += len(keys)
+        if deleted:
+            STORAGE_GC_DELETIONS.inc(deleted, kind=kind, reason="unreferenced")
+        return deleted
+
+    def _clean_dir(self, directory: str, grace_cutoff: float, kind: str):
+        # Staging files left by failed jobs or interrupted requests
+        removed = 0
+        for entry in os.scandir(directory):
+            if entry.is_file() and entry.stat().st_mtime < grace_cutoff:
+                os.remove(entry.path)
+                removed += 1
+        if removed:
+            STORAGE_GC_DELETIONS.inc(removed, kind=kind, reason="staging")
+        return removed
+
+    def _clean_thumbnails(self, kind: str):
+        directory = self.thumbnail_dir(kind)
+        if not os.path.isdir(directory):
+            return 0
+        backend = self.backends[kind]
+        removed = 0
+        for width in os.scandir(directory):
+            if not width.is_dir():
+                continue
+            for entry in os.scandir(width.path):
+                # Named after the stored key, or the public name of a legacy file
+                if not (backend.exists(entry.name) or os.path.isfile(os.path.join(self.roots[kind], entry.name))):
+                    os.remove(entry.path)
+                    removed += 1
+        if removed:
+            STORAGE_GC_DELETIONS.inc(removed, kind=kind, reason="thumbnail")
+        return removed
+
+    def _rebuild_usage(self):
+        # Recount from the records, which also corrects drift between workers
+        StorageUsage, StoredFile = models.StorageUsage, models.StoredFile
+        owned = StoredFile.user_id == StorageUsage.user_id
+        with self.engine.begin() as conn:
+            conn.execute(update(StorageUsage).values(
+                bytes=select(func.coalesce(func.sum(StoredFile.size), 0)).where(owned).scalar_subquery(),
+                files=select(func.count(StoredFile.name)).where(owned).scalar_subquery(),
+            ))
+            self._total_bytes = conn.scalar(select(func.coalesce(func.sum(StorageUsage.bytes), 0)))
+
+    def start_gc(self, interval: int = STORAGE_GC_INTERVAL_SECONDS):
+        # Off unless an interval is set; any number of processes may run it,
+        # as a pass is skipped while another process holds the sweep lock
+        if not interval or self._gc_thread is not None:
+            return
+
+        def run():
+            while not self._gc_stop.wait(interval):
+                try:
+                    stats = self.sweep()
+                    if stats is None:
+                        logger.info("Storage sweep skipped: another process is sweeping")
+                    else:
+                        logger.info(f"Storage sweep: {stats}")
+                except Exception as e:
+                    logger.error(f"Storage sweep failed: {str(e)}")
+
+        self._gc_thread = threading.Thread(target=run, name="storage-gc", daemon=True)
+        self._gc_thread.start()
+
+    def stop_gc(self):
+        self._gc_stop.set()
+        if self._gc_thread is not None:
+            self._gc_thread.join()
+            self._gc_thread = None
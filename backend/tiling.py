@@ -0,0 +1,118 @@
+import math
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from . import buffers
+
+# Tiled execution configuration
+MEMORY_CAP_MB = int(os.getenv("ENHANCE_MEMORY_CAP_MB", 512))
+MAX_TILE_ROWS = int(os.getenv("ENHANCE_TILE_ROWS", 1024))
+MIN_TILE_ROWS = 32
+
+# Parallel tiles: OpenCV releases the GIL, so threads scale across cores
+TILE_WORKERS = int(os.getenv("ENHANCE_TILE_WORKERS", os.cpu_count() or 1))
+PARALLEL_MIN_PIXELS = int(os.getenv("ENHANCE_PARALLEL_MIN_PIXELS", 2_000_000))
+# More tiles than workers evens out uneven tiles at the cost of extra halo rows
+TILES_PER_WORKER = 2
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=TILE_WORKERS, thread_name_prefix="tile")
+        return _executor
+
+
+def resolve_workers(workers: int = None):
+    # Requested parallelism, clamped to the shared tile pool
+    if workers is None:
+        workers = TILE_WORKERS
+    return max(1, min(int(workers), TILE_WORKERS))
+
+
+def estimate_peak_bytes(image, peak_copies: float):
+    # Untiled filters hold about `peak_copies` full-size arrays at once
+    return int(image.nbytes * peak_copies)
+
+
+def should_tile(image, peak_copies: float, memory_cap_mb: int = None):
+    cap = (memory_cap_mb or MEMORY_CAP_MB) * 1024 * 1024
+    return estimate_peak_bytes(image, peak_copies) > cap
+
+
+def choose_tile_rows(image, halo: int, peak_copies: float, memory_cap_mb: int = None, workers: int = 1):
+    # Input and output stay resident; the rest of the cap is shared by the in-flight tiles
+    cap = (memory_cap_mb or MEMORY_CAP_MB) * 1024 * 1024
+    budget = cap - 2 * image.nbytes
+    height = image.shape[0]
+    row_bytes = image.nbytes // height
+    if budget <= 0:
+        return MIN_TILE_ROWS
+    rows = int(budget / (row_bytes * peak_copies * workers)) - 2 * halo
+    if workers > 1:
+        rows = min(rows, math.ceil(height / (workers * TILES_PER_WORKER)))
+    return max(MIN_TILE_ROWS, min(MAX_TILE_ROWS, rows))
+
+
+def iter_tiles(height: int, tile_rows: int, halo: int):
+    """Yield (core, padded) row ranges as (y0, y1) tuples covering the image."""
+    for y0 in range(0, height, tile_rows):
+        y1 = min(y0 + tile_rows, height)
+        yield (y0, y1), (max(y0 - halo, 0), min(y1 + halo, height))
+
+
+def _map_bounded(func, items, workers: int):
+    # Like executor.map, but with at most `workers` tiles in flight
+    executor = get_executor()
+    pending = deque()
+    for item in items:
+        if len(pending) >= workers:
+            yield pending.popleft().result()
+        pending.append(executor.submit(func, item))
+    while pending:
+        yield pending.popleft().result()
+
+
+def process_tiled(image, func, halo: int, tile_rows: int = MAX_TILE_ROWS, workers: int = 1):
+    """Apply func tile by tile so its temporaries are bounded by tile size.
+
+    Tiles are full-width bands extended by `halo` rows of real neighbouring
+    data above and below, so a filter whose footprint radius is at most
+    `halo` produces the same pixels as on the whole image; the left, right
+    and outer edges get the filter's own border handling, exactly as in the
+    untiled call. Bands rather than square tiles keep every row the same
+    length, which matters because OpenCV's vectorised loops (HSV conversion
+    in particular) round the tail of a row differently from its body.
+
+    With workers > 1 tiles run concurrently on the shared tile pool.
+    """
+    height = image.shape[0]
+    # Tile workers draw from the caller's lease, so tile outputs are recycled
+    lease = buffers.current_lease()
+
+    def run(tile):
+        (y0, y1), (py0, py1) = tile
+        with buffers.using(lease):
+            return y0, y1, func(image[py0:py1])[y0 - py0:y1 - py0]
+
+    tiles = iter_tiles(height, tile_rows, halo)
+    results = _map_bounded(run, tiles, workers) if workers > 1 else map(run, tiles)
+
+    output = None
+    for y0, y1, core in results:
+        if output is None:
+            output = buffers.take((height,) + core.shape[1:], dtype=core.dtype)
+        output[y0:y1] = core
+        # Copied out, so the tile's buffer can serve the next tile; unless
+        # the filter returned its input unchanged
+        if not np.may_share_memory(core, image):
+            buffers.release(core)
+    return output
@@ -0,0 +1,189 @@
+import hashlib
+import io
+import json
+import os
+import warnings
+
+from PIL import Image
+
+# Upload limits
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 50 * 1024 * 1024))
+MAX_BATCH_UPLOAD_BYTES = int(os.getenv("MAX_BATCH_UPLOAD_BYTES", 512 * 1024 * 1024))
+MAX_CLIP_UPLOAD_BYTES = int(os.getenv("MAX_CLIP_UPLOAD_BYTES", 200 * 1024 * 1024))
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", 100_000_000))
+# Room for the multipart framing and form fields around the file
+FORM_OVERHEAD_BYTES = 64 * 1024
+# Enough of the file for Pillow to find the dimensions, even behind large EXIF blocks
+HEADER_PROBE_BYTES = 1024 * 1024
+
+# Leading bytes of each accepted format
+MAGIC_BYTES = {
+    "jpeg": (b"\xff\xd8\xff",),
+    "png": (b"\x89PNG\r\n\x1a\n",),
+}
+PIL_FORMATS = {"JPEG": "jpeg", "MPO": "jpeg", "PNG": "png"}
+
+
+class InvalidUpload(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def too_large(limit: int):
+    return InvalidUpload(413, f"Upload exceeds the {limit // (1024 * 1024)} MB limit")
+
+
+def sniff_format(head: bytes):
+    for name, signatures in MAGIC_BYTES.items():
+        if head.startswith(signatures):
+            return name
+    return None
+
+
+def probe_image(head: bytes):
+    """Validate an upload from its first bytes: -> (format, width, height).
+
+    Only the header is parsed; pixels are never decoded, so a decompression
+    bomb is rejected before it can allocate anything.
+    """
+    image_format = sniff_format(head)
+    if image_format is None:
+        raise InvalidUpload(415, "Invalid file type. Only JPG, JPEG, PNG are supported.")
+    try:
+        with warnings.catch_warnings():
+            # Pillow warns past its own pixel limit; ours is checked below
+            warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+            with Image.open(io.BytesIO(head)) as im:
+                width, height = im.size
+                pil_format = im.format
+    except Image.DecompressionBombError:
+        raise InvalidUpload(413, f"Image exceeds the {MAX_IMAGE_PIXELS} pixel limit")
+    except Exception:
+        raise InvalidUpload(400, "Corrupt or unreadable image header")
+    if PIL_FORMATS.get(pil_format) != image_format:
+        raise InvalidUpload(400, "Corrupt or unreadable image header")
+    if width * height > MAX_IMAGE_PIXELS:
+        raise InvalidUpload(413, f"Image is {width}x{height}; at most {MAX_IMAGE_PIXELS} pixels are accepted")
+    return image_format, width, height
+
+
+def read_upload(file, max_bytes: int = MAX_UPLOAD_BYTES):
+    """Read an UploadFile into memory, enforcing the byte cap and validating the header."""
+    data = file.file.read(max_bytes + 1)
+    if len(data) > max_bytes:
+        raise too_large(max_bytes)
+    probe_image(data[:HEADER_PROBE_BYTES])
+    return data
+
+
+async def read_upload_async(file, max_bytes: int = MAX_UPLOAD_BYTES):
+    """As read_upload, for async routes: Starlette reads spooled files in its threadpool."""
+    data = await file.read(max_bytes + 1)
+    if len(data) > max_bytes:
+        raise too_large(max_bytes)
+    probe_image(data[:HEADER_PROBE_BYTES])
+    return data
+
+
+def save_upload(file, upload_path: str, max_bytes: int = MAX_UPLOAD_BYTES, probe=probe_image):
+    """Validate the header, then stream the upload to disk: -> (sha256 hex digest, probe result).
+
+    Nothing is written for a rejected upload, and a partial file is removed
+    if the byte cap is hit part-way. `probe` checks the leading bytes.
+    """
+    head = file.file.read(HEADER_PROBE_BYTES)
+    probed = probe(head)
+    digest = hashlib.sha256(head)
+    size = len(head)
+    try:
+        with open(upload_path, "wb") as buffer:
+            buffer.write(head)
+            while chunk := file.file.read(1024 * 1024):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise too_large(max_bytes)
+                digest.update(chunk)
+                buffer.write(chunk)
+    except BaseException:
+        os.remove(upload_path)
+        raise
+    return digest.hexdigest(), probed
+
+
+class _BodyTooLarge(Exception):
+    pass
+
+
+class UploadLimitMiddleware:
+    """Caps request bodies of upload routes while they stream in.
+
+    Requests with a larger Content-Length are refused before any of the
+    body is read; chunked or understated bodies are cut off as soon as they
+    pass the limit, so Starlette never spools more than that to disk.
+    """
+
+    def __init__(self, app, limits=None):
+        self.app = app
+        # (path, limit); the first matching path prefix wins
+        self.limits = limits or [
+            ("/enhance/batch", MAX_BATCH_UPLOAD_BYTES + FORM_OVERHEAD_BYTES),
+            ("/enhance/video", MAX_CLIP_UPLOAD_BYTES + FORM_OVERHEAD_BYTES),
+            ("/enhance", MAX_UPLOAD_BYTES + FORM_OVERHEAD_BYTES),
+        ]
+
+    def _limit_for(self, path: str):
+        for prefix, limit in self.limits:
+            if path == prefix or path.startswith(prefix + "/"):
+                return limit
+        return None
+
+    async def _reject(self, send, limit: int):
+        body = json.dumps({"detail": too_large(limit - FORM_OVERHEAD_BYTES).detail}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        limit = self._limit_for(scope["path"]) if scope["type"] == "http" and scope["method"] == "POST" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+            await self._reject(send, limit)
+            return
+
+        received = 0
+        exceeded = False
+        started = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    exceeded = True
+                    raise _BodyTooLarge()
+            return message
+
+        async def guarded_send(message):
+            nonlocal started
+            # The form parser turns our exception into its own error response; replace it
+            if exceeded:
+                return
+            started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except _BodyTooLarge:
+            pass
+        if exceeded and not started:
+            await self._reject(send, limit)
@@ -0,0 +1,110 @@
+"""Benchmark the per-request cost of authentication on protected routes.
+
+Times auth.get_current_user on its own and GET /auth/me end to end, with
+the token and user caches disabled (the old behaviour: JWT decode plus a
+SELECT on every request) and enabled. Runs against a throwaway database
+in a temporary directory. Run from the repository root:
+
+    python -m benchmarks.auth_overhead --requests 2000
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _set_caches(auth, enabled: bool):
+    auth.clear_auth_caches()
+    auth.token_cache.maxsize = auth.TOKEN_CACHE_SIZE if enabled else 0
+    auth.user_cache.maxsize = auth.USER_CACHE_SIZE if enabled else 0
+
+
+async def _time_dependency(auth, database, token, requests):
+    db = database.SessionLocal()
+    try:
+        timings = []
+        for _ in range(requests):
+            start = time.perf_counter()
+            await auth.get_current_user(token, db)
+            timings.append((time.perf_counter() - start) * 1_000_000)
+        return timings
+    finally:
+        db.close()
+
+
+async def _time_http(client, headers, requests):
+    timings = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        response = await client.get("/auth/me", headers=headers)
+        timings.append((time.perf_counter() - start) * 1_000_000)
+        response.raise_for_status()
+    return timings
+
+
+async def run(requests):
+    import httpx
+    from backend import auth, database
+    from backend.main import app
+
+    results = {}
+    # ASGITransport sends no lifespan events: run startup (tables, storage, warm-up) here
+    async with app.router.lifespan_context(app), httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        account = {"email": f"bench_{uuid.uuid4().hex[:8]}@example.com", "password": "benchmark", "name": "Bench"}
+        (await client.post("/auth/register", json=account)).raise_for_status()
+        login = await client.post("/auth/login", json={"email": account["email"], "password": account["password"]})
+        token = login.json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+
+        for label, enabled in (("uncached", False), ("cached", True)):
+            _set_caches(auth, enabled)
+            for case, timings in (
+                ("get_current_user", await _time_dependency(auth, database, token, requests)),
+                ("GET /auth/me", await _time_http(client, headers, requests)),
+            ):
+                results[f"{case} ({label})"] = {
+                    "us_p50": statistics.median(timings),
+                    "us_mean": statistics.fmean(timings),
+                }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000, help="calls per case")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    json_path = os.path.abspath(args.json) if args.json else None
+
+    # backend.database opens ./sql_app.db, so import the app from a scratch directory
+    sys.path.insert(0, REPO_ROOT)
+    workdir = tempfile.mkdtemp(prefix="enhancer-bench-")
+    try:
+        for name in ("static", "templates"):
+            os.symlink(os.path.join(REPO_ROOT, name), os.path.join(workdir, name))
+        os.chdir(workdir)
+        results = asyncio.run(run(args.requests))
+    finally:
+        os.chdir(REPO_ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print("| Case | p50 (µs) | mean (µs) |")
+    print("| --- | ---: | ---: |")
+    for case, metrics in results.items():
+        print(f"| {case} | {metrics['us_p50']:.0f} | {metrics['us_mean']:.0f} |")
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""Benchmark the filter buffer pool under sustained load.
+
+Runs apply_filter_bytes and apply_pipeline_bytes over a mix of filters from
+several threads, with the pool disabled (the default) and enabled
+with --pool-mb, each in a fresh process. Reports p50/p99 latency, minor page
+faults per request and resident memory during and after the run. Run from the
+repository root:
+
+    python -m benchmarks.buffer_pool --megapixels 1 2 4 8 --requests 400 --threads 4
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Everything but NLM, which would hide allocation costs behind seconds of compute
+WORKLOAD = [
+    ("filter", "brightness"),
+    ("filter", "contrast"),
+    ("filter", "sharpen"),
+    ("filter", "grayscale"),
+    ("filter", "blur"),
+    ("pipeline", "brightness,contrast:1.2:5,sharpen:0.5"),
+    ("pipeline", "gamma:1.4,blur,resize:1200x"),
+]
+
+
+def _rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+def _child(args):
+    import cv2
+
+    from backend import buffers
+    from backend.enhancer import apply_filter_bytes
+    from backend.pipeline import apply_pipeline_bytes
+    from benchmarks.suite import percentile, synthetic_image
+
+    # Mixed sizes, as under real traffic
+    uploads = [cv2.imencode(".jpg", synthetic_image(mp))[1].tobytes() for mp in args.megapixels]
+    funcs = {"filter": apply_filter_bytes, "pipeline": apply_pipeline_bytes}
+    latencies = []
+    lock = threading.Lock()
+    counter = iter(range(args.requests))
+
+    def worker():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            kind, spec = WORKLOAD[i % len(WORKLOAD)]
+            data = uploads[i % len(uploads)]
+            start = time.perf_counter()
+            funcs[kind](data, spec, ".jpg")
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                latencies.append(elapsed)
+
+    rss_samples = []
+    done = threading.Event()
+
+    def sample_rss():
+        while not done.wait(0.05):
+            rss_samples.append(_rss_mb())
+
+    faults = resource.getrusage(resource.RUSAGE_SELF).ru_minflt
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+    sampler = threading.Thread(target=sample_rss)
+    sampler.start()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+    done.set()
+    sampler.join()
+    faults = resource.getrusage(resource.RUSAGE_SELF).ru_minflt - faults
+
+    json.dump({
+        "latency_ms_p50": percentile(latencies, 50),
+        "latency_ms_p99": percentile(latencies, 99),
+        "requests_per_s": len(latencies) / wall,
+        "minor_faults_per_request": faults / len(latencies),
+        "mean_rss_mb": sum(rss_samples) / len(rss_samples),
+        "rss_mb": _rss_mb(),
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "pool": buffers.pool.stats(),
+    }, sys.stdout)
+
+
+def run_case(args, pooled: bool):
+    cmd = [sys.executable, "-m", "benchmarks.buffer_pool", "_child", "--megapixels", *map(str, args.megapixels),
+           "--requests", str(args.requests), "--threads", str(args.threads)]
+    env = {**os.environ, "PYTHONPATH": REPO_ROOT + os.pathsep + os.environ.get("PYTHONPATH", "")}
+    env["BUFFER_POOL_MAX_BYTES"] = str(args.pool_mb * 1024 * 1024 if pooled else 0)
+    output = subprocess.run(cmd, cwd=REPO_ROOT, env=env, check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("mode", nargs="?", default="run", choices=["run", "_child"], help=argparse.SUPPRESS)
+    parser.add_argument("--megapixels", type=float, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--pool-mb", type=int, default=256, help="pool cap for the pooled run")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+    if args.mode == "_child":
+        return _child(args)
+
+    results = {"unpooled": run_case(args, pooled=False), "pooled": run_case(args, pooled=True)}
+    print("| case | p50 ms | p99 ms | req/s | minor faults / request | mean RSS MB | final RSS MB | peak RSS MB |")
+    print("| --- | ---: | ---: | ---: | ---: | ---: | ---: | ---: |")
+    for case, r in results.items():
+        print(f"| {case} | {r['latency_ms_p50']:.1f} | {r['latency_ms_p99']:.1f} | {r['requests_per_s']:.1f} | "
+              f"{r['minor_faults_per_request']:.0f} | {r['mean_rss_mb']:.0f} | {r['rss_mb']:.0f} | {r['peak_rss_mb']:.0f} |")
+    pool = results["pooled"]["pool"]
+    print(f"\nPool: {pool['hits']} hits, {pool['misses']} misses, {pool['free_bytes'] / 2 ** 20:.0f} MB retained")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
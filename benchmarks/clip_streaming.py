@@ -0,0 +1,120 @@
+"""Benchmark frame-streamed clip enhancement.
+
+Two parts:
+
+- Length: MP4 clips of increasing length through one filter. Reports time
+  per frame and how far resident memory rose above its level before the run.
+  It should stay flat as clips get longer.
+- Temporal: a noisy clip with a known clean version, stored losslessly as
+  APNG. Compares denoise frame by frame with temporal denoise. Reports time
+  per frame and mean PSNR against the clean frames.
+
+Run from the repository root:
+
+    python -m benchmarks.clip_streaming --megapixels 0.3 --frames 30 120 480
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+import cv2
+import numpy as np
+from PIL import Image, ImageSequence
+
+from backend import video
+from benchmarks.suite import synthetic_image
+
+
+def _rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+def moving_frames(megapixels: float, count: int, sigma: float = 0, seed: int = 0):
+    # A smooth scene panning 2 px per frame, optionally with Gaussian noise
+    base = cv2.GaussianBlur(synthetic_image(megapixels), (0, 0), 1.5)
+    rng = np.random.default_rng(seed)
+    for i in range(count):
+        frame = np.roll(base, 2 * i, axis=1)
+        noisy = frame
+        if sigma:
+            noisy = np.clip(frame + rng.normal(0, sigma, frame.shape), 0, 255).astype(np.uint8)
+        yield frame, noisy
+
+
+def write_mp4(path: str, frames):
+    writer = None
+    for _, frame in frames:
+        if writer is None:
+            writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), 25, frame.shape[1::-1])
+        writer.write(frame)
+    writer.release()
+
+
+def timed_run(input_path: str, filter_type: str, output_path: str, params: dict):
+    # -> (seconds, peak RSS increase in MB)
+    samples = []
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(0.02):
+            samples.append(_rss_mb())
+
+    before = _rss_mb()
+    sampler = threading.Thread(target=sample)
+    sampler.start()
+    start = time.perf_counter()
+    try:
+        video.enhance_clip(input_path, filter_type, output_path, params)
+    finally:
+        elapsed = time.perf_counter() - start
+        done.set()
+        sampler.join()
+    return elapsed, max(samples + [before]) - before
+
+
+def length_cases(args, workdir: str):
+    print(f"| frames | {args.filter} ms / frame | peak RSS increase MB |")
+    print("| ---: | ---: | ---: |")
+    for count in args.frames:
+        source = os.path.join(workdir, f"clip_{count}.mp4")
+        write_mp4(source, moving_frames(args.megapixels, count))
+        seconds, rss = timed_run(source, args.filter, os.path.join(workdir, f"out_{count}.mp4"), {})
+        print(f"| {count} | {seconds * 1000 / count:.1f} | {rss:.0f} |")
+
+
+def temporal_cases(args, workdir: str):
+    clean, noisy = zip(*moving_frames(args.megapixels, args.temporal_frames, sigma=args.sigma, seed=1))
+    source = os.path.join(workdir, "noisy.png")
+    images = [Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)) for frame in noisy]
+    images[0].save(source, format="PNG", save_all=True, append_images=images[1:], duration=40)
+
+    print(f"\n| denoise | ms / frame | mean PSNR (input {np.mean([cv2.PSNR(n, c) for n, c in zip(noisy, clean)]):.2f}) |")
+    print("| --- | ---: | ---: |")
+    for label, params in (("per frame", {}), ("temporal", {"temporal": True})):
+        output = os.path.join(workdir, f"denoised_{label.replace(' ', '_')}.png")
+        seconds, _ = timed_run(source, "denoise", output, params)
+        with Image.open(output) as im:
+            frames = [cv2.cvtColor(np.asarray(f.convert("RGB")), cv2.COLOR_RGB2BGR) for f in ImageSequence.Iterator(im)]
+        psnr = np.mean([cv2.PSNR(f, c) for f, c in zip(frames, clean)])
+        print(f"| {label} | {seconds * 1000 / len(frames):.0f} | {psnr:.2f} |")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--megapixels", type=float, default=0.3)
+    parser.add_argument("--frames", type=int, nargs="+", default=[30, 120, 480], help="clip lengths")
+    parser.add_argument("--filter", default="sharpen", help="filter for the length cases")
+    parser.add_argument("--temporal-frames", type=int, default=12)
+    parser.add_argument("--sigma", type=float, default=12, help="noise added for the temporal cases")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="enhancer-bench-") as workdir:
+        length_cases(args, workdir)
+        temporal_cases(args, workdir)
+
+
+if __name__ == "__main__":
+    main()
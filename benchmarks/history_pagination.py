@@ -0,0 +1,136 @@
+"""Benchmark /history on a large history table.
+
+Seeds a throwaway database with --rows history rows spread over --users
+users (1M rows by default), then times, for one user:
+
+- the old query: every row as an ORM entity, sorted on timestamp, with and
+  without the (user_id, timestamp, id) index;
+- the first keyset page and a page deep into the history;
+- GET /history end to end, and the 304 revalidation with If-None-Match.
+
+Run from the repository root:
+
+    python -m benchmarks.history_pagination --rows 1000000 --users 10
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CHUNK_ROWS = 50_000
+
+
+def _median_ms(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def seed(database, models, user_ids, rows):
+    from sqlalchemy import insert
+
+    start = datetime(2024, 1, 1)
+    with database.engine.begin() as conn:
+        for offset in range(0, rows, CHUNK_ROWS):
+            conn.execute(insert(models.ImageHistory), [{
+                "user_id": user_ids[i % len(user_ids)],
+                "original_filename": f"{i}_photo.jpg",
+                "enhanced_filename": f"enhanced_{i}_photo.jpg",
+                "timestamp": start + timedelta(seconds=i // 3),  # several rows per second
+            } for i in range(offset, min(offset + CHUNK_ROWS, rows))])
+
+
+async def run(rows, users, repeat):
+    import httpx
+    from backend import database, models
+    from backend.main import app
+
+    results = {}
+    # ASGITransport sends no lifespan events: run startup (tables, storage, warm-up) here
+    async with app.router.lifespan_context(app), httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        for i in range(users):
+            account = {"email": f"bench_{i}_{uuid.uuid4().hex[:6]}@example.com", "password": "benchmark", "name": "B"}
+            (await client.post("/auth/register", json=account)).raise_for_status()
+        login = await client.post("/auth/login", json={"email": account["email"], "password": "benchmark"})
+        headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+        db = database.SessionLocal()
+        user_ids = [user.id for user in db.query(models.User).all()]
+        user_id = user_ids[-1]
+        start = time.perf_counter()
+        seed(database, models, user_ids, rows)
+        print(f"Seeded {rows} rows in {time.perf_counter() - start:.1f} s", file=sys.stderr)
+
+        def legacy():
+            items = db.query(models.ImageHistory).filter(models.ImageHistory.user_id == user_id) \
+                .order_by(models.ImageHistory.timestamp.desc()).all()
+            return [{"id": item.id, "original_filename": item.original_filename,
+                     "enhanced_filename": item.enhanced_filename,
+                     "timestamp": item.timestamp.isoformat()} for item in items]
+
+        index = next(iter(models.ImageHistory.__table__.indexes))
+        index.drop(bind=database.engine)
+        results["legacy .all(), no index"] = _median_ms(legacy, repeat)
+        index.create(bind=database.engine)
+        results["legacy .all(), indexed"] = _median_ms(legacy, repeat)
+        db.close()
+
+        async def timed_get(params, extra_headers=None, expect=200):
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                response = await client.get("/history", params=params, headers={**headers, **(extra_headers or {})})
+                timings.append((time.perf_counter() - start) * 1000)
+                assert response.status_code == expect, response.status_code
+            return statistics.median(timings), response
+
+        results["GET /history first page"], first = await timed_get({"limit": 50})
+        # Walk to a deep cursor using the largest page size
+        params = {"limit": 500}
+        for _ in range(min(100, rows // users // 500 - 1)):
+            response = await client.get("/history", params=params, headers=headers)
+            params["after"] = response.headers["x-next-cursor"]
+        results["GET /history deep page"], _ = await timed_get({"limit": 50, "after": params["after"]})
+        results["GET /history 304"], _ = await timed_get(
+            {"limit": 50}, {"If-None-Match": first.headers["etag"]}, expect=304
+        )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000, help="history rows to seed")
+    parser.add_argument("--users", type=int, default=10, help="users the rows are spread over")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per case")
+    args = parser.parse_args()
+
+    # backend.database opens ./sql_app.db, so import the app from a scratch directory
+    sys.path.insert(0, REPO_ROOT)
+    workdir = tempfile.mkdtemp(prefix="enhancer-bench-")
+    try:
+        for name in ("static", "templates"):
+            os.symlink(os.path.join(REPO_ROOT, name), os.path.join(workdir, name))
+        os.chdir(workdir)
+        results = asyncio.run(run(args.rows, args.users, args.repeat))
+    finally:
+        os.chdir(REPO_ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"| Case ({args.rows // args.users} rows for the user) | median (ms) |")
+    print("| --- | ---: |")
+    for case, ms in results.items():
+        print(f"| {case} | {ms:.1f} |")
+
+
+if __name__ == "__main__":
+    main()
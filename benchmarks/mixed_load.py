@@ -0,0 +1,151 @@
+"""Benchmark cheap requests while expensive ones keep the CPU busy.
+
+Several clients keep POSTing denoise to /enhance while one client sends
+brightness requests and another polls GET /auth/me. Reports p50/p99 latency
+of the cheap requests, how many denoise requests finished, and how late a
+probe task on the event loop woke up. Runs the default executor sizing and
+per-filter limits, then an unbounded case, which approximates the old
+40-thread request pool. Each case runs in a fresh process against a
+throwaway database in a temporary directory. Run from the repository root:
+
+    python -m benchmarks.mixed_load --heavy 4 --duration 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CASES = {
+    "limited": {},
+    "unbounded": {"ENHANCE_CPU_WORKERS": "40", "ENHANCE_FILTER_CONCURRENCY": "denoise=40"},
+}
+
+
+async def _run(heavy: int, duration: float, megapixels: float):
+    import cv2
+    import httpx
+    from backend.main import app
+    from benchmarks.suite import percentile, synthetic_image
+
+    big = cv2.imencode(".jpg", synthetic_image(megapixels))[1].tobytes()
+    small = cv2.imencode(".jpg", synthetic_image(0.25))[1].tobytes()
+    async with app.router.lifespan_context(app), httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=None
+    ) as client:
+        account = {"email": f"bench_{uuid.uuid4().hex[:8]}@example.com", "password": "benchmark", "name": "B"}
+        (await client.post("/auth/register", json=account)).raise_for_status()
+        login = await client.post("/auth/login", json={"email": account["email"], "password": "benchmark"})
+        headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+        async def enhance(filter_type, data):
+            # Trailing bytes change the content hash, so no request is a result cache hit
+            body = data + f"#{uuid.uuid4().hex}".encode()
+            response = await client.post("/enhance", headers=headers, data={
+                "filter_type": filter_type, "persist": "false",
+            }, files={"file": ("bench.jpg", body, "image/jpeg")})
+            response.raise_for_status()
+
+        async def auth_me():
+            (await client.get("/auth/me", headers=headers)).raise_for_status()
+
+        # One of each first, so one-off first-request costs are not measured
+        await enhance("brightness", small)
+        await enhance("denoise", small)
+        await auth_me()
+
+        deadline = time.perf_counter() + duration
+        timings = {"brightness": [], "auth_me": [], "loop_lag": []}
+        heavy_done = 0
+
+        async def heavy_client():
+            nonlocal heavy_done
+            while time.perf_counter() < deadline:
+                await enhance("denoise", big)
+                heavy_done += 1
+
+        async def timed_client(name, call):
+            # Starts once the heavy clients are under way
+            await asyncio.sleep(0.5)
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                await call()
+                timings[name].append((time.perf_counter() - start) * 1000)
+                await asyncio.sleep(0.05)
+
+        async def lag_probe():
+            # How late a 10 ms sleep wakes up
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                await asyncio.sleep(0.01)
+                timings["loop_lag"].append((time.perf_counter() - start - 0.01) * 1000)
+
+        await asyncio.gather(
+            *(heavy_client() for _ in range(heavy)),
+            timed_client("brightness", lambda: enhance("brightness", small)),
+            timed_client("auth_me", auth_me),
+            lag_probe(),
+        )
+    results = {"denoise_completed": heavy_done}
+    for name, values in timings.items():
+        results[f"{name}_ms_p50"] = percentile(values, 50)
+        results[f"{name}_ms_p99"] = percentile(values, 99)
+    return results
+
+
+def _child(args):
+    # Runs with a scratch working directory; see run_case()
+    json.dump(asyncio.run(_run(args.heavy, args.duration, args.megapixels)), sys.stdout)
+
+
+def run_case(args, env_overrides: dict):
+    # backend.main creates its database and storage directories relative to
+    # the working directory, so run it from a scratch copy
+    workdir = tempfile.mkdtemp(prefix="enhancer-bench-")
+    try:
+        for name in ("static", "templates"):
+            os.symlink(os.path.join(REPO_ROOT, name), os.path.join(workdir, name))
+        cmd = [sys.executable, "-m", "benchmarks.mixed_load", "_child", "--heavy", str(args.heavy),
+               "--duration", str(args.duration), "--megapixels", str(args.megapixels)]
+        env = {
+            **os.environ, **env_overrides,
+            "PYTHONPATH": REPO_ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""),
+        }
+        output = subprocess.run(cmd, cwd=workdir, env=env, check=True, capture_output=True, text=True).stdout
+        return json.loads(output)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("mode", nargs="?", default="run", choices=["run", "_child"], help=argparse.SUPPRESS)
+    parser.add_argument("--heavy", type=int, default=4, help="concurrent denoise clients")
+    parser.add_argument("--duration", type=float, default=20, help="seconds per case")
+    parser.add_argument("--megapixels", type=float, default=1, help="size of the denoise uploads")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+    if args.mode == "_child":
+        return _child(args)
+
+    results = {case: run_case(args, env) for case, env in CASES.items()}
+    print("| case | brightness p50 ms | brightness p99 ms | /auth/me p50 ms | /auth/me p99 ms "
+          "| denoise done | loop lag p99 ms |")
+    print("| --- | ---: | ---: | ---: | ---: | ---: | ---: |")
+    for case, r in results.items():
+        print(f"| {case} | {r['brightness_ms_p50']:.1f} | {r['brightness_ms_p99']:.1f} | {r['auth_me_ms_p50']:.1f} | "
+              f"{r['auth_me_ms_p99']:.1f} | {r['denoise_completed']} | {r['loop_lag_ms_p99']:.1f} |")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
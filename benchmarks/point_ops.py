@@ -0,0 +1,95 @@
+"""Benchmark LUT-based point operations against the original implementations.
+
+Compares increase_brightness, increase_contrast and a fused contrast/gamma
+chain with the mask-based and convertScaleAbs code they replace, checks
+that the outputs are identical and prints a Markdown table. Run from the
+repository root:
+
+    python -m benchmarks.point_ops --sizes 4 12 --repeat 10
+"""
+import argparse
+import json
+import math
+import time
+
+import cv2
+import numpy as np
+
+from backend.enhancer import increase_brightness, increase_contrast, adjust_gamma
+from backend.pipeline import parse_pipeline, run_pipeline
+
+
+def brightness_masked(image, value=30):
+    # increase_brightness before the LUT rewrite
+    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+    h, s, v = cv2.split(hsv)
+    lim = 255 - value
+    v[v > lim] = 255
+    v[v <= lim] += value
+    return cv2.cvtColor(cv2.merge((h, s, v)), cv2.COLOR_HSV2BGR)
+
+
+def chain_sequential(image):
+    image = cv2.convertScaleAbs(image, alpha=1.2, beta=10)
+    image = adjust_gamma(image, 1.4)
+    return cv2.convertScaleAbs(image, alpha=0.9, beta=0)
+
+
+CHAIN = parse_pipeline("contrast:1.2:10,gamma:1.4,contrast:0.9")
+
+# name -> (before, after)
+CASES = {
+    "brightness": (brightness_masked, increase_brightness),
+    "contrast": (lambda image: cv2.convertScaleAbs(image, alpha=1.5, beta=0), increase_contrast),
+    "contrast+gamma+contrast": (chain_sequential, lambda image: run_pipeline(image, CHAIN, reorder=False)),
+}
+
+
+def synthetic_image(megapixels: float, seed: int = 0):
+    width = int(math.sqrt(megapixels * 1_000_000 * 4 / 3))
+    height = int(width * 3 / 4)
+    return np.random.default_rng(seed).integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+
+def timed_ms(func, image, repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(image)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def run(sizes, repeat):
+    results = []
+    for megapixels in sizes:
+        image = synthetic_image(megapixels)
+        for name, (before, after) in CASES.items():
+            identical = bool(np.array_equal(before(image), after(image)))
+            before_ms = timed_ms(before, image, repeat)
+            after_ms = timed_ms(after, image, repeat)
+            results.append({"megapixels": megapixels, "operation": name, "before_ms": before_ms,
+                            "after_ms": after_ms, "speedup": before_ms / after_ms, "identical": identical})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=float, nargs="+", default=[4, 12], help="image sizes in megapixels")
+    parser.add_argument("--repeat", type=int, default=10, help="runs per case (best is kept)")
+    parser.add_argument("--json", help="also write raw results to this file")
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.repeat)
+    print("| Image | Operation | Before (ms) | After (ms) | Speedup | Identical |")
+    print("| --- | --- | --- | --- | --- | --- |")
+    for r in results:
+        print(f"| {r['megapixels']} MP | {r['operation']} | {r['before_ms']:.1f} | {r['after_ms']:.1f} | "
+              f"{r['speedup']:.2f}x | {'yes' if r['identical'] else 'no'} |")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+"""Reproducible benchmark suite for the enhancer filters and HTTP endpoints.
+
+Filter cases run every branch of apply_filter on synthetic images of
+several sizes, each in a fresh process so that peak RSS is attributable.
+HTTP cases drive /enhance and /history through an in-process ASGI client
+under concurrent load, against a throwaway database and storage directory.
+
+Run from the repository root:
+
+    python -m benchmarks.suite run --out results.json
+    python -m benchmarks.suite compare baseline.json results.json --threshold 0.10
+
+`compare` exits with status 1 when any latency metric regressed by more
+than the threshold.
+"""
+import argparse
+import asyncio
+import json
+import math
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import cv2
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Every filter usable on its own in apply_filter
+FILTERS = ['denoise', 'brightness', 'contrast', 'sharpen', 'grayscale', 'blur', 'auto', 'resize']
+
+# Metrics where larger is worse, checked by `compare`
+LATENCY_METRICS = ('filter_ms_p50', 'total_ms_p50', 'latency_ms_p50', 'latency_ms_p95')
+
+
+def synthetic_image(megapixels: float, seed: int = 0):
+    # Smooth gradients plus Gaussian noise: compresses like a photo and gives
+    # denoise real work, unlike pure random pixels
+    width = int(math.sqrt(megapixels * 1_000_000 * 4 / 3))
+    height = int(width * 3 / 4)
+    rng = np.random.default_rng(seed)
+    base = cv2.resize(rng.integers(0, 256, (48, 64, 3), dtype=np.uint8), (width, height),
+                      interpolation=cv2.INTER_CUBIC)
+    return np.clip(base + rng.normal(0, 8, base.shape), 0, 255).astype(np.uint8)
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def _rss_mb():
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+# --- Filter cases ---
+
+def _filter_case(filter_type: str, megapixels: float, repeat: int):
+    # Runs in a fresh process; see run_filter_cases()
+    from backend.enhancer import process_image, apply_filter_bytes
+
+    image = synthetic_image(megapixels)
+    data = cv2.imencode(".jpg", image)[1].tobytes()
+    params = {"width": image.shape[1] // 2} if filter_type == 'resize' else None
+    baseline_rss = _rss_mb()
+
+    filter_ms, total_ms = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        process_image(image, filter_type, params)
+        filter_ms.append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        apply_filter_bytes(data, filter_type, ".jpg", params)
+        total_ms.append((time.perf_counter() - start) * 1000)
+
+    return {
+        "filter_ms_p50": statistics.median(filter_ms),
+        "filter_ms_min": min(filter_ms),
+        "total_ms_p50": statistics.median(total_ms),
+        "megapixels_per_s": megapixels / (statistics.median(filter_ms) / 1000),
+        "peak_rss_mb": _rss_mb(),
+        "peak_rss_delta_mb": _rss_mb() - baseline_rss,
+    }
+
+
+def run_filter_cases(sizes, repeat, filters=FILTERS):
+    results = {}
+    ctx = multiprocessing.get_context("spawn")
+    for megapixels in sizes:
+        for filter_type in filters:
+            with ctx.Pool(1, maxtasksperchild=1) as pool:
+                metrics = pool.apply(_filter_case, (filter_type, megapixels, repeat))
+            case = f"filter/{filter_type}/{megapixels}MP"
+            results[case] = metrics
+            print(f"{case}: {metrics['filter_ms_p50']:.1f} ms filter, "
+                  f"{metrics['total_ms_p50']:.1f} ms with codec, {metrics['peak_rss_mb']:.0f} MB peak RSS",
+                  file=sys.stderr)
+    return results
+
+
+# --- HTTP cases ---
+
+async def _drive(client, method, url, count, concurrency, make_kwargs):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i):
+        kwargs = make_kwargs(i)
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            latencies.append((time.perf_counter() - start) * 1000)
+            response.raise_for_status()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(count)))
+    wall = time.perf_counter() - start
+    return {
+        "latency_ms_p50": percentile(latencies, 50),
+        "latency_ms_p95": percentile(latencies, 95),
+        "requests_per_s": count / wall,
+    }
+
+
+async def _http_cases(megapixels, requests, concurrency, filters):
+    import httpx
+    from backend.main import app
+
+    transport = httpx.ASGITransport(app=app)
+    # ASGITransport sends no lifespan events: run startup (tables, storage, warm-up) here
+    async with app.router.lifespan_context(app), httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        account = {"email": f"bench_{uuid.uuid4().hex[:8]}@example.com", "password": "benchmark", "name": "Bench"}
+        (await client.post("/auth/register", json=account)).raise_for_status()
+        login = await client.post("/auth/login", json={"email": account["email"], "password": account["password"]})
+        headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+        data = cv2.imencode(".jpg", synthetic_image(megapixels))[1].tobytes()
+
+        def enhance_kwargs(filter_type, unique):
+            def make_kwargs(i):
+                # Bytes after the JPEG end marker are ignored by the decoder but
+                # change the content hash, so every request misses the result cache
+                body = data + f"#{uuid.uuid4().hex}".encode() if unique else data
+                return {"headers": headers, "files": {"file": ("bench.jpg", body, "image/jpeg")},
+                        "data": {"filter_type": filter_type}}
+            return make_kwargs
+
+        results = {}
+        for filter_type in filters:
+            results[f"http/enhance/{filter_type}/{megapixels}MP"] = await _drive(
+                client, "POST", "/enhance", requests, concurrency, enhance_kwargs(filter_type, True)
+            )
+            results[f"http/enhance/{filter_type}/{megapixels}MP/cached"] = await _drive(
+                client, "POST", "/enhance", requests, concurrency, enhance_kwargs(filter_type, False)
+            )
+        results["http/history"] = await _drive(
+            client, "GET", "/history", requests, concurrency, lambda i: {"headers": headers}
+        )
+        return results
+
+
+def _http_child(args):
+    # Runs with a scratch working directory; see run_http_cases()
+    results = asyncio.run(_http_cases(args.http_megapixels, args.requests, args.concurrency, args.http_filters))
+    json.dump(results, sys.stdout)
+
+
+def run_http_cases(args):
+    # backend.main creates its database and storage directories relative to
+    # the working directory, so run it from a scratch copy
+    workdir = tempfile.mkdtemp(prefix="enhancer-bench-")
+    try:
+        for name in ("static", "templates"):
+            os.symlink(os.path.join(REPO_ROOT, name), os.path.join(workdir, name))
+        cmd = [sys.executable, "-m", "benchmarks.suite", "_http",
+               "--http-megapixels", str(args.http_megapixels), "--requests", str(args.requests),
+               "--concurrency", str(args.concurrency), "--http-filters", *args.http_filters]
+        env = {**os.environ, "PYTHONPATH": REPO_ROOT + os.pathsep + os.environ.get("PYTHONPATH", "")}
+        output = subprocess.run(cmd, cwd=workdir, env=env, check=True, capture_output=True, text=True).stdout
+        results = json.loads(output)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    for case, metrics in results.items():
+        print(f"{case}: p50 {metrics['latency_ms_p50']:.1f} ms, p95 {metrics['latency_ms_p95']:.1f} ms, "
+              f"{metrics['requests_per_s']:.1f} req/s", file=sys.stderr)
+    return results
+
+
+# --- Reporting ---
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, current, threshold):
+    """Return a list of (case, metric, before, after) that regressed."""
+    regressions = []
+    for case, metrics in current["results"].items():
+        before_metrics = baseline["results"].get(case)
+        if before_metrics is None:
+            continue
+        for metric in LATENCY_METRICS:
+            before, after = before_metrics.get(metric), metrics.get(metric)
+            if before and after and after > before * (1 + threshold):
+                regressions.append((case, metric, before, after))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="run the benchmarks and write JSON results")
+    run.add_argument("--out", default="-", help="output file (default: stdout)")
+    run.add_argument("--sizes", type=float, nargs="+", default=[0.5, 2, 8], help="filter image sizes in megapixels")
+    run.add_argument("--repeat", type=int, default=3, help="runs per filter case")
+    run.add_argument("--filters", nargs="+", default=FILTERS, help="filters to benchmark")
+    run.add_argument("--skip-http", action="store_true", help="only run the filter cases")
+    for p in (run, sub.add_parser("_http")):
+        p.add_argument("--http-megapixels", type=float, default=1.0, help="upload size for HTTP cases")
+        p.add_argument("--http-filters", nargs="+", default=['grayscale', 'sharpen'], help="filters for HTTP cases")
+        p.add_argument("--requests", type=int, default=50, help="requests per HTTP case")
+        p.add_argument("--concurrency", type=int, default=8, help="concurrent HTTP requests")
+
+    cmp = sub.add_parser("compare", help="compare two result files")
+    cmp.add_argument("baseline")
+    cmp.add_argument("current")
+    cmp.add_argument("--threshold", type=float, default=0.10, help="allowed relative slowdown (0.10 = 10%%)")
+
+    args = parser.parse_args()
+
+    if args.command == "_http":
+        _http_child(args)
+        return
+
+    if args.command == "compare":
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        regressions = compare(baseline, current, args.threshold)
+        for case, metric, before, after in regressions:
+            print(f"REGRESSION {case} {metric}: {before:.1f} -> {after:.1f} ({after / before - 1:+.0%})")
+        if not regressions:
+            print(f"No regressions above {args.threshold:.0%}")
+        sys.exit(1 if regressions else 0)
+
+    results = run_filter_cases(args.sizes, args.repeat, args.filters)
+    if not args.skip_http:
+        results.update(run_http_cases(args))
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "opencv": cv2.__version__,
+            "cpu_count": os.cpu_count(),
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+    if args.out == "-":
+        json.dump(report, sys.stdout, indent=2)
+    else:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Scaling report for parallel tiled denoise.
+
+Runs the NLM denoise filter on synthetic noisy images of several sizes,
+once untiled and then split into an increasing number of tiles processed
+in parallel, and prints the speedup of each configuration as a Markdown
+table. Run from the repository root:
+
+    python -m benchmarks.tile_scaling --sizes 4 12 48 --tiles 1 2 4 8 16 32
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from backend import tiling
+from backend.enhancer import FILTERS, denoise
+
+
+def synthetic_image(megapixels: float, seed: int = 0):
+    # Smooth gradients plus Gaussian noise, so NLM has real work to do
+    width = int(math.sqrt(megapixels * 1_000_000 * 4 / 3))
+    height = int(width * 3 / 4)
+    rng = np.random.default_rng(seed)
+    base = cv2.resize(rng.integers(0, 256, (48, 64, 3), dtype=np.uint8), (width, height),
+                      interpolation=cv2.INTER_CUBIC)
+    noise = rng.normal(0, 12, base.shape)
+    return np.clip(base + noise, 0, 255).astype(np.uint8)
+
+
+def timed(func, repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(sizes, tile_counts, repeat):
+    halo = FILTERS['denoise'].halo
+    results = []
+    for megapixels in sizes:
+        image = synthetic_image(megapixels)
+        height = image.shape[0]
+        baseline = timed(lambda: denoise(image), repeat)
+        results.append({"megapixels": megapixels, "tiles": 0, "workers": 1,
+                        "seconds": baseline, "speedup": 1.0})
+        for count in tile_counts:
+            rows = math.ceil(height / count)
+            workers = tiling.resolve_workers(count)
+            seconds = timed(lambda: tiling.process_tiled(image, denoise, halo, rows, workers), repeat)
+            results.append({"megapixels": megapixels, "tiles": count, "workers": workers,
+                            "seconds": seconds, "speedup": baseline / seconds})
+    return results
+
+
+def to_markdown(results):
+    # One row per image size, one speedup column per tile count
+    sizes = list(dict.fromkeys(r["megapixels"] for r in results))
+    counts = list(dict.fromkeys(r["tiles"] for r in results if r["tiles"]))
+    lines = [
+        "| Image | Untiled (s) | " + " | ".join(f"{c} tile{'s' if c > 1 else ''}" for c in counts) + " |",
+        "| --- | ---: | " + " | ".join("---:" for _ in counts) + " |",
+    ]
+    for megapixels in sizes:
+        row = {r["tiles"]: r for r in results if r["megapixels"] == megapixels}
+        lines.append(f"| {megapixels:g} MP | {row[0]['seconds']:.1f} | "
+                     + " | ".join(f"{row[c]['speedup']:.2f}x" for c in counts) + " |")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=float, nargs="+", default=[4, 12, 48], help="image sizes in megapixels")
+    parser.add_argument("--tiles", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32], help="tile counts to try")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per configuration (best is kept)")
+    parser.add_argument("--opencv-threads", type=int, default=1,
+                        help="OpenCV's own thread count; 1 isolates the effect of tiling")
+    parser.add_argument("--json", help="also write raw results to this file")
+    args = parser.parse_args()
+
+    cores = os.cpu_count() or 1
+    if cores < max(args.tiles):
+        print(f"warning: {cores} CPU core(s) for up to {max(args.tiles)} tiles; speedups above "
+              f"{cores}x are not possible here", file=sys.stderr)
+    cv2.setNumThreads(args.opencv_threads)
+    results = run(args.sizes, args.tiles, args.repeat)
+    machine = {"cpu_count": cores, "tile_workers": tiling.TILE_WORKERS, "opencv_threads": args.opencv_threads}
+    print(f"CPU cores: {cores}, tile pool: {tiling.TILE_WORKERS} workers, "
+          f"OpenCV threads: {args.opencv_threads}\n")
+    print(to_markdown(results))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({**machine, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
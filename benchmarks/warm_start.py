@@ -0,0 +1,108 @@
+"""Benchmark the first request after startup, with and without the warm-up.
+
+Each case starts the app in a fresh process with ENHANCE_WARMUP set to 0
+(cold) or 1 (warm), then times the first POST /enhance for one filter and a
+second one with a different upload, which shows the steady state. Startup
+time is reported too, since the warm-up moves work there. Runs against a
+throwaway database in a temporary directory. Run from the repository root:
+
+    python -m benchmarks.warm_start --megapixels 1 --json warm_start.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import cv2
+
+from benchmarks.suite import FILTERS, synthetic_image
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def _first_requests(filter_type: str, megapixels: float):
+    import httpx
+    from backend.main import app
+
+    data = cv2.imencode(".jpg", synthetic_image(megapixels))[1].tobytes()
+    start = time.perf_counter()
+    async with app.router.lifespan_context(app):
+        startup_ms = (time.perf_counter() - start) * 1000
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+            account = {"email": f"bench_{uuid.uuid4().hex[:8]}@example.com", "password": "benchmark", "name": "B"}
+            (await client.post("/auth/register", json=account)).raise_for_status()
+            login = await client.post("/auth/login", json={"email": account["email"], "password": "benchmark"})
+            headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+            timings = []
+            for _ in range(2):
+                # Trailing bytes change the content hash, so neither request is a result cache hit
+                body = data + f"#{uuid.uuid4().hex}".encode()
+                start = time.perf_counter()
+                response = await client.post("/enhance", headers=headers, data={
+                    "filter_type": filter_type, "width": "640",
+                }, files={"file": ("bench.jpg", body, "image/jpeg")})
+                timings.append((time.perf_counter() - start) * 1000)
+                response.raise_for_status()
+    return {"startup_ms": startup_ms, "first_ms": timings[0], "second_ms": timings[1]}
+
+
+def _child(args):
+    # Runs with a scratch working directory; see run_case()
+    json.dump(asyncio.run(_first_requests(args.filter, args.megapixels)), sys.stdout)
+
+
+def run_case(filter_type: str, megapixels: float, warm: bool):
+    # backend.main creates its database and storage directories relative to
+    # the working directory, so run it from a scratch copy
+    workdir = tempfile.mkdtemp(prefix="enhancer-bench-")
+    try:
+        for name in ("static", "templates"):
+            os.symlink(os.path.join(REPO_ROOT, name), os.path.join(workdir, name))
+        cmd = [sys.executable, "-m", "benchmarks.warm_start", "_child",
+               "--filter", filter_type, "--megapixels", str(megapixels)]
+        env = {
+            **os.environ,
+            "ENHANCE_WARMUP": "1" if warm else "0",
+            "PYTHONPATH": REPO_ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""),
+        }
+        output = subprocess.run(cmd, cwd=workdir, env=env, check=True, capture_output=True, text=True).stdout
+        return json.loads(output)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("mode", nargs="?", default="run", choices=["run", "_child"], help=argparse.SUPPRESS)
+    parser.add_argument("--filters", nargs="+", default=FILTERS)
+    parser.add_argument("--filter", help=argparse.SUPPRESS)
+    parser.add_argument("--megapixels", type=float, default=1)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+    if args.mode == "_child":
+        return _child(args)
+
+    results = {}
+    print("| filter | startup cold ms | startup warm ms | first cold ms | first warm ms | second ms |")
+    print("| --- | ---: | ---: | ---: | ---: | ---: |")
+    for filter_type in args.filters:
+        cold = run_case(filter_type, args.megapixels, warm=False)
+        warm = run_case(filter_type, args.megapixels, warm=True)
+        results[filter_type] = {"cold": cold, "warm": warm}
+        # The second request is warm either way; report the faster of the two runs
+        print(f"| {filter_type} | {cold['startup_ms']:.0f} | {warm['startup_ms']:.0f} | {cold['first_ms']:.1f} | "
+              f"{warm['first_ms']:.1f} | {min(cold['second_ms'], warm['second_ms']):.1f} |")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
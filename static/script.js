@@ -20,6 +20,7 @@ const resetBtn = document.getElementById('reset-btn');
 
 const toastVal = document.getElementById('toast');
 const historyGrid = document.getElementById('history-grid');
+const historyMoreBtn = document.getElementById('history-more');
 const resizeOptions = document.getElementById('resize-options');
 
 // --- AUTH CHECK ---
@@ -199,18 +200,33 @@ if (enhanceBtn) {
 }
 
 // --- HISTORY LOGIC ---
-async function loadHistory() {
+// /history is paged, newest first; X-Next-Cursor is passed back as `after`
+let historyCursor = null;
+
+if (historyMoreBtn) {
+    historyMoreBtn.addEventListener('click', () => loadHistory(historyCursor));
+}
+
+async function loadHistory(after = null) {
     if (!historyGrid) return;
 
     try {
-        const res = await fetch('/history', {
+        const url = after ? `/history?after=${encodeURIComponent(after)}` : '/history';
+        const res = await fetch(url, {
             headers: { 'Authorization': `Bearer ${token}` }
         });
         const data = await res.json();
 
-        historyGrid.innerHTML = '';
+        historyCursor = res.headers.get('X-Next-Cursor');
+        if (historyMoreBtn) {
+            historyMoreBtn.style.display = historyCursor ? 'inline-block' : 'none';
+        }
+
+        if (!after) {
+            historyGrid.innerHTML = '';
+        }
 
-        if (data.length === 0) {
+        if (data.length === 0 && !after) {
             historyGrid.innerHTML = '<p class="text-muted" style="grid-column: 1/-1; text-align: center;">No history found. Enhance an image to get started.</p>';
             return;
         }
@@ -221,7 +237,7 @@ async function loadHistory() {
             const date = new Date(item.timestamp).toLocaleDateString();
 
             card.innerHTML = `
-                <img src="/outputs/${item.enhanced_filename}" class="history-img" alt="Enhanced">
+                <img src="/outputs/${item.enhanced_filename}?w=512" class="history-img" alt="Enhanced" loading="lazy">
                 <div class="history-info">
                     <p class="history-date">${date}</p>
                     <div class="history-actions">
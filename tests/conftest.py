@@ -0,0 +1,50 @@
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# backend.main creates its database and storage directories relative to the
+# working directory, so the tests run from a scratch directory
+_workdir = tempfile.mkdtemp(prefix="enhancer-tests-")
+for _name in ("static", "templates"):
+    os.symlink(os.path.join(REPO_ROOT, _name), os.path.join(_workdir, _name))
+os.chdir(_workdir)
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_workdir}/test.db")
+os.environ.setdefault("ENHANCE_WARMUP", "0")
+# Every test signs up its own users, all from the same address
+os.environ.setdefault("AUTH_REGISTER_RATE_LIMIT_PER_MINUTE", "100000")
+os.environ.setdefault("AUTH_RATE_LIMIT_PER_MINUTE", "100000")
+sys.path.insert(0, REPO_ROOT)
+
+
+@pytest.fixture(scope="session")
+def client():
+    # One app lifespan per process: shutdown stops executors for good
+    from fastapi.testclient import TestClient
+    from backend.main import app
+
+    with TestClient(app) as client:
+        yield client
+
+
+def _new_user(client):
+    # -> (user id, auth headers) of a new account
+    account = {"email": f"test_{uuid.uuid4().hex[:8]}@example.com", "password": "password1", "name": "Test"}
+    client.post("/auth/register", json=account).raise_for_status()
+    login = client.post("/auth/login", json={"email": account["email"], "password": account["password"]})
+    headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+    return client.get("/auth/me", headers=headers).json()["id"], headers
+
+
+@pytest.fixture
+def user(client):
+    return _new_user(client)
+
+
+@pytest.fixture
+def other_user(client):
+    return _new_user(client)
@@ -0,0 +1,217 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from backend import formats, jobs, offload
+from backend.coalesce import SingleFlight
+
+
+def test_failing_leader_propagates_to_every_waiter_without_poisoning_the_key():
+    flights = SingleFlight()
+    calls = []
+
+    async def main():
+        release = asyncio.Event()
+
+        async def failing():
+            calls.append("failing")
+            await release.wait()
+            raise ValueError("boom")
+
+        waiters = [asyncio.ensure_future(flights.do_async("key", failing)) for _ in range(3)]
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(*waiters, return_exceptions=True)
+        assert all(isinstance(r, ValueError) and str(r) == "boom" for r in results)
+        assert flights.in_flight() == 0
+
+        async def working():
+            calls.append("working")
+            return b"ok"
+
+        # The key is free again: the next caller runs its own work
+        assert await flights.do_async("key", working) == b"ok"
+
+    asyncio.run(main())
+    assert calls == ["failing", "working"]
+
+
+def test_cancelled_caller_does_not_cancel_the_shared_work():
+    flights = SingleFlight()
+    finished = []
+
+    async def main():
+        release = asyncio.Event()
+
+        async def work():
+            await release.wait()
+            finished.append(True)
+            return b"result"
+
+        leader = asyncio.ensure_future(flights.do_async("key", work))
+        follower = asyncio.ensure_future(flights.do_async("key", work))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        assert await follower == b"result"
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+
+        # With every caller gone the work still runs to the end
+        release.clear()
+        alone = asyncio.ensure_future(flights.do_async("other", work))
+        await asyncio.sleep(0)
+        alone.cancel()
+        release.set()
+        for _ in range(10):
+            await asyncio.sleep(0)
+        assert flights.in_flight() == 0
+
+    asyncio.run(main())
+    assert finished == [True, True]
+
+
+def test_threads_share_one_call():
+    flights = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def work():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return b"shared"
+
+    with ThreadPoolExecutor(4) as pool:
+        leader = pool.submit(flights.do, "key", work)
+        started.wait(5)
+        followers = [pool.submit(flights.do, "key", work) for _ in range(3)]
+        # Give the followers time to join the flight before it lands
+        threading.Event().wait(0.2)
+        release.set()
+        assert [f.result(5) for f in [leader, *followers]] == [b"shared"] * 4
+    assert calls == [1]
+    assert flights.in_flight() == 0
+
+
+def test_cancelled_waiter_gives_up_its_place():
+    limit = offload.ConcurrencyLimit("test", 1, queue_size=4)
+
+    async def main():
+        await limit.acquire_async()
+        waiter = asyncio.ensure_future(limit.acquire_async())
+        await asyncio.sleep(0)
+        assert limit.stats() == {"active": 1, "waiting": 1, "limit": 1}
+        waiter.cancel()
+        await asyncio.sleep(0)
+        assert limit.stats()["waiting"] == 0
+        limit.release()
+        assert limit.stats()["active"] == 0
+
+    asyncio.run(main())
+
+
+@pytest.fixture
+def job_pool(monkeypatch):
+    # Threads instead of worker processes, and no database
+    pool = ThreadPoolExecutor(2)
+    recorded = []
+    monkeypatch.setattr(jobs, "_pool", pool)
+    monkeypatch.setattr(jobs, "_record_history", recorded.append)
+    monkeypatch.setattr(jobs, "_save_job", lambda job: None)
+    yield recorded
+    pool.shutdown(wait=True)
+
+
+def _wait(job):
+    for _ in range(500):
+        if job.finished_at is not None:
+            return
+        threading.Event().wait(0.01)
+    raise AssertionError("job did not finish")
+
+
+def test_job_followers_get_a_copy_of_the_output(job_pool, tmp_path):
+    release = threading.Event()
+    runs = []
+
+    def task(input_path, filter_type, output_path, params):
+        runs.append(output_path)
+        release.wait(5)
+        with open(output_path, "wb") as f:
+            f.write(b"enhanced")
+
+    stored = []
+    submit = lambda name: jobs.submit_job(
+        1, str(tmp_path / "in.jpg"), "sharpen", str(tmp_path / name), task=task, key="key",
+        on_success=lambda job: stored.append(job.output_filename)
+    )
+    leader, follower = submit("a.jpg"), submit("b.jpg")
+    release.set()
+    _wait(leader), _wait(follower)
+
+    assert len(runs) == 1
+    assert leader.error is None and follower.error is None
+    assert (tmp_path / "b.jpg").read_bytes() == b"enhanced"
+    assert sorted(stored) == ["a.jpg", "b.jpg"]
+    assert sorted(job.output_filename for job in job_pool) == ["a.jpg", "b.jpg"]
+
+
+def test_job_followers_fail_with_the_leader(job_pool, tmp_path):
+    release = threading.Event()
+
+    def task(input_path, filter_type, output_path, params):
+        release.wait(5)
+        raise ValueError("Could not load image")
+
+    submit = lambda name: jobs.submit_job(1, str(tmp_path / "in.jpg"), "sharpen", str(tmp_path / name),
+                                          task=task, key="failing")
+    leader, follower = submit("a.jpg"), submit("b.jpg")
+    release.set()
+    _wait(leader), _wait(follower)
+
+    assert leader.error == follower.error == "Could not load image"
+    assert job_pool == []
+    # Not poisoned: a later job with the same key runs on its own
+    later = jobs.submit_job(1, str(tmp_path / "in.jpg"), "sharpen", str(tmp_path / "c.jpg"),
+                            task=lambda *args: None, key="failing")
+    _wait(later)
+    assert later.error is None
+
+
+def test_followers_report_the_leaders_auto_plan(client):
+    from backend import main, metrics
+
+    started, release = threading.Event(), threading.Event()
+    calls = []
+    plan = object()
+
+    def process_bytes(data, filter_type, ext, params=None, timer=metrics.NULL_TIMER):
+        calls.append(1)
+        with timer.stage("analysis"):
+            timer.auto_plan = plan
+        started.set()
+        release.wait(5)
+        return b"enhanced"
+
+    def enhance(timer):
+        return main._enhance_bytes(
+            b"same upload " + b"x" * 16, "auto", ["auto"], process_bytes, formats.OutputOptions(), {}, {}, timer
+        )
+
+    leader_timer, follower_timer = metrics.StageTimer(), metrics.StageTimer()
+    with ThreadPoolExecutor(2) as pool:
+        leader = pool.submit(enhance, leader_timer)
+        started.wait(5)
+        follower = pool.submit(enhance, follower_timer)
+        threading.Event().wait(0.2)
+        release.set()
+        assert leader.result(5)[0] == follower.result(5)[0] == b"enhanced"
+
+    assert calls == [1]
+    assert follower_timer.auto_plan is plan
+    assert "coalesced" in follower_timer.stages
+    assert follower_timer.stages["analysis"] == leader_timer.stages["analysis"]
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from backend import enhancer
+from backend.enhancer import FILTERS, get_filter, process_image
+
+# Not an image: anything that reads or validates the upload would answer 415
+NOT_AN_IMAGE = ("a.jpg", b"not an image", "image/jpeg")
+
+
+def test_filters_lists_the_public_registry(client):
+    listed = {spec["name"]: spec for spec in client.get("/filters").json()}
+    assert set(listed) == {name for name, spec in FILTERS.items() if not spec.internal}
+    assert "lut" not in listed
+    assert listed["contrast"]["params"][0] == {"name": "alpha", "type": "float", "default": 1.5,
+                                               "minimum": 0, "maximum": 10, "required": False}
+
+
+@pytest.mark.parametrize("name", ["", "unknown", "lut"])
+def test_get_filter_rejects_unknown_and_internal_filters(name):
+    with pytest.raises(ValueError, match="Unknown filter"):
+        get_filter(name)
+
+
+@pytest.mark.parametrize("kwargs, message", [({"value": "bright"}, "must be an integer"),
+                                             ({"value": 300}, "between -255 and 255"),
+                                             ({"strength": 1}, "no parameter 'strength'")])
+def test_parameters_are_checked_against_their_declaration(kwargs, message):
+    with pytest.raises(ValueError, match=message):
+        get_filter("brightness").validate(kwargs)
+
+
+@pytest.mark.parametrize("name", sorted(name for name, spec in FILTERS.items() if spec.standalone))
+def test_every_standalone_filter_dispatches(name):
+    image = np.random.default_rng(0).integers(0, 256, (32, 48, 3), dtype=np.uint8)
+    result = process_image(image, name, {"width": 24})
+    assert result.dtype == np.uint8
+    assert result.shape[:2] == ((16, 24) if name == "resize" else (32, 48))
+
+
+def test_warm_up_runs_every_standalone_filter():
+    timings = enhancer.warm_up(side=16)
+    assert set(timings) == {name for name, spec in FILTERS.items() if spec.standalone} | {"codecs"}
+
+
+@pytest.mark.parametrize("route", ["/enhance", "/enhance?async=1", "/enhance/preview"])
+@pytest.mark.parametrize("data, detail", [
+    ({"filter_type": "unknown"}, "Unknown filter 'unknown'"),
+    ({"filters": "sharpen,unknown"}, "Unknown filter 'unknown'"),
+    ({"filter_type": "gamma"}, "needs arguments; use filters=gamma:<gamma>"),
+    ({"filters": "contrast:99"}, "alpha must be between 0 and 10"),
+    ({}, "Either filter_type or filters is required"),
+])
+def test_bad_filters_get_400_before_the_upload_is_read(client, user, route, data, detail):
+    _, headers = user
+    response = client.post(route, headers=headers, files={"file": NOT_AN_IMAGE}, data=data)
+    assert response.status_code == 400
+    assert detail in response.json()["detail"]
+
+
+def test_batch_rejects_unknown_filters(client, user):
+    _, headers = user
+    response = client.post("/enhance/batch", headers=headers, files=[("files", NOT_AN_IMAGE)],
+                           data={"filter_type": "unknown"})
+    assert response.status_code == 400
@@ -0,0 +1,92 @@
+import cv2
+import numpy as np
+import pytest
+
+from backend import formats
+
+
+@pytest.mark.parametrize("accept, expected", [
+    (None, None),
+    ("*/*", None),
+    ("image/*", None),
+    ("text/html,image/webp,*/*;q=0.8", "webp"),
+    ("image/png;q=0.5, image/jpeg;q=0.9", "jpeg"),
+    ("image/webp, image/png", "webp"),
+    ("image/webp;q=0, image/png", "png"),
+    ("image/webp;q=abc, image/jpeg;q=0.1", "jpeg"),
+    ("image/gif", None),
+])
+def test_negotiate_prefers_quality_then_smaller_formats(accept, expected):
+    assert formats.negotiate(accept) == expected
+
+
+def test_equally_acceptable_types_pick_the_smallest_format():
+    accept = ", ".join(media_type for _, media_type in formats.FORMATS.values())
+    assert formats.negotiate(accept) == ("avif" if "avif" in formats.FORMATS else "webp")
+
+
+def test_explicit_format_beats_accept_which_beats_the_upload():
+    assert formats.resolve_output(".png", "jpg", "image/webp").format == "jpeg"
+    assert formats.resolve_output(".png", None, "image/webp").format == "webp"
+    assert formats.resolve_output(".png", None, "*/*").format == "png"
+    assert formats.resolve_output(".bmp").format == "jpeg"
+
+
+@pytest.mark.parametrize("kwargs", [{"output_format": "tiff"}, {"quality": 0}, {"quality": 101},
+                                    {"png_compression": 10}])
+def test_invalid_settings_are_rejected(kwargs):
+    with pytest.raises(ValueError):
+        formats.resolve_output(".jpg", **kwargs)
+
+
+def test_encoder_settings_split_the_cache_key():
+    keys = {str(sorted(formats.OutputOptions(**kwargs).key_params().items())) for kwargs in
+            [{}, {"quality": 70}, {"progressive": True}, {"optimize": True}, {"format": "png"},
+             {"format": "png", "png_compression": 9}]}
+    assert len(keys) == 6
+
+
+def _upload():
+    image = np.random.default_rng(0).integers(0, 256, (48, 64, 3), dtype=np.uint8)
+    return cv2.imencode(".png", image)[1].tobytes()
+
+
+def _vary(response):
+    # CORS adds Origin
+    return [item.strip() for item in response.headers.get("vary", "").split(",")]
+
+
+def _enhance(client, headers, accept=None, **data):
+    request_headers = {**headers, **({"Accept": accept} if accept else {})}
+    return client.post("/enhance", headers=request_headers, files={"file": ("a.png", _upload(), "image/png")},
+                       data={"filter_type": "sharpen", "persist": "false", **data})
+
+
+def test_enhance_negotiates_from_accept(client, user):
+    _, headers = user
+    response = _enhance(client, headers, accept="image/webp,image/png;q=0.5")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/webp"
+    assert "Accept" in _vary(response)
+    assert response.content[8:12] == b"WEBP"
+
+
+def test_enhance_output_format_overrides_accept(client, user):
+    _, headers = user
+    response = _enhance(client, headers, accept="image/webp", output_format="jpeg", quality="60", progressive="true")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/jpeg"
+    assert "Accept" not in _vary(response)
+    # Progressive JPEGs carry a SOF2 marker
+    assert b"\xff\xc2" in response.content
+
+
+def test_enhance_keeps_the_upload_format_without_a_preference(client, user):
+    _, headers = user
+    response = _enhance(client, headers)
+    assert response.headers["content-type"] == "image/png"
+
+
+def test_enhance_rejects_unknown_formats(client, user):
+    _, headers = user
+    assert _enhance(client, headers, output_format="tiff").status_code == 400
@@ -0,0 +1,115 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import exc, insert, select
+
+from backend import database, history, models
+
+
+def _seed(user_id, timestamps):
+    with database.engine.begin() as conn:
+        conn.execute(insert(models.ImageHistory), [
+            {"user_id": user_id, "original_filename": f"in_{i}.jpg", "enhanced_filename": f"out_{i}.jpg",
+             "timestamp": timestamp}
+            for i, timestamp in enumerate(timestamps)
+        ])
+
+
+def _walk(client, headers, limit):
+    # -> (ids in page order, number of pages)
+    ids, pages, params = [], 0, {"limit": limit}
+    while True:
+        response = client.get("/history", headers=headers, params=params)
+        assert response.status_code == 200
+        ids += [item["id"] for item in response.json()]
+        pages += 1
+        cursor = response.headers.get("x-next-cursor")
+        if cursor is None:
+            return ids, pages
+        params = {"limit": limit, "after": cursor}
+
+
+def test_cursor_pages_across_equal_timestamps(client, user):
+    user_id, headers = user
+    start = datetime(2026, 1, 1, 12, 0, 0)
+    # Runs of rows sharing a timestamp, split across page boundaries
+    _seed(user_id, [start] * 5 + [start + timedelta(seconds=1)] * 4 + [start - timedelta(seconds=1)] * 3)
+
+    everything = client.get("/history", headers=headers, params={"limit": 500}).json()
+    expected = [item["id"] for item in everything]
+    assert len(expected) == 12
+    # Newest first, newest id first within a timestamp
+    assert expected == [item["id"] for item in sorted(everything, key=lambda i: (i["timestamp"], i["id"]), reverse=True)]
+
+    for limit in (1, 2, 3, 4, 5):
+        ids, pages = _walk(client, headers, limit)
+        assert ids == expected
+        assert pages == -(-len(expected) // limit)
+
+
+def test_cursor_rejects_garbage(client, user):
+    _, headers = user
+    response = client.get("/history", headers=headers, params={"after": "yesterday,1"})
+    assert response.status_code == 400
+
+
+class FlakyWriter(history.HistoryWriter):
+    # Fails the first `failures` inserts as if the database were locked
+    def __init__(self, failures, reject=()):
+        super().__init__(database.engine, flush_ms=10)
+        self.failures = failures
+        self.reject = set(reject)
+
+    def _insert(self, rows):
+        if self.failures:
+            self.failures -= 1
+            raise exc.OperationalError("INSERT", {}, Exception("database is locked"))
+        if any(row["original_filename"] in self.reject for row in rows):
+            raise exc.IntegrityError("INSERT", {}, Exception("constraint failed"))
+        super()._insert(rows)
+
+
+@pytest.fixture
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(history, "HISTORY_RETRY_MS", 1)
+    monkeypatch.setattr(history, "HISTORY_RETRY_MAX_MS", 4)
+
+
+def _stored(user_id):
+    with database.engine.connect() as conn:
+        return sorted(conn.execute(
+            select(models.ImageHistory.original_filename).where(models.ImageHistory.user_id == user_id)
+        ).scalars())
+
+
+def test_writer_retries_until_the_database_accepts_the_batch(client, user, fast_retries):
+    user_id, _ = user
+    writer = FlakyWriter(failures=5)
+    writer.add_many([{"user_id": user_id, "original_filename": f"in_{i}.jpg", "enhanced_filename": "out.jpg"}
+                     for i in range(3)])
+    assert writer.flush(user_id)
+    writer.close()
+    assert writer.failures == 0
+    assert _stored(user_id) == ["in_0.jpg", "in_1.jpg", "in_2.jpg"]
+
+
+def test_writer_drops_only_the_rejected_row(client, user, fast_retries):
+    user_id, _ = user
+    writer = FlakyWriter(failures=0, reject={"in_1.jpg"})
+    writer.add_many([{"user_id": user_id, "original_filename": f"in_{i}.jpg", "enhanced_filename": "out.jpg"}
+                     for i in range(3)])
+    assert writer.flush(user_id)
+    writer.close()
+    assert _stored(user_id) == ["in_0.jpg", "in_2.jpg"]
+
+
+def test_writer_keeps_rows_pending_while_the_database_is_down(client, user, fast_retries):
+    user_id, _ = user
+    dropped = history.HISTORY_ROWS_DROPPED._values.get(("shutdown",), 0)
+    writer = FlakyWriter(failures=10 ** 6)
+    writer.add(user_id, "in.jpg", "out.jpg")
+    assert not writer.flush(user_id, timeout=0.2)
+    # Given up only at shutdown, and counted
+    writer.close()
+    assert _stored(user_id) == []
+    assert history.HISTORY_ROWS_DROPPED._values[("shutdown",)] == dropped + 1
@@ -0,0 +1,67 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from backend import jobs
+
+
+@pytest.fixture
+def job_pool(client, monkeypatch):
+    # Threads instead of worker processes; job status still goes to the database
+    pool = ThreadPoolExecutor(2)
+    monkeypatch.setattr(jobs, "_pool", pool)
+    monkeypatch.setattr(jobs, "_record_history", lambda job: None)
+    yield
+    pool.shutdown(wait=True)
+
+
+def _submit(user_id, tmp_path, task):
+    return jobs.submit_job(user_id, str(tmp_path / "in.jpg"), "sharpen", str(tmp_path / "out.jpg"), task=task)
+
+
+def _forget_locally(job_id):
+    # As seen from another worker process, which never had the job in memory
+    with jobs._lock:
+        del jobs._jobs[job_id]
+
+
+def _poll(client, headers, job_id, status):
+    for _ in range(500):
+        body = client.get(f"/jobs/{job_id}", headers=headers).json()
+        if body.get("status") == status:
+            return body
+        threading.Event().wait(0.01)
+    raise AssertionError(f"job never reached {status}: {body}")
+
+
+def test_job_status_is_shared_through_the_database(client, user, job_pool, tmp_path):
+    user_id, headers = user
+    release = threading.Event()
+    job = _submit(user_id, tmp_path, lambda *args: release.wait(5))
+    _forget_locally(job.id)
+
+    assert client.get(f"/jobs/{job.id}", headers=headers).json()["status"] == jobs.QUEUED
+    release.set()
+    body = _poll(client, headers, job.id, jobs.DONE)
+    assert body["enhanced_filename"] == "out.jpg"
+
+
+def test_failed_job_is_reported_by_other_workers(client, user, job_pool, tmp_path):
+    user_id, headers = user
+
+    def task(*args):
+        raise ValueError("Could not load image")
+
+    job = _submit(user_id, tmp_path, task)
+    _forget_locally(job.id)
+    assert _poll(client, headers, job.id, jobs.FAILED)["error"] == "Could not load image"
+    assert client.get(f"/jobs/{job.id}/result", headers=headers).status_code == 500
+
+
+def test_other_users_cannot_see_the_job(client, user, other_user, job_pool, tmp_path):
+    user_id, _ = user
+    job = _submit(user_id, tmp_path, lambda *args: None)
+    _forget_locally(job.id)
+    _, headers = other_user
+    assert client.get(f"/jobs/{job.id}", headers=headers).status_code == 404
@@ -0,0 +1,25 @@
+from backend import metrics
+
+
+class _Profiled:
+    def collapsed(self):
+        return "main (main.py:1);enhance (main.py:2) 3\n"
+
+
+def test_profiles_are_served_to_their_owner_only(client, user, other_user):
+    user_id, headers = user
+    profile_id = metrics.store_profile(_Profiled(), user_id)
+
+    response = client.get(f"/metrics/profiles/{profile_id}", headers=headers)
+    assert response.status_code == 200
+    assert response.text == _Profiled().collapsed()
+    assert client.get(f"/metrics/profiles/{profile_id}", headers=other_user[1]).status_code == 404
+    assert client.get(f"/metrics/profiles/{profile_id}").status_code == 401
+
+
+def test_cache_stats_need_a_signed_in_user(client, user):
+    _, headers = user
+    assert client.get("/cache/stats").status_code == 401
+    response = client.get("/cache/stats", headers=headers)
+    assert response.status_code == 200
+    assert {"hits", "misses"} <= response.json().keys()
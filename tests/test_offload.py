@@ -0,0 +1,107 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import pytest
+
+from backend import offload
+
+
+def test_limit_serves_waiters_in_arrival_order():
+    limit = offload.ConcurrencyLimit("test", 2, queue_size=8)
+    order = []
+
+    async def main():
+        await limit.acquire_async()
+        await limit.acquire_async()
+
+        async def waiter(i):
+            await limit.acquire_async()
+            order.append(i)
+
+        waiters = [asyncio.ensure_future(waiter(i)) for i in range(4)]
+        await asyncio.sleep(0)
+        assert limit.stats() == {"active": 2, "waiting": 4, "limit": 2}
+        for _ in range(4):
+            limit.release()
+            await asyncio.sleep(0)
+        await asyncio.gather(*waiters)
+
+    asyncio.run(main())
+    assert order == [0, 1, 2, 3]
+    assert limit.stats() == {"active": 2, "waiting": 0, "limit": 2}
+
+
+def test_full_queue_is_refused():
+    limit = offload.ConcurrencyLimit("test", 1, queue_size=1)
+    rejected = offload.REJECTED._values.get(("test",), 0)
+    limit.acquire()
+    with ThreadPoolExecutor(1) as pool:
+        queued = pool.submit(limit.acquire)
+        while limit.stats()["waiting"] == 0:
+            threading.Event().wait(0.01)
+        with pytest.raises(offload.FilterBusyError):
+            limit.acquire()
+        limit.release()
+        queued.result(5)
+    assert offload.REJECTED._values[("test",)] == rejected + 1
+
+
+def test_run_holds_every_filter_slot_until_the_work_ends(monkeypatch):
+    monkeypatch.setattr(offload, "_limits", {name: offload.ConcurrencyLimit(name, 1) for name in ("a", "b")})
+    release = threading.Event()
+
+    async def main():
+        first = asyncio.ensure_future(offload.run(["a", "b"], release.wait, 5))
+        await asyncio.sleep(0.05)
+        assert offload.stats()["a"]["active"] == offload.stats()["b"]["active"] == 1
+        # The caller going away does not free the slots: the work still runs
+        first.cancel()
+        second = asyncio.ensure_future(offload.run(["b"], lambda: "ran"))
+        await asyncio.sleep(0.05)
+        assert offload.stats()["b"]["waiting"] == 1
+        release.set()
+        assert await second == "ran"
+
+    asyncio.run(main())
+    assert offload.stats()["a"] == {"active": 0, "waiting": 0, "limit": 1}
+
+
+def test_pipeline_filter_names_are_distinct_and_sorted():
+    assert offload.filter_names("sharpen,denoise,sharpen,contrast", pipeline=True) == ["contrast", "denoise", "sharpen"]
+
+
+def _enhance(client, headers, seed):
+    # A different image each time, so requests are not coalesced
+    image = np.random.default_rng(seed).integers(0, 256, (16, 16, 3), dtype=np.uint8)
+    upload = ("a.png", cv2.imencode(".png", image)[1].tobytes(), "image/png")
+    return client.post("/enhance", headers=headers, files={"file": upload},
+                       data={"filter_type": "blur", "persist": "false"})
+
+
+@pytest.fixture
+def busy_blur(monkeypatch):
+    # blur's only slot is taken; -> its limit
+    limit = offload.ConcurrencyLimit("blur", 1, queue_size=1)
+    monkeypatch.setitem(offload._limits, "blur", limit)
+    limit.acquire()
+    yield limit
+    if limit.stats()["active"]:
+        limit.release()
+
+
+def test_busy_filter_answers_429_once_its_queue_is_full(client, user, busy_blur):
+    _, headers = user
+    with ThreadPoolExecutor(1) as pool:
+        waiting = pool.submit(_enhance, client, headers, 1)
+        while busy_blur.stats()["waiting"] == 0:
+            threading.Event().wait(0.01)
+        # Other routes keep answering while the request waits for its slot
+        assert client.get("/filters").status_code == 200
+        refused = _enhance(client, headers, 2)
+        assert refused.status_code == 429
+        assert refused.headers["retry-after"] == "5"
+        busy_blur.release()
+        assert waiting.result(10).status_code == 200
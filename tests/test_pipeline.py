@@ -0,0 +1,67 @@
+import cv2
+import numpy as np
+import pytest
+
+from backend import pipeline
+from backend.pipeline import fuse_point_ops, parse_pipeline, plan_pipeline, run_pipeline
+
+
+def _image(height=60, width=80):
+    return np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+
+def _names(stages):
+    return [stage.name for stage in stages]
+
+
+def test_parse_reads_stages_and_their_arguments():
+    stages = parse_pipeline(" denoise:12, contrast:1.2 ,resize:800x ")
+    assert _names(stages) == ["denoise", "contrast", "resize"]
+    assert stages[0].kwargs == {"h": 12.0}
+    assert stages[1].kwargs["alpha"] == 1.2
+    assert stages[2].kwargs == {"width": 800}
+
+
+@pytest.mark.parametrize("spec", ["", " , ", "unknown", "contrast:abc", "resize:800", "resize:0x10",
+                                  "gamma", ",".join(["blur"] * (pipeline.MAX_STAGES + 1))])
+def test_parse_rejects_bad_specs(spec):
+    with pytest.raises(ValueError):
+        parse_pipeline(spec)
+
+
+def test_downscaling_resize_moves_ahead_of_scale_invariant_stages():
+    planned = plan_pipeline(parse_pipeline("denoise,contrast,resize:100x"), 600, 800)
+    assert _names(planned) == ["resize", "denoise", "contrast"]
+
+
+def test_resize_does_not_move_past_other_stages_or_when_upscaling():
+    # sharpen looks at neighbouring pixels, so its result depends on the scale
+    assert _names(plan_pipeline(parse_pipeline("denoise,sharpen,resize:100x"), 600, 800)) == \
+        ["denoise", "sharpen", "resize"]
+    assert _names(plan_pipeline(parse_pipeline("denoise,resize:1600x"), 600, 800)) == ["denoise", "resize"]
+
+
+def test_adjacent_point_operations_fuse_into_one_lut():
+    fused = fuse_point_ops(parse_pipeline("contrast:1.3:5,gamma:0.8,sharpen,gamma:1.2"))
+    assert _names(fused) == ["lut", "sharpen", "gamma"]
+
+
+def test_fused_pipeline_matches_the_stages_run_one_by_one():
+    image = _image()
+    spec = "contrast:1.3:5,gamma:0.8,brightness:20,gamma:1.5,contrast:0.9"
+    expected = image
+    for stage in parse_pipeline(spec):
+        expected = stage.func(expected, **stage.kwargs)
+    assert np.array_equal(run_pipeline(image, parse_pipeline(spec)), expected)
+
+
+def test_grayscale_stage_feeds_colour_stages():
+    result = run_pipeline(_image(), parse_pipeline("grayscale,brightness:10,resize:40x"))
+    assert result.shape == (30, 40, 3)
+
+
+def test_pipeline_bytes_decodes_and_encodes_once():
+    ok, data = cv2.imencode(".png", _image())
+    result = pipeline.apply_pipeline_bytes(data.tobytes(), "sharpen,resize:40x", ".png")
+    decoded = cv2.imdecode(np.frombuffer(result, np.uint8), cv2.IMREAD_COLOR)
+    assert decoded.shape == (30, 40, 3)
@@ -0,0 +1,65 @@
+import io
+
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+from backend import preview
+
+
+def _jpeg(width, height, orientation=None):
+    image = Image.fromarray(np.full((height, width, 3), 128, np.uint8))
+    exif = Image.Exif()
+    if orientation is not None:
+        exif[0x0112] = orientation
+    out = io.BytesIO()
+    image.save(out, "JPEG", exif=exif)
+    return out.getvalue()
+
+
+@pytest.mark.parametrize("orientation, size", [(None, (300, 200)), (1, (300, 200)), (3, (300, 200)),
+                                               (6, (200, 300)), (8, (200, 300))])
+def test_probe_size_follows_exif_orientation(orientation, size):
+    assert preview.probe_size(_jpeg(300, 200, orientation)) == size
+
+
+def test_proxy_fits_max_side_and_keeps_the_aspect_ratio():
+    width, height = preview.choose_proxy_size(4000, 3000, ["brightness"], max_side=1024, budget_ms=10_000)
+    assert (width, height) == (1024, 768)
+
+
+def test_proxy_shrinks_to_the_time_budget_but_not_below_the_minimum():
+    per_mp = preview.estimate_cost_ms(["denoise"], 1.0)
+    width, height = preview.choose_proxy_size(4000, 3000, ["denoise"], max_side=4096, budget_ms=per_mp)
+    # One megapixel's worth of filter time
+    assert abs(width * height - 1_000_000) < 5_000
+    tiny = preview.choose_proxy_size(4000, 3000, ["denoise"], max_side=4096, budget_ms=0.001)
+    assert max(tiny) == preview.PREVIEW_MIN_SIDE
+
+
+def test_small_images_are_not_upscaled():
+    assert preview.choose_proxy_size(100, 80, ["brightness"], max_side=1024, budget_ms=150) == (100, 80)
+
+
+def test_preview_renders_a_rotated_proxy(client, user):
+    _, headers = user
+    response = client.post(
+        "/enhance/preview", headers=headers, files={"file": ("a.jpg", _jpeg(1200, 800, orientation=6), "image/jpeg")},
+        data={"filter_type": "brightness", "max_side": 300, "budget_ms": 1000}
+    )
+    assert response.status_code == 200
+    assert (response.headers["x-preview-width"], response.headers["x-preview-height"]) == ("200", "300")
+    decoded = cv2.imdecode(np.frombuffer(response.content, np.uint8), cv2.IMREAD_COLOR)
+    assert decoded.shape[:2] == (300, 200)
+
+
+@pytest.mark.parametrize("field, value", [("budget_ms", 0), ("budget_ms", -5), ("budget_ms", 10 ** 6),
+                                          ("max_side", 0), ("max_side", -1), ("max_side", 10 ** 6)])
+def test_preview_rejects_out_of_range_settings(client, user, field, value):
+    _, headers = user
+    response = client.post(
+        "/enhance/preview", headers=headers, files={"file": ("a.jpg", _jpeg(64, 64), "image/jpeg")},
+        data={"filter_type": "brightness", field: value}
+    )
+    assert response.status_code == 422
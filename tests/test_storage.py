@@ -0,0 +1,196 @@
+import hashlib
+import os
+from datetime import datetime, timedelta, timezone
+
+import cv2
+import numpy as np
+import pytest
+from sqlalchemy import create_engine, insert, select, update
+
+from backend import database, models, storage
+
+# Cutoffs in the future: everything counts as past the grace period
+PAST_GRACE = -60
+
+
+@pytest.fixture
+def store(tmp_path):
+    # A storage of its own, on a database of its own, so sweeps touch nothing else
+    engine = create_engine(f"sqlite:///{tmp_path}/storage.db")
+    models.Base.metadata.create_all(bind=engine)
+    roots = {storage.UPLOAD: str(tmp_path / "uploads"), storage.OUTPUT: str(tmp_path / "outputs")}
+    yield storage.Storage(engine, roots, user_quota_bytes=1000)
+    engine.dispose()
+
+
+def _key(data, ext=".jpg"):
+    return hashlib.sha256(data).hexdigest() + ext
+
+
+def _history(store, user_id, upload, output, timestamp=None):
+    with store.engine.begin() as conn:
+        conn.execute(insert(models.ImageHistory).values(
+            user_id=user_id, original_filename=upload, enhanced_filename=output,
+            **({"timestamp": timestamp} if timestamp else {})
+        ))
+
+
+def _names(store):
+    with store.engine.connect() as conn:
+        return sorted(conn.scalars(select(models.StoredFile.name)))
+
+
+def test_identical_files_are_stored_once(store):
+    paths = store.store(1, [(storage.OUTPUT, "a.jpg", b"same", None), (storage.OUTPUT, "b.jpg", b"same", None)])
+    assert paths["a.jpg"] == paths["b.jpg"] == store.local_path(storage.OUTPUT, "b.jpg")
+    assert paths["a.jpg"].endswith(os.path.join(*storage.shard_path(_key(b"same")).split("/")))
+    assert open(paths["a.jpg"], "rb").read() == b"same"
+    # Each name is charged to its owner, even when the content is shared
+    assert store.usage(1) == {"bytes": 8, "files": 2, "quota_bytes": 1000}
+
+
+def test_staged_files_are_taken_over(store):
+    staged = store.staging_path(storage.UPLOAD, "in.jpg")
+    with open(staged, "wb") as f:
+        f.write(b"upload")
+    store.store(1, [(storage.UPLOAD, "in.jpg", staged, None)])
+    # A second copy of the same content is dropped in favour of the stored one
+    with open(staged, "wb") as f:
+        f.write(b"upload")
+    store.store(1, [(storage.UPLOAD, "again.jpg", staged, None)])
+    assert not os.path.exists(staged)
+    assert open(store.local_path(storage.UPLOAD, "again.jpg"), "rb").read() == b"upload"
+
+
+def test_quota_counts_stored_bytes_and_honours_overrides(store):
+    store.store(1, [(storage.OUTPUT, "a.jpg", b"x" * 600, None)])
+    store.check_quota(1, 400)
+    with pytest.raises(storage.QuotaExceeded):
+        store.check_quota(1, 401)
+    # Other users have their own allowance
+    store.check_quota(2, 1000)
+    with store.engine.begin() as conn:
+        conn.execute(update(models.StorageUsage).where(models.StorageUsage.user_id == 1).values(quota_bytes=2000))
+    store.check_quota(1, 1400)
+    with pytest.raises(storage.QuotaExceeded):
+        store.check_quota(1, 1401)
+
+
+def test_global_quota_covers_every_user(store):
+    store.global_quota_bytes = 1000
+    store.store(1, [(storage.OUTPUT, "a.jpg", b"x" * 700, None)])
+    store.check_quota(2, 300)
+    with pytest.raises(storage.QuotaExceeded):
+        store.check_quota(2, 301)
+
+
+def test_sweep_keeps_referenced_files_and_deletes_the_rest(store):
+    paths = store.store(1, [
+        (storage.UPLOAD, "in.jpg", b"in", None),
+        (storage.OUTPUT, "kept.jpg", b"shared", None),
+        (storage.OUTPUT, "orphan.jpg", b"shared", None),
+        (storage.OUTPUT, "lonely.jpg", b"lonely", None),
+    ])
+    _history(store, 1, "in.jpg", "kept.jpg")
+
+    stats = store.sweep(grace_seconds=PAST_GRACE)
+    assert stats["orphaned"] == 2
+    assert _names(store) == ["in.jpg", "kept.jpg"]
+    # Content still referenced under another name survives, the rest goes
+    assert os.path.exists(paths["kept.jpg"])
+    assert not os.path.exists(paths["lonely.jpg"])
+    assert store.usage(1)["files"] == 2
+    assert store.usage(1)["bytes"] == len(b"in") + len(b"shared")
+
+
+def test_sweep_respects_the_grace_period(store):
+    paths = store.store(1, [(storage.OUTPUT, "fresh.jpg", b"fresh", None)])
+    staged = store.staging_path(storage.OUTPUT, "job.jpg")
+    open(staged, "wb").close()
+    stats = store.sweep(grace_seconds=3600)
+    assert stats["orphaned"] == stats["blobs"] == stats["staging"] == 0
+    assert os.path.exists(paths["fresh.jpg"]) and os.path.exists(staged)
+
+    assert store.sweep(grace_seconds=PAST_GRACE)["staging"] == 1
+    assert not os.path.exists(paths["fresh.jpg"]) and not os.path.exists(staged)
+
+
+def test_sweep_expires_old_files_with_their_history(store):
+    paths = store.store(1, [(storage.UPLOAD, "old_in.jpg", b"old in", None),
+                            (storage.OUTPUT, "old_out.jpg", b"old out", None),
+                            (storage.UPLOAD, "new_in.jpg", b"new in", None),
+                            (storage.OUTPUT, "new_out.jpg", b"new out", None)])
+    _history(store, 1, "old_in.jpg", "old_out.jpg")
+    _history(store, 1, "new_in.jpg", "new_out.jpg")
+    long_ago = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=40)
+    with store.engine.begin() as conn:
+        conn.execute(update(models.StoredFile).where(models.StoredFile.name.like("old_%")).values(created_at=long_ago))
+
+    stats = store.sweep(retention_days=30, grace_seconds=3600)
+    assert stats["expired"] == 2
+    assert _names(store) == ["new_in.jpg", "new_out.jpg"]
+    with store.engine.connect() as conn:
+        assert list(conn.scalars(select(models.ImageHistory.enhanced_filename))) == ["new_out.jpg"]
+    # Expired content goes once it has been unreferenced for the grace period
+    assert os.path.exists(paths["old_out.jpg"])
+    store.sweep(retention_days=30, grace_seconds=PAST_GRACE)
+    assert not os.path.exists(paths["old_out.jpg"]) and os.path.exists(paths["new_out.jpg"])
+
+
+def test_sweep_drops_history_whose_result_is_gone(store):
+    store.store(1, [(storage.UPLOAD, "in.jpg", b"in", None), (storage.OUTPUT, "out.jpg", b"out", None)])
+    _history(store, 1, "in.jpg", "out.jpg")
+    _history(store, 1, "in.jpg", "never_stored.jpg")
+    assert store.sweep(grace_seconds=PAST_GRACE)["missing"] == 1
+    with store.engine.connect() as conn:
+        assert list(conn.scalars(select(models.ImageHistory.enhanced_filename))) == ["out.jpg"]
+
+
+def test_sweep_removes_thumbnails_of_deleted_content(store):
+    paths = store.store(1, [(storage.OUTPUT, "gone.jpg", b"gone", None)])
+    thumbnails = os.path.join(store.thumbnail_dir(storage.OUTPUT), "64")
+    os.makedirs(thumbnails)
+    thumbnail = os.path.join(thumbnails, os.path.basename(paths["gone.jpg"]))
+    open(thumbnail, "wb").close()
+    assert store.sweep(grace_seconds=PAST_GRACE)["thumbnails"] == 1
+    assert not os.path.exists(thumbnail)
+
+
+def test_only_one_process_sweeps_at_a_time(store):
+    lock = storage._try_lock(os.path.join(store.roots[storage.UPLOAD], storage.GC_LOCK_FILE))
+    try:
+        assert store.sweep(grace_seconds=PAST_GRACE) is None
+    finally:
+        lock.close()
+    assert store.sweep(grace_seconds=PAST_GRACE) is not None
+
+
+def test_content_swept_while_being_stored_is_put_back(store, monkeypatch):
+    store.store(1, [(storage.OUTPUT, "first.jpg", b"content", None)])
+    store.sweep(grace_seconds=PAST_GRACE)
+    assert _names(store) == []
+    key = _key(b"content")
+    backend = store.backends[storage.OUTPUT]
+    assert not backend.exists(key)
+    # store() saw the content just before the sweep deleted it, and so skipped the put
+    exists, looks = backend.exists, []
+
+    def stale_exists(k):
+        looks.append(k)
+        return len(looks) == 1 or exists(k)
+
+    monkeypatch.setattr(backend, "exists", stale_exists)
+    paths = store.store(1, [(storage.OUTPUT, "second.jpg", b"content", None)])
+    monkeypatch.undo()
+    assert backend.exists(key)
+    assert open(paths["second.jpg"], "rb").read() == b"content"
+
+
+def test_enhance_answers_507_over_quota(client, user):
+    user_id, headers = user
+    with database.engine.begin() as conn:
+        conn.execute(insert(models.StorageUsage).values(user_id=user_id, bytes=0, files=0, quota_bytes=10))
+    upload = cv2.imencode(".png", np.zeros((8, 8, 3), np.uint8))[1].tobytes()
+    response = client.post("/enhance", headers=headers, files={"file": ("a.png", upload, "image/png")},
+                           data={"filter_type": "sharpen"})
+    assert response.status_code == 507
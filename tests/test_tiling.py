@@ -0,0 +1,77 @@
+import cv2
+import numpy as np
+import pytest
+
+from backend import enhancer, tiling
+from backend.enhancer import FILTERS, process_image
+
+# Above the memory cap below for every filter, so process_image tiles them all
+HEIGHT, WIDTH = 600, 500
+MEMORY_CAP_MB = 1
+
+
+def _photo():
+    # Smooth gradients plus noise, dim enough for auto to pick several stages
+    rng = np.random.default_rng(1)
+    base = cv2.resize(rng.integers(0, 160, (12, 10, 3), dtype=np.uint8), (WIDTH, HEIGHT),
+                      interpolation=cv2.INTER_CUBIC)
+    return np.clip(base + rng.normal(0, 10, base.shape), 0, 255).astype(np.uint8)
+
+
+TILED_FILTERS = sorted(name for name, spec in FILTERS.items() if spec.halo is not None and not spec.internal)
+# Arguments for filters that have no default
+PARAMS = {"gamma": {"gamma": 0.7}}
+
+
+@pytest.fixture
+def tile_pool(monkeypatch):
+    # Four tile workers, and parallel tiling even for this small image
+    monkeypatch.setattr(tiling, "TILE_WORKERS", 4)
+    monkeypatch.setattr(tiling, "_executor", None)
+    monkeypatch.setattr(enhancer, "PARALLEL_MIN_PIXELS", 0)
+    yield
+    if tiling._executor is not None:
+        tiling._executor.shutdown(wait=True)
+
+
+def test_every_tiled_filter_is_declared():
+    assert {"denoise", "auto", "sharpen", "blur", "brightness", "contrast", "gamma"} <= set(TILED_FILTERS)
+    assert {name for name in TILED_FILTERS if FILTERS[name].parallel} == {"denoise", "auto"}
+
+
+@pytest.mark.parametrize("name", TILED_FILTERS)
+def test_tiled_output_matches_untiled(name):
+    image = _photo()
+    spec = FILTERS[name]
+    assert tiling.should_tile(image, spec.peak_copies, MEMORY_CAP_MB)
+    params = PARAMS.get(name, {})
+    untiled = process_image(image, name, params)
+    tiled = process_image(image, name, {**params, "memory_cap_mb": MEMORY_CAP_MB})
+    assert tiled.shape == untiled.shape
+    assert np.array_equal(tiled, untiled)
+
+
+@pytest.mark.parametrize("name", [name for name in TILED_FILTERS if FILTERS[name].parallel])
+def test_parallel_tiles_match_untiled(name, tile_pool, monkeypatch):
+    image = _photo()
+    untiled = process_image(image, name, {"parallelism": 1})
+    calls = []
+
+    def spy(image, func, halo, tile_rows, workers):
+        calls.append(workers)
+        return tiling.process_tiled(image, func, halo, tile_rows, workers)
+
+    monkeypatch.setattr(enhancer, "process_tiled", spy)
+    parallel = process_image(image, name, {"parallelism": 4})
+    assert calls == [4]
+    assert np.array_equal(parallel, untiled)
+
+
+@pytest.mark.parametrize("tile_rows, halo", [(32, 13), (77, 13), (600, 13), (1, 0)])
+def test_tiles_cover_every_row_once(tile_rows, halo):
+    covered = []
+    for (y0, y1), (py0, py1) in tiling.iter_tiles(HEIGHT, tile_rows, halo):
+        assert py0 == max(y0 - halo, 0) and py1 == min(y1 + halo, HEIGHT)
+        covered.extend(range(y0, y1))
+    assert covered == list(range(HEIGHT))
+
@@ -0,0 +1,13 @@
+from backend import uploads
+
+
+def test_oversized_upload_gets_413_with_cors_headers(client, user):
+    _, headers = user
+    body = b"x" * 1024
+    response = client.post(
+        "/enhance", content=body,
+        headers={**headers, "Origin": "https://dashboard.example.com", "Content-Type": "multipart/form-data; boundary=b",
+                 "Content-Length": str(uploads.MAX_UPLOAD_BYTES * 2)},
+    )
+    assert response.status_code == 413
+    assert response.headers["access-control-allow-origin"] in ("*", "https://dashboard.example.com")
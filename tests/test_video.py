@@ -0,0 +1,142 @@
+import io
+import threading
+
+import cv2
+import numpy as np
+from PIL import Image, ImageSequence
+
+from backend import video
+from backend.enhancer import process_image
+from backend.uploads import HEADER_PROBE_BYTES
+
+
+def _frames(count=6, width=48, height=32):
+    base = np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8)
+    return [np.roll(base, 3 * i, axis=1) for i in range(count)]
+
+
+def _animation(frames, format, durations=None, **info):
+    images = [Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)) for frame in frames]
+    out = io.BytesIO()
+    images[0].save(out, format=format, save_all=True, append_images=images[1:],
+                   duration=durations or 80, **info)
+    return out.getvalue()
+
+
+def _read(data):
+    # -> (BGR frames, durations, loop)
+    with Image.open(io.BytesIO(data)) as image:
+        frames, durations = [], []
+        for frame in ImageSequence.Iterator(image):
+            frames.append(cv2.cvtColor(np.asarray(frame.convert("RGB")), cv2.COLOR_RGB2BGR))
+            durations.append(frame.info.get("duration"))
+        return frames, durations, image.info.get("loop")
+
+
+def _with_chunk_before_actl(apng, size):
+    # A large ancillary chunk between IHDR and acTL, as some encoders write text there
+    ihdr_end = len(video.PNG_SIGNATURE) + 8 + 13 + 4
+    chunk = video._png_chunk(b"tEXt", b"comment\x00" + b"x" * size)
+    return apng[:ihdr_end] + chunk + apng[ihdr_end:]
+
+
+def test_sniff_tells_clips_from_stills():
+    frames = _frames(2)
+    assert video.sniff_clip(_animation(frames, "GIF")) == video.GIF
+    assert video.sniff_clip(_animation(frames, "PNG")) == video.APNG
+    assert video.sniff_clip(cv2.imencode(".png", frames[0])[1].tobytes()) is None
+    assert video.sniff_clip(b"\x00\x00\x00\x18ftypmp42") == video.VIDEO
+    assert video.sniff_clip(b"\xff\xd8\xff\xe0") is None
+
+
+def test_clip_kind_finds_actl_behind_large_chunks(tmp_path):
+    path = tmp_path / "clip.png"
+    path.write_bytes(_with_chunk_before_actl(_animation(_frames(2), "PNG"), HEADER_PROBE_BYTES // 2))
+    assert video.clip_kind(str(path)) == video.APNG
+
+
+def test_map_ordered_keeps_order_and_bounds_read_ahead():
+    read, in_flight = [], []
+    yielded = 0
+
+    def items():
+        for i in range(40):
+            read.append(i)
+            in_flight.append(len(read) - yielded)
+            yield i
+
+    def work(i):
+        # Every fourth item is slow, so the ones after it finish first
+        threading.Event().wait(0.005 if i % 4 == 0 else 0)
+        return i * 2
+
+    results = []
+    for result in video.map_ordered(work, items(), workers=4, max_in_flight=4):
+        results.append(result)
+        yielded += 1
+    assert results == [i * 2 for i in range(40)]
+    assert max(in_flight) <= 5
+
+
+def test_temporal_windows_centre_each_frame_once():
+    frames = [(i, 10 * i) for i in range(7)]
+    windows = list(video.temporal_windows(iter(frames), radius=1))
+    assert [window[index] for window, index, _ in windows] == list(range(7))
+    assert [duration for _, _, duration in windows] == [10 * i for i in range(7)]
+    assert all(len(window) <= 3 for window, _, _ in windows)
+
+
+def test_apng_frames_are_enhanced_one_by_one_losslessly(tmp_path):
+    frames = _frames()
+    source = tmp_path / "in.png"
+    source.write_bytes(_animation(frames, "PNG", durations=[40, 60, 80, 100, 120, 140], loop=2))
+    output = tmp_path / "out.png"
+    video.enhance_clip(str(source), "sharpen", str(output))
+
+    enhanced, durations, loop = _read(output.read_bytes())
+    assert len(enhanced) == len(frames)
+    assert all(np.array_equal(got, process_image(frame, "sharpen")) for got, frame in zip(enhanced, frames))
+    assert durations == [40, 60, 80, 100, 120, 140]
+    assert loop == 2
+
+
+def test_gif_keeps_frame_count_timing_and_loop(tmp_path):
+    source = tmp_path / "in.gif"
+    source.write_bytes(_animation(_frames(), "GIF", durations=[50, 100] * 3, loop=0))
+    output = tmp_path / "out.gif"
+    video.enhance_clip(str(source), "blur", str(output))
+    enhanced, durations, loop = _read(output.read_bytes())
+    assert len(enhanced) == 6
+    assert durations == [50, 100] * 3
+    assert loop == 0
+
+
+def _post(client, headers, name, data, **form):
+    return client.post("/enhance/video", headers=headers, files={"file": (name, data, "application/octet-stream")},
+                       data={"filter_type": "sharpen", **form})
+
+
+def test_video_route_streams_gif_and_apng(client, user):
+    _, headers = user
+    frames = _frames()
+    response = _post(client, headers, "a.gif", _animation(frames, "GIF"))
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/gif"
+    assert len(_read(response.content)[0]) == len(frames)
+
+    apng = _with_chunk_before_actl(_animation(frames, "PNG"), 200_000)
+    response = _post(client, headers, "a.png", apng, filters="contrast:1.2,resize:24x")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/apng"
+    enhanced = _read(response.content)[0]
+    assert len(enhanced) == len(frames) and enhanced[0].shape == (16, 24, 3)
+
+
+def test_video_route_rejects_stills_and_long_clips(client, user, monkeypatch):
+    _, headers = user
+    frames = _frames()
+    assert _post(client, headers, "a.png", cv2.imencode(".png", frames[0])[1].tobytes()).status_code == 415
+    monkeypatch.setattr(video, "MAX_CLIP_FRAMES", 3)
+    response = _post(client, headers, "a.gif", _animation(frames, "GIF"))
+    assert response.status_code == 400
+    assert "at most 3" in response.json()["detail"]